@@ -0,0 +1,253 @@
+import os
+import imp
+import hashlib
+
+from xchipulator_cpu import Chip8CPU, IDLE_MIN_BUDGET
+from chipy8.analyser import analyse
+import headless
+
+# Bump when the generated code changes, cached modules of older versions
+# are regenerated
+AOT_VERSION = 1
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.chipy8', 'aot')
+
+# Handlers compiled to inline code. Lines are formatted with the operands
+# of the instruction; r is the register list, m the memory.
+_INLINE = {
+    '_op_mov': ['r[{X}] = {NN}'],
+    '_op_add': ['r[{X}] += {NN}', 'r[{X}] &= 0xFF'],
+    '_op_movr': ['r[{X}] = r[{Y}]'],
+    '_op_or': ['r[{X}] |= r[{Y}]'],
+    '_op_and': ['r[{X}] &= r[{Y}]'],
+    '_op_xor': ['r[{X}] ^= r[{Y}]'],
+    '_op_addr': ['r[{X}] += r[{Y}]',
+                 'if(r[{X}] > 0xFF):', '    r[{X}] &= 0xFF', '    r[0xF] = 1',
+                 'else:', '    r[0xF] = 0'],
+    '_op_sub': ['r[{X}] -= r[{Y}]',
+                'if(r[{X}] < 0x00):', '    r[{X}] &= 0xFF', '    r[0xF] = 0',
+                'else:', '    r[0xF] = 1'],
+    '_op_shr': ['r[0xF] = r[{X}] & 0x1', 'r[{X}] = r[{X}] >> 1'],
+    '_op_rsb': ['r[{X}] = r[{Y}] - r[{X}]',
+                'if(r[{X}] < 0x00):', '    r[{X}] &= 0xFF', '    r[0xF] = 0',
+                'else:', '    r[0xF] = 1'],
+    '_op_shl': ['r[0xF] = r[{X}] & 0x80', 'r[{X}] = (r[{X}] << 1) & 0xFF'],
+    '_op_mvi': ['cpu._addressRegister = {NNN}'],
+    '_op_adi': ['cpu._addressRegister += r[{X}]'],
+    '_op_nfnt': ['cpu._addressRegister = r[{X}] * 5'],
+    '_op_efnt': ['cpu._addressRegister = 0x50 + r[{X}] * 10'],
+    '_op_gdelay': ['r[{X}] = cpu._delayTimer'],
+    '_op_sdelay': ['cpu._delayTimer = r[{X}]'],
+    '_op_ssound': ['cpu._soundTimer = r[{X}]'],
+    '_op_rand': ['r[{X}] = cpu._random.randint(0x0, 0xFF) & {NN}'],
+}
+
+# Handlers that end a block by setting the PC. The PC of the instruction
+# is {PC}.
+_BRANCH = {
+    '_op_skeq': 'r[{X}] == {NN}',
+    '_op_skne': 'r[{X}] != {NN}',
+    '_op_sker': 'r[{X}] == r[{Y}]',
+    '_op_skner': 'r[{X}] != r[{Y}]',
+    '_op_skpr': 'cpu._gamepad.keyIsDown(r[{X}])',
+    '_op_skup': 'not cpu._gamepad.keyIsDown(r[{X}])',
+}
+_JUMP = {
+    '_op_jsr': ['cpu._stackPush({PC})', 'cpu._PC = {NNN}'],
+    '_op_rts': ['cpu._PC = cpu._stackPop() + 2'],
+    '_op_jmi': ['cpu._PC = {NNN} + r[0x0]'],
+}
+
+# Handlers after which a block is cut: a key wait may halt, a memory write
+# may change the code that would follow
+_CUT = set(['_op_key', '_op_bcd', '_op_str', '_op_end'])
+
+def _blocks(cpu, analysis):
+    """Yield (start, [(address, handler name, operands)]) for every block
+    of the analysis, cut after the handlers in _CUT"""
+    for block in analysis.blocks:
+        start = block.start
+        body = []
+        for address in xrange(block.start, block.end, 2):
+            entry = cpu._decode(address)
+            body.append((address, entry[0].__name__, entry[1 : ]))
+            if(entry[0].__name__ in _CUT and address + 2 < block.end):
+                yield start, body
+                start = address + 2
+                body = []
+        yield start, body
+
+def _emit(address, name, operands):
+    """Return the lines of one instruction and whether it set the PC"""
+    X, Y, N, NN, NNN = operands
+    fields = {'X': X, 'Y': Y, 'N': N, 'NN': NN, 'NNN': NNN, 'PC': address}
+    if(name == '_op_ldr'):
+        lines = ['a = cpu._addressRegister']
+        lines += ['r[%d] = m[a + %d]' % (i, i) for i in xrange(X + 1)]
+        return lines, False
+    if(name in _INLINE):
+        return [line.format(**fields) for line in _INLINE[name]], False
+    if(name in _BRANCH):
+        return ['if(%s):' % _BRANCH[name].format(**fields),
+                '    cpu._PC = %d' % (address + 4),
+                'else:',
+                '    cpu._PC = %d' % (address + 2)], True
+    if(name in _JUMP):
+        return [line.format(**fields) for line in _JUMP[name]], True
+    if(name == '_op_jmp'):
+        # A jump to itself halts the CPU, as in the handler
+        if(NNN == address):
+            return ['cpu._PC = %d' % address, 'cpu._halted = 1'], True
+        return ['cpu._PC = %d' % NNN], True
+    # Everything else runs its handler, which advances the PC itself
+    return ['cpu._PC = %d' % address,
+            'cpu._X, cpu._Y, cpu._N, cpu._NN, cpu._NNN = %d, %d, %d, %d, %d' %
+            (X, Y, N, NN, NNN),
+            'cpu.%s()' % name], True
+
+def compileROM(filename):
+    """Return the source of a Python module that runs the ROM in filename:
+    one function per basic block and BLOCKS, a dict of block start address
+    to (function, instruction count). CODE maps every compiled address to
+    the instruction word it was compiled from.
+
+    """
+    analysis = analyse(filename)
+    cpu = Chip8CPU(headless.Gamepad(), headless.Canvas(), filename)
+    lines = ['# Generated by aot_cpu.py from a ROM with md5 %s, do not edit'
+             % analysis.md5,
+             'AOT_VERSION = %d' % AOT_VERSION,
+             'MD5 = %r' % analysis.md5,
+             '']
+    blocks = []
+    code = []
+    for start, body in _blocks(cpu, analysis):
+        lines.append('def block_%03X(cpu):' % start)
+        lines.append('    r = cpu._register')
+        lines.append('    m = cpu._memory')
+        setPC = False
+        for address, name, operands in body:
+            lines.append('    # %03X %s' % (address, name[4 : ]))
+            emitted, setPC = _emit(address, name, operands)
+            lines += ['    ' + line for line in emitted]
+            code.append((address, (cpu._memory[address] << 8) |
+                         cpu._memory[address + 1]))
+        if(not setPC):
+            lines.append('    cpu._PC = %d' % (body[-1][0] + 2))
+        lines.append('')
+        blocks.append((start, len(body)))
+    lines.append('BLOCKS = {')
+    lines += ['    0x%03X: (block_%03X, %d),' % (start, start, count)
+              for start, count in blocks]
+    lines.append('}')
+    lines.append('CODE = {')
+    lines += ['    0x%03X: 0x%04X,' % entry for entry in sorted(set(code))]
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+def loadCompiled(filename, cacheDir=CACHE_DIR):
+    """Return the compiled module for the ROM in filename. The source is
+    cached in cacheDir by ROM hash and imported from there, so Python
+    keeps its bytecode next to it and later runs start at once.
+
+    """
+    fh = open(filename, 'rb')
+    md5 = hashlib.md5(fh.read()).hexdigest()
+    fh.close()
+    name = 'rom_%s' % md5
+    path = os.path.join(cacheDir, name + '.py')
+    if(os.path.exists(path)):
+        module = imp.load_source(name, path)
+        if(getattr(module, 'AOT_VERSION', None) == AOT_VERSION):
+            return module
+    if(not os.path.isdir(cacheDir)):
+        os.makedirs(cacheDir)
+    fh = open(path, 'w')
+    fh.write(compileROM(filename))
+    fh.close()
+    # Don't pick up bytecode of an older version written in the same second
+    if(os.path.exists(path + 'c')):
+        os.remove(path + 'c')
+    return imp.load_source(name, path)
+
+class AOTChip8CPU(Chip8CPU):
+    """Chip8CPU running ahead-of-time compiled blocks of its ROM.
+
+    runCycles() runs a whole compiled block whenever the PC is at the start
+    of one that fits in the remaining budget, and interprets everything
+    else (addresses the analysis didn't find, partial blocks at the end of
+    the budget). Blocks whose memory is written are dropped, so
+    self-modifying code falls back to the interpreter.
+
+    """
+    def __init__(self, gamepad, canvas, filename, seed=None,
+                 cacheDir=CACHE_DIR):
+        Chip8CPU.__init__(self, gamepad, canvas, filename, seed)
+        self._compiled = loadCompiled(filename, cacheDir)
+        self._restoreBlocks()
+
+    def _restoreBlocks(self):
+        """Use every compiled block whose code is still in memory."""
+        self._blocks = dict(self._compiled.BLOCKS)
+        # Memory address -> starts of the blocks covering it
+        self._owners = {}
+        code = self._compiled.CODE
+        for start, (function, count) in self._compiled.BLOCKS.items():
+            for address in xrange(start, start + 2 * count, 2):
+                self._owners.setdefault(address, []).append(start)
+                self._owners.setdefault(address + 1, []).append(start)
+        for address, word in code.items():
+            if((self._memory[address] << 8) | self._memory[address + 1] != word):
+                self._invalidateDecodeCache(address, 2)
+
+    def _invalidateDecodeCache(self, address, length):
+        """Drop cached decodes and compiled blocks overlapping
+        memory[address : address + length]
+
+        """
+        Chip8CPU._invalidateDecodeCache(self, address, length)
+        for i in xrange(address, address + length):
+            for start in self._owners.pop(i, ()):
+                self._blocks.pop(start, None)
+
+    def reset(self):
+        Chip8CPU.reset(self)
+        self._restoreBlocks()
+
+    def unCoreDump(self, state):
+        Chip8CPU.unCoreDump(self, state)
+        self._restoreBlocks()
+
+    def runCycles(self, count):
+        """Execute up to count instructions and return how many ran, like
+        Chip8CPU.runCycles but a compiled block at a time where possible.
+
+        """
+        if(self._halted and self._gamepad.keyCount() == 0):
+            return 0
+        blocks = self._blocks
+        nextCycle = self.nextCycle
+        skipIdle = self.skipIdle
+        remaining = count
+        while(remaining > 0):
+            PC = self._PC
+            block = blocks.get(PC)
+            if(block is None or block[1] > remaining):
+                last = PC
+                nextCycle()
+                remaining -= 1
+            else:
+                last = PC + 2 * (block[1] - 1)
+                block[0](self)
+                remaining -= block[1]
+            # A block ending in FX0A may halt after moving the PC on
+            if(self._halted):
+                break
+            # Loops close with a jump back (1NNN) or an instruction that
+            # stays put (00FD), as in Chip8CPU.runCycles
+            if(self._PC <= last and skipIdle and
+               remaining >= IDLE_MIN_BUDGET and
+               (self._PC == last or self._memory[last] >> 4 == 0x1)):
+                remaining -= self._skipIdle(remaining)
+                if(self._halted):
+                    break
+        return count - remaining
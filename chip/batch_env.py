@@ -0,0 +1,130 @@
+import numpy
+
+from xchipulator_cpu import Chip8CPU
+import headless
+
+def registerValue(index):
+    """Return an accessor reading register[index] of a Chip8CPU."""
+    def read(cpu):
+        return cpu._register[index]
+    return read
+
+def memoryValue(address, length=1):
+    """Return an accessor reading length bytes at address of a Chip8CPU as a
+    big endian number.
+
+    """
+    if(length == 1):
+        def read(cpu):
+            return cpu._memory[address]
+    else:
+        def read(cpu):
+            value = 0
+            for byte in cpu._memory[address : address + length]:
+                value = (value << 8) | byte
+            return value
+    return read
+
+def bcdValue(address, digits=3):
+    """Return an accessor reading a score stored as one decimal digit per
+    byte at address (as written by FX33) of a Chip8CPU.
+
+    """
+    def read(cpu):
+        value = 0
+        for digit in cpu._memory[address : address + digits]:
+            value = value * 10 + digit
+        return value
+    return read
+
+class BatchEnv:
+    """A batch of Chip8CPU instances running one ROM, stepped together.
+
+    Actions are 16-bit key masks, one per instance, held down for
+    frameSkip frames of cyclesPerFrame instructions. Observations are the
+    VRAM of every instance as one (count, 32, 64) uint8 array. Each
+    instance draws straight into its row of that array, so no copy is made
+    per step; pass packed=True to get (count, 32, 8) packed bits instead.
+    The reward of an instance is the change of the value returned by the
+    reward accessor (see registerValue, memoryValue and bcdValue) since
+    the previous step. An instance is done once it halts other than to
+    wait for a key.
+
+    """
+    def __init__(self, filename, count, frameSkip=4, cyclesPerFrame=10,
+                 reward=None, packed=False):
+        self.count = count
+        self.frameSkip = frameSkip
+        self.cyclesPerFrame = cyclesPerFrame
+        self.packed = packed
+        self._reward = reward
+        self._gamepads = [headless.Gamepad() for i in xrange(count)]
+        self._cpus = [Chip8CPU(gamepad, headless.Canvas(), filename)
+                      for gamepad in self._gamepads]
+
+        self._observations = numpy.zeros((count, 32, 64), numpy.uint8)
+        for i in xrange(count):
+            # Standard mode VRAM is a view into the observation array
+            self._cpus[i]._VRAMBuffers[(64, 32)] = self._observations[i]
+            self._cpus[i]._setDisplayMode(0)
+        self._values = numpy.zeros(count, numpy.int64)
+        self._rewards = numpy.zeros(count, numpy.int64)
+        self._dones = numpy.zeros(count, numpy.bool_)
+
+    def reset(self, seeds=None):
+        """Reset every instance and return the first observation. seeds
+        holds one random number generator seed per instance.
+
+        """
+        for i in xrange(self.count):
+            self._gamepads[i].setMask(0)
+            self._cpus[i].reset()
+            if(seeds is not None):
+                self._cpus[i].setSeed(seeds[i])
+            if(self._reward is not None):
+                self._values[i] = self._reward(self._cpus[i])
+        self._dones.fill(False)
+        return self.observations()
+
+    def step(self, actions):
+        """Hold down the key masks in actions for frameSkip frames on every
+        instance that isn't done. Return (observations, rewards, dones).
+
+        """
+        frames = self.frameSkip
+        cycles = self.cyclesPerFrame
+        reward = self._reward
+        for i in xrange(self.count):
+            if(self._dones[i]):
+                self._rewards[i] = 0
+                continue
+            cpu = self._cpus[i]
+            self._gamepads[i].setMask(int(actions[i]))
+            for frame in xrange(frames):
+                cpu.runCycles(cycles)
+                if(cpu.getDelayTimer() > 0):
+                    cpu.decrementDelayTimer()
+                if(cpu.getSoundTimer() > 0):
+                    cpu.decrementSoundTimer()
+            if(reward is not None):
+                value = reward(cpu)
+                self._rewards[i] = value - self._values[i]
+                self._values[i] = value
+            self._dones[i] = self._finished(cpu)
+        return self.observations(), self._rewards, self._dones
+
+    def observations(self):
+        """Return the VRAM of every instance, packed if requested."""
+        if(self.packed):
+            return numpy.packbits(self._observations, axis=2)
+        return self._observations
+
+    def _finished(self, cpu):
+        """True if cpu halted for good (00FD or a jump to itself) rather
+        than to wait for a key (FX0A).
+
+        """
+        if(not cpu.isHalted()):
+            return False
+        PC = cpu._PC
+        return not (cpu._memory[PC] >> 4 == 0xF and cpu._memory[PC + 1] == 0x0A)
@@ -0,0 +1,47 @@
+"""Measure Chip8CPU save state (coreDump / unCoreDump) latency.
+
+usage: python bench_savestate.py [-n COUNT] [-f FRAMES] ROM
+
+"""
+import sys
+import timeit
+from optparse import OptionParser
+
+from xchipulator_cpu import Chip8CPU, STATE_SIZE
+import headless
+
+def main():
+    parser = OptionParser("usage: %prog [options] ROM")
+    parser.add_option('-n', '--count', action='store', dest='count', type='int', default=10000, help='How many snapshots to take and load')
+    parser.add_option('-f', '--frames', action='store', dest='frames', type='int', default=60, help='How many frames to run before measuring')
+    (options, args) = parser.parse_args()
+    if len(args) != 1:
+        parser.error("Wrong number of arguments specified")
+
+    cpu = Chip8CPU(headless.Gamepad(), headless.Canvas(), args[0])
+    for frame in xrange(options.frames):
+        for i in xrange(10):
+            cpu.nextCycle()
+        if cpu.getDelayTimer() > 0:
+            cpu.decrementDelayTimer()
+
+    # A loaded state has to dump the same again, also after a return on an
+    # empty stack has left the stack pointer negative
+    stackPointer = cpu._stackPointer
+    for cpu._stackPointer in (stackPointer, -1):
+        state = cpu.coreDump()
+        cpu.unCoreDump(state)
+        if cpu.coreDump() != state:
+            sys.exit("State with stack pointer %d doesn't round-trip" %
+                     cpu._stackPointer)
+    cpu._stackPointer = stackPointer
+
+    state = cpu.coreDump()
+    save = timeit.timeit(cpu.coreDump, number=options.count)
+    load = timeit.timeit(lambda: cpu.unCoreDump(state), number=options.count)
+    print "state size: %d bytes" % STATE_SIZE
+    print "save: %8.2f us" % (save / options.count * 1e6)
+    print "load: %8.2f us" % (load / options.count * 1e6)
+
+if __name__ == '__main__':
+    main()
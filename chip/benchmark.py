@@ -0,0 +1,250 @@
+"""Benchmark every interpreter core on the bundled game corpus.
+
+Each core runs every ROM in chipy8/games for the same number of 60 Hz
+frames with the same scripted key presses and random seed, uncapped.
+Instructions, frames and sprite draws per second are reported per core
+and per game, along with the peak RSS of the process running the core
+(each core runs in a process of its own). Every game is run --repeat times
+and the fastest run counts, which keeps baseline comparisons steadier.
+Idle loop fast-forwarding is off unless --skip-idle is given and
+instruction fusion is off unless --fuse is given, the same for every core
+that has them. pyChip8Emu has neither, and chipy8-jit and xchipulator-aot
+run translated blocks instead of fusing.
+
+usage: python benchmark.py [options]
+
+"""
+import os
+import sys
+import json
+import time
+import resource
+import subprocess
+from optparse import OptionParser
+
+from chipy8.scheduler import Scheduler
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+GAMES = os.path.join(HERE, 'chipy8', 'games')
+PYCHIP8EMU = os.path.join(HERE, 'tutorial', 'pyChip8Emu')
+CORES = ['chipy8', 'chipy8-jit', 'xchipulator', 'xchipulator-aot', 'pyChip8Emu']
+SEED = 0
+
+def keys(frame):
+    """Scripted input: every second, hold the next key for a third of it."""
+    if(frame % 60 < 20):
+        return 1 << ((frame // 60) % 16)
+    return 0
+
+def games(directory=GAMES):
+    """Return the paths of the ROMs in directory, skipping documentation."""
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory))
+            if '.' not in name]
+
+def _counted(function, counter):
+    """Wrap function so that every call increments counter[0]."""
+    def counted(*args):
+        counter[0] += 1
+        return function(*args)
+    return counted
+
+def _runChipy8(rom, frames, ips, skipIdle, fuse, jit=False):
+    from chipy8.cpu import Cpu
+    from chipy8.translator import BlockCpu
+    if(jit):
+        cpu = BlockCpu(False, 1, True, SEED)
+    else:
+        cpu = Cpu(False, 1, True, SEED)
+    cpu.skip_idle = skipIdle
+    cpu.fuse = fuse
+    # Before read_rom so translated blocks bind the counting draw8 too
+    draws = [0]
+    cpu.video.draw8 = _counted(cpu.video.draw8, draws)
+    cpu.read_rom(rom)
+
+    scheduler = Scheduler(ips, True)
+    executed = 0
+    start = time.time()
+    for frame in xrange(frames):
+        cpu.set_keys(keys(frame))
+        executed += cpu.step(scheduler.instructions())
+        cpu.tick_timers()
+    return executed, draws[0], time.time() - start
+
+def _runXchipulator(rom, frames, ips, skipIdle, fuse, aot=False):
+    import headless
+    gamepad = headless.Gamepad()
+    if(aot):
+        # Compiling isn't timed, the module is cached after the first run
+        from aot_cpu import AOTChip8CPU
+        cpu = AOTChip8CPU(gamepad, headless.Canvas(), rom, SEED)
+    else:
+        from xchipulator_cpu import Chip8CPU
+        cpu = Chip8CPU(gamepad, headless.Canvas(), rom, SEED)
+    cpu.skipIdle = skipIdle
+    cpu.fuse = fuse
+    draws = [0]
+    # Compiled blocks call the handler by name
+    cpu._op_sprite = _counted(cpu._op_sprite, draws)
+    cpu._optable_main[0xD] = cpu._op_sprite
+
+    scheduler = Scheduler(ips, True)
+    executed = 0
+    start = time.time()
+    for frame in xrange(frames):
+        gamepad.setMask(keys(frame))
+        executed += cpu.runCycles(scheduler.instructions())
+        if(cpu.getDelayTimer() > 0):
+            cpu.decrementDelayTimer()
+        if(cpu.getSoundTimer() > 0):
+            cpu.decrementSoundTimer()
+    return executed, draws[0], time.time() - start
+
+def _runPyChip8Emu(rom, frames, ips, skipIdle, fuse):
+    # The module loads its images relative to the working directory
+    cwd = os.getcwd()
+    os.chdir(PYCHIP8EMU)
+    sys.path.insert(0, PYCHIP8EMU)
+    try:
+        import chip8
+    finally:
+        os.chdir(cwd)
+    chip8.SEED = SEED
+    emu = chip8.cpu(headless=True)
+    emu.initialize()
+    emu.load_rom(rom)
+    draws = [0]
+    emu.funcmap[0xD000] = _counted(emu.funcmap[0xD000], draws)
+
+    scheduler = Scheduler(ips, True)
+    cycle = emu.cycle
+    executed = 0
+    start = time.time()
+    for frame in xrange(frames):
+        mask = keys(frame)
+        emu.key_inputs = [(mask >> key) & 1 for key in xrange(16)]
+        count = scheduler.instructions()
+        for i in xrange(count):
+            cycle()
+        executed += count
+        emu.tick_timers()
+    return executed, draws[0], time.time() - start
+
+_RUNNERS = {
+    'chipy8': _runChipy8,
+    'chipy8-jit': lambda *args: _runChipy8(*args, jit=True),
+    'xchipulator': _runXchipulator,
+    'xchipulator-aot': lambda *args: _runXchipulator(*args, aot=True),
+    'pyChip8Emu': _runPyChip8Emu,
+}
+
+def _summary(executed, frames, draws, seconds):
+    seconds = max(seconds, 1e-9)
+    return {
+        'instructions': executed,
+        'seconds': seconds,
+        'ips': executed / seconds,
+        'fps': frames / seconds,
+        'draws_per_second': draws / seconds,
+    }
+
+def runCore(core, roms, frames, ips, repeat=1, skipIdle=False, fuse=False):
+    """Run every ROM on core in this process and return its results."""
+    runner = _RUNNERS[core]
+    results = {}
+    total = [0, 0, 0, 0.0]
+    try:
+        for rom in roms:
+            try:
+                executed, draws, seconds = \
+                    min([runner(rom, frames, ips, skipIdle, fuse)
+                         for i in xrange(repeat)],
+                        key=lambda run: run[2])
+            except ImportError:
+                raise
+            except (Exception, SystemExit), error:
+                # chipy8 exits on opcodes it doesn't implement
+                results[os.path.basename(rom)] = {'error': repr(error)}
+                continue
+            results[os.path.basename(rom)] = \
+                _summary(executed, frames, draws, seconds)
+            total[0] += executed
+            total[1] += frames
+            total[2] += draws
+            total[3] += seconds
+    except ImportError, error:
+        return {'skipped': str(error)}
+    result = _summary(*total)
+    result['games'] = results
+    # Kilobytes on Linux
+    result['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return result
+
+def runAll(cores, roms, frames, ips, repeat=1, skipIdle=False, fuse=False):
+    """Run each core in a fresh interpreter so its peak RSS is its own."""
+    results = {'frames': frames, 'ips': ips, 'skip_idle': skipIdle,
+               'fuse': fuse, 'cores': {}}
+    for core in cores:
+        command = [sys.executable, os.path.abspath(__file__), '--worker', core,
+                   '-f', str(frames), '-i', str(ips), '-r', str(repeat)] + \
+            ['--skip-idle'] * skipIdle + ['--fuse'] * fuse + roms
+        output = subprocess.check_output(command)
+        # The result is the last line, cores may print before it
+        results['cores'][core] = json.loads(output.strip().splitlines()[-1])
+    return results
+
+def report(results, baseline=None):
+    print "%-15s %12s %10s %12s %10s %9s" % \
+        ('core', 'ips', 'fps', 'draws/s', 'RSS MB', 'vs base')
+    for core in CORES:
+        result = results['cores'].get(core)
+        if(result is None):
+            continue
+        if('skipped' in result):
+            print "%-15s skipped: %s" % (core, result['skipped'])
+            continue
+        change = ''
+        if(baseline is not None):
+            base = baseline['cores'].get(core, {})
+            if(base.get('ips')):
+                change = "%+8.1f%%" % ((result['ips'] / base['ips'] - 1) * 100)
+        print "%-15s %12.0f %10.1f %12.1f %10.1f %9s" % \
+            (core, result['ips'], result['fps'], result['draws_per_second'],
+             result['peak_rss_kb'] / 1024.0, change)
+        for name, game in sorted(result['games'].items()):
+            if('error' in game):
+                print "    %-8s error: %s" % (name, game['error'])
+
+def main():
+    parser = OptionParser("usage: %prog [options] [ROM...]")
+    parser.add_option('-f', '--frames', action='store', dest='frames', type='int', default=600, help='How many frames to run each game for')
+    parser.add_option('-i', '--ips', action='store', dest='ips', type='float', default=600, help='How many instructions to execute per emulated second')
+    parser.add_option('-r', '--repeat', action='store', dest='repeat', type='int', default=3, help='Run each game this many times and keep the fastest')
+    parser.add_option('-s', '--skip-idle', action='store_true', dest='skipIdle', default=False, help='Fast-forward idle loops (pyChip8Emu has no support)')
+    parser.add_option('--fuse', action='store_true', dest='fuse', default=False, help='Run frequent instruction sequences in one dispatch (chipy8 and xchipulator cores only)')
+    parser.add_option('-c', '--core', action='append', dest='cores', choices=CORES, default=None, help='Core to benchmark (repeatable, default all)')
+    parser.add_option('-o', '--output', action='store', dest='output', default=None, help='Write the results as JSON to this file')
+    parser.add_option('-b', '--baseline', action='store', dest='baseline', default=None, help='Compare against results stored with --output')
+    parser.add_option('--worker', action='store', dest='worker', default=None, help='Run one core in this process and print its results as JSON')
+    (options, args) = parser.parse_args()
+    roms = args or games()
+
+    if(options.worker):
+        print json.dumps(runCore(options.worker, roms, options.frames,
+                                 options.ips, options.repeat,
+                                 options.skipIdle, options.fuse))
+        return
+
+    results = runAll(options.cores or CORES, roms, options.frames, options.ips,
+                     options.repeat, options.skipIdle, options.fuse)
+    baseline = None
+    if(options.baseline):
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+    report(results, baseline)
+    if(options.output):
+        with open(options.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
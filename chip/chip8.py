@@ -7,7 +7,6 @@ def main():
 	Frames = 60
 	Running = True
 	pygame.init()
-	Clock = pygame.time.Clock()
 	engine = machine.Machine()
 	screen = pygame.display.set_mode((600,200),pygame.DOUBLEBUF|pygame.HWSURFACE,0)
 	pygame.display.set_caption('Chip-8 Emulator')
@@ -25,17 +24,20 @@ def main():
 	pygame.display.flip()
 	
 
+	# One timer event per frame, the loop sleeps in event.wait() until
+	# the next frame or input instead of polling
+	pygame.time.set_timer(USEREVENT, 1000 // Frames)
 	while Running:
-		Clock.tick(60)
-		for event in pygame.event.get():
-			if event.type== pygame.QUIT:
+		event = pygame.event.wait()
+		if event.type== pygame.QUIT:
+			Running = False
+			pygame.quit()
+			return 1
+		if event.type == pygame.KEYDOWN:
+			if event.key == pygame.K_ESCAPE:
 				Running = False
 				pygame.quit()
-				return 1
-			if event.type == pygame.KEYDOWN:
-				if event.key == pygame.K_ESCAPE:
-					Running = False
-					pygame.quit()
+		if event.type == USEREVENT:
 			screen.blit(background,(0,0))
 			pygame.display.flip()
 	
@@ -0,0 +1,379 @@
+#!/usr/bin/python
+#* * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * *
+#*   chipy8 - analyser.py                                                  *
+#*   chipy8 homepage: http://code.google.com/p/chipy8/                     *
+#*   Copyright (C) 2009 olejl77@gmail.com                                  *
+#*                                                                         *
+#*   This program is free software: you can redistribute it and/or modify  *
+#*   it under the terms of the GNU General Public License as published by  *
+#*   the Free Software Foundation, either version 3 of the License, or     *
+#*   (at your option) any later version.                                   *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the          *
+#*   GNU General Public License for more details.                          *
+#*                                                                         *
+#*   You should have received a copy of the GNU General Public License     *
+#*   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+#* * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * */
+import os
+import sys
+import json
+import hashlib
+from collections import namedtuple
+from optparse import OptionParser
+from memory import MEMORY_SIZE, ROM_START, MAX_ROM_SIZE
+from tracer import disassemble
+
+# Bump when the analysis changes, cached results of older versions are redone
+VERSION = 1
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.chipy8', 'analysis')
+
+# How control leaves an instruction
+OP = 'op'               # falls through to the next one
+JUMP = 'jump'           # 1NNN
+CALL = 'call'           # 2NNN, then back to the next one
+RETURN = 'return'       # 00EE
+SKIP = 'skip'           # next one or the one after
+INDIRECT = 'indirect'   # BNNN, target depends on V0
+EXIT = 'exit'           # 00FD
+INVALID = 'invalid'     # not an instruction, so not code
+
+_MISC = set([0x07, 0x0a, 0x15, 0x18, 0x1e, 0x29, 0x30, 0x33, 0x55, 0x65,
+             0x75, 0x85])
+_ALU = set([0x0, 0x1, 0x2, 0x3, 0x4, 0x5, 0x6, 0x7, 0xe])
+
+# start, end (exclusive) and the addresses control can go to from the last
+# instruction, terminator is how it leaves (see above)
+Block = namedtuple('Block', 'start end successors terminator')
+
+def kind(word):
+    """Return how control leaves the instruction word (OP, JUMP, ...)"""
+    n1 = word >> 12
+    n4 = word & 0x0f
+    kk = word & 0xff
+    if n1 == 0x0:
+        if word == 0x00ee:
+            return RETURN
+        if word == 0x00fd:
+            return EXIT
+        if word == 0x00e0 or word & 0xfff0 == 0x00c0 or \
+           word in (0x00fb, 0x00fc, 0x00fe, 0x00ff):
+            return OP
+        return INVALID
+    if n1 == 0x1:
+        return JUMP
+    if n1 == 0x2:
+        return CALL
+    if n1 in (0x3, 0x4):
+        return SKIP
+    if n1 in (0x5, 0x9):
+        if n4 == 0x0:
+            return SKIP
+        return INVALID
+    if n1 == 0x8:
+        if n4 in _ALU:
+            return OP
+        return INVALID
+    if n1 == 0xb:
+        return INDIRECT
+    if n1 == 0xe:
+        if kk in (0x9e, 0xa1):
+            return SKIP
+        return INVALID
+    if n1 == 0xf:
+        if kk in _MISC:
+            return OP
+        return INVALID
+    return OP
+
+def _ranges(addresses):
+    """Merge sorted byte addresses into [start, end) ranges"""
+    ranges = []
+    for address in addresses:
+        if ranges and ranges[-1][1] == address:
+            ranges[-1][1] = address + 1
+        else:
+            ranges.append([address, address + 1])
+    return ranges
+
+class Analysis:
+    """Static analysis of a ROM: what is code and how it is connected.
+
+    Code is found by recursive descent from ROM_START, following jumps,
+    calls, returns and skips, so data between routines is never decoded.
+    BNNN jumps can't be followed and are listed in indirect. Writes to
+    memory by FX55 and FX33 are resolved where I was set by ANNN earlier
+    in the same block; those that hit code are self-modifying, those with
+    an unknown I are listed in unknown_writes.
+    """
+    def __init__(self, rom = None):
+        self.md5 = None
+        self.size = 0
+        self.entry = ROM_START
+        # address -> instruction word, for every instruction reached
+        self.instructions = {}
+        self.blocks = []
+        # function entry -> entries of the functions it calls
+        self.calls = {}
+        self.indirect = []
+        # addresses where decoding stopped on something that isn't code
+        self.invalid = []
+        # control transfers to addresses outside the ROM
+        self.outside = []
+        # [pc, start, end] for every memory write / read with a known I
+        self.writes = []
+        self.reads = []
+        self.unknown_writes = []
+        # [start, end) ranges of writes that land on code
+        self.self_modifying = []
+        if rom is not None:
+            self.md5 = hashlib.md5(rom).hexdigest()
+            self.size = len(rom)
+            self._analyse(bytearray(rom))
+
+    def _analyse(self, rom):
+        end = ROM_START + len(rom)
+        memory = bytearray(MEMORY_SIZE)
+        memory[ROM_START:end] = rom
+        leaders = set([ROM_START])
+        functions = set([ROM_START])
+        work = [ROM_START]
+        invalid = set()
+        outside = set()
+        while work:
+            pc = work.pop()
+            while pc not in self.instructions:
+                if pc < ROM_START or pc + 1 >= end:
+                    outside.add(pc)
+                    break
+                word = (memory[pc] << 8) | memory[pc + 1]
+                how = kind(word)
+                if how == INVALID:
+                    invalid.add(pc)
+                    break
+                self.instructions[pc] = word
+                if how == OP:
+                    pc = pc + 2
+                    continue
+                targets = self._targets(pc, word, how)
+                if how == CALL:
+                    functions.add(word & 0x0fff)
+                leaders.update(targets)
+                work.extend(targets)
+                break
+        self.invalid = sorted(invalid)
+        self.outside = sorted(outside)
+
+        for leader in sorted(leaders):
+            if leader in self.instructions:
+                self.blocks.append(self._block(leader, leaders))
+        self._memory_accesses()
+        self._call_graph(functions)
+
+    def _targets(self, pc, word, how):
+        if how == JUMP:
+            return [word & 0x0fff]
+        if how == CALL:
+            return [word & 0x0fff, pc + 2]
+        if how == SKIP:
+            return [pc + 2, pc + 4]
+        if how == INDIRECT:
+            self.indirect.append(pc)
+        return []
+
+    def _block(self, start, leaders):
+        pc = start
+        while True:
+            word = self.instructions[pc]
+            how = kind(word)
+            if how != OP:
+                return Block(start, pc + 2, self._targets(pc, word, how), how)
+            pc = pc + 2
+            if pc in leaders or pc not in self.instructions:
+                if pc in self.instructions:
+                    return Block(start, pc, [pc], OP)
+                return Block(start, pc, [], OP)
+
+    def _memory_accesses(self):
+        self.indirect.sort()
+        code = set()
+        for pc in self.instructions:
+            code.add(pc)
+            code.add(pc + 1)
+        for block in self.blocks:
+            # I is only known after an ANNN in the same block
+            I = None
+            for pc in xrange(block.start, block.end, 2):
+                word = self.instructions[pc]
+                n1 = word >> 12
+                x = (word >> 8) & 0x0f
+                n = word & 0x0f
+                kk = word & 0xff
+                access = None
+                if n1 == 0xa:
+                    I = word & 0x0fff
+                elif n1 == 0xd:
+                    # N = 0 draws a 16x16 sprite, two bytes a row
+                    access = self.reads, n or 32
+                elif n1 == 0xf and kk == 0x65:
+                    access = self.reads, x + 1
+                elif n1 == 0xf and kk == 0x55:
+                    access = self.writes, x + 1
+                elif n1 == 0xf and kk == 0x33:
+                    access = self.writes, 3
+                elif n1 == 0xf and kk in (0x1e, 0x29, 0x30):
+                    I = None
+                if access is None:
+                    continue
+                accesses, length = access
+                if I is None:
+                    if accesses is self.writes:
+                        self.unknown_writes.append(pc)
+                    continue
+                accesses.append([pc, I, I + length])
+                if accesses is self.writes and \
+                   code.intersection(xrange(I, I + length)):
+                    self.self_modifying.append([I, I + length])
+                if kk in (0x55, 0x65) and n1 == 0xf:
+                    # Some interpreters advance I past the registers
+                    I = None
+        self.self_modifying = [list(r) for r in
+                               sorted(set(map(tuple, self.self_modifying)))]
+
+    def _call_graph(self, functions):
+        blocks = dict([(block.start, block) for block in self.blocks])
+        for function in sorted(functions):
+            callees = set()
+            seen = set()
+            work = [function]
+            while work:
+                start = work.pop()
+                if start in seen or start not in blocks:
+                    continue
+                seen.add(start)
+                block = blocks[start]
+                if block.terminator == CALL:
+                    callees.add(block.successors[0])
+                    work.append(block.successors[1])
+                else:
+                    work.extend(block.successors)
+            if function in blocks:
+                self.calls[function] = sorted(callees)
+
+    def code(self):
+        """Return the [start, end) ranges of bytes that hold instructions"""
+        covered = set()
+        for pc in self.instructions:
+            covered.add(pc)
+            covered.add(pc + 1)
+        return _ranges(sorted(covered))
+
+    def data(self):
+        """Return the [start, end) ranges of ROM bytes that aren't code"""
+        covered = set()
+        for pc in self.instructions:
+            covered.add(pc)
+            covered.add(pc + 1)
+        return _ranges([address for address in
+                        xrange(ROM_START, ROM_START + self.size)
+                        if address not in covered])
+
+    def to_dict(self):
+        return {
+            'version': VERSION,
+            'md5': self.md5,
+            'size': self.size,
+            'entry': self.entry,
+            'instructions': sorted(self.instructions.items()),
+            'blocks': [list(block) for block in self.blocks],
+            'calls': sorted(self.calls.items()),
+            'indirect': self.indirect,
+            'invalid': self.invalid,
+            'outside': self.outside,
+            'writes': self.writes,
+            'reads': self.reads,
+            'unknown_writes': self.unknown_writes,
+            'self_modifying': self.self_modifying,
+            'code': self.code(),
+            'data': self.data(),
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        analysis = cls()
+        analysis.md5 = d['md5']
+        analysis.size = d['size']
+        analysis.entry = d['entry']
+        analysis.instructions = dict([(pc, word) for pc, word in d['instructions']])
+        analysis.blocks = [Block(*block) for block in d['blocks']]
+        analysis.calls = dict([(f, callees) for f, callees in d['calls']])
+        for name in ('indirect', 'invalid', 'outside', 'writes', 'reads',
+                     'unknown_writes', 'self_modifying'):
+            setattr(analysis, name, d[name])
+        return analysis
+
+def analyse(filename, cache_dir = CACHE_DIR):
+    """Return the Analysis of the ROM in filename. Results are cached as
+    JSON in cache_dir by ROM hash (None disables the cache)"""
+    with open(filename, 'rb') as f:
+        rom = f.read()
+    if len(rom) > MAX_ROM_SIZE:
+        raise ValueError("ROM is %d bytes, at most %d fit in memory" % (len(rom), MAX_ROM_SIZE))
+    if cache_dir is None:
+        return Analysis(rom)
+    path = os.path.join(cache_dir, hashlib.md5(rom).hexdigest() + '.json')
+    try:
+        with open(path) as f:
+            d = json.load(f)
+        if d['version'] == VERSION:
+            return Analysis.from_dict(d)
+    except (IOError, ValueError, KeyError):
+        pass
+    analysis = Analysis(rom)
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        with open(path, 'w') as f:
+            json.dump(analysis.to_dict(), f)
+    except (IOError, OSError):
+        # A read-only cache only costs the analysis
+        pass
+    return analysis
+
+def summary(name, analysis):
+    data = sum([end - start for start, end in analysis.data()])
+    return "%-10s %5d instr %4d blocks %3d functions %2d indirect %2d invalid " \
+           "%3d data bytes %2d self-modifying %2d unknown writes" % \
+        (name, len(analysis.instructions), len(analysis.blocks),
+         len(analysis.calls), len(analysis.indirect), len(analysis.invalid),
+         data, len(analysis.self_modifying), len(analysis.unknown_writes))
+
+def listing(analysis, out = sys.stdout):
+    """Print the code block by block with the successors of each block"""
+    for block in analysis.blocks:
+        label = "sub" if block.start in analysis.calls else "blk"
+        out.write("%s_%03X:\n" % (label, block.start))
+        for pc in xrange(block.start, block.end, 2):
+            word = analysis.instructions[pc]
+            out.write("    %03X  %04X  %s\n" % (pc, word, disassemble(word)))
+        out.write("    ; %s -> %s\n" % (block.terminator,
+                  " ".join(["%03X" % s for s in block.successors]) or "-"))
+
+if __name__ == "__main__":
+    parser = OptionParser("usage: %prog [options] ROM...")
+    parser.add_option('-l', '--listing', action='store_true', dest='listing', default=False, help='Print the code block by block')
+    parser.add_option('-j', '--json', action='store_true', dest='json', default=False, help='Print the analysis as JSON')
+    parser.add_option('-n', '--no-cache', action='store_true', dest='no_cache', default=False, help='Neither read nor write the analysis cache')
+    (options, args) = parser.parse_args()
+    if not args:
+        parser.error("No ROM given")
+    for filename in args:
+        analysis = analyse(filename, None if options.no_cache else CACHE_DIR)
+        if options.json:
+            print json.dumps(analysis.to_dict())
+        elif options.listing:
+            listing(analysis)
+        else:
+            print summary(os.path.basename(filename), analysis)
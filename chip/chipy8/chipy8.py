@@ -19,17 +19,37 @@
 #* * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * */
 import sys
 import os
+import time
+import random
+import hashlib
 from optparse import OptionParser
 from cpu import Cpu
+from memory import MAX_ROM_SIZE
+from translator import BlockCpu
+from inputlog import InputLog
+from runner import Runner
+from process import ProcessMachine
+import tracer
 
 # Options, usage and stuff...
 ver = "%prog - version 0.1"
 usage = "usage: '%prog [options] GAME'\n\n"
 usage += "chipy8 is a Chip8 emulator written in Python using pygame.\n"
 parser = OptionParser(usage, version=ver)
-parser.add_option('-v', '--verbose', action='store_true', dest='verbose', default=False, help='Print debug information')
-parser.add_option('-i', '--ips', action='store', dest='ips', type='float', default=60, help='How many instructions to execute each second')
+parser.add_option('-v', '--verbose', action='store_true', dest='verbose', default=False, help='Print debug information and the last instructions executed')
+parser.add_option('-T', '--trace', action='store', dest='trace', default=None, help='Save a trace of the last instructions executed to a file')
+parser.add_option('-i', '--ips', action='store', dest='ips', type='float', default=600, help='How many instructions to execute each second')
+parser.add_option('-t', '--turbo', action='store_true', dest='turbo', default=False, help='Run frames back to back without sleeping')
 parser.add_option('-s', '--scale', action='store', dest='scale', type='int', default=1, help='Increase the window size with the scale factor')
+parser.add_option('-H', '--headless', action='store_true', dest='headless', default=False, help='Run without display, input or clock')
+parser.add_option('-j', '--jit', action='store_true', dest='jit', default=False, help='Translate basic blocks to Python functions')
+parser.add_option('-x', '--exact', action='store_true', dest='exact', default=False, help='Execute every iteration of idle loops instead of fast-forwarding them')
+parser.add_option('-n', '--machines', action='store', dest='machines', type='int', default=1, help='Run this many copies of the game in one process, only the first one is displayed')
+parser.add_option('-p', '--process', action='store_true', dest='process', default=False, help='Run the emulation in a separate process from rendering and input')
+parser.add_option('-f', '--frames', action='store', dest='frames', type='int', default=600, help='How many frames to run in headless mode')
+parser.add_option('-r', '--seed', action='store', dest='seed', type='int', default=None, help='Seed for the random number generator')
+parser.add_option('-R', '--record', action='store', dest='record', default=None, help='Record the key presses of this session to a file')
+parser.add_option('-P', '--replay', action='store', dest='replay', default=None, help='Replay a recorded session headless at full speed')
 (options, args) = parser.parse_args()
 if len(args) != 1:
     parser.error("Wrong number of arguments specified")
@@ -37,10 +57,75 @@ else:
     if not os.path.exists(args[0]):
         parser.error("File doesn't exist")
     else:
-        if os.path.getsize(args[0]) > 0x0fff:
+        if os.path.getsize(args[0]) > MAX_ROM_SIZE:
             parser.error("File to large")
-    
-cpu = Cpu(options.verbose, options.scale)
-cpu.read_rom(args[0])
-cpu.run(options.ips)
+if options.record and (options.headless or options.replay):
+    parser.error("Only an interactive session can be recorded")
+# Input logs store the seed as a 32-bit unsigned int
+if options.seed is not None and not 0 <= options.seed < 2 ** 32:
+    parser.error("Seed must be between 0 and %d" % (2 ** 32 - 1))
 
+log = None
+if options.replay:
+    log = InputLog.load(options.replay)
+    options.seed = log.seed
+    options.headless = True
+elif options.record:
+    if options.seed is None:
+        options.seed = random.getrandbits(32)
+    log = InputLog(options.seed, options.ips)
+
+if options.machines > 1 and (options.headless or options.record):
+    parser.error("Only an interactive session can run several machines")
+
+if options.process and (options.headless or options.record or options.machines > 1
+                        or options.verbose or options.trace):
+    parser.error("--process only runs a single interactive session")
+if options.process:
+    ProcessMachine(args[0], options.ips, options.scale, options.turbo,
+                   options.seed, options.jit, options.exact).run()
+    sys.exit(0)
+
+def machine(headless, seed):
+    if options.jit:
+        cpu = BlockCpu(options.verbose, options.scale, headless, seed)
+    else:
+        cpu = Cpu(options.verbose, options.scale, headless, seed)
+    cpu.skip_idle = not options.exact
+    cpu.read_rom(args[0])
+    return cpu
+
+cpu = machine(options.headless, options.seed)
+if options.trace:
+    cpu.enable_trace()
+try:
+    if options.replay:
+        start = time.time()
+        executed = cpu.replay(log)
+        elapsed = time.time() - start
+        state = hashlib.md5(cpu._reg.tostring() + cpu._I.tostring() + cpu._PC.tostring() + cpu.framebuffer().tostring())
+        print "%d frames, %d instructions in %.2f s (%d ips)" % (log.frames, executed, elapsed, executed / max(elapsed, 1e-6))
+        print "final state %s" % state.hexdigest()
+    elif options.headless:
+        cpu.run_frames(options.frames, options.ips)
+    elif options.record:
+        cpu.record(log)
+        try:
+            cpu.run(options.ips, options.turbo)
+        finally:
+            log.save(options.record)
+    else:
+        runner = Runner(options.turbo)
+        runner.add(cpu, options.ips)
+        for i in range(1, options.machines):
+            seed = options.seed
+            if seed is not None:
+                seed = seed + i
+            runner.add(machine(True, seed), options.ips)
+        runner.run()
+finally:
+    # Written however the emulator stopped, even on an unknown opcode
+    if options.trace:
+        cpu.trace.save(options.trace)
+    elif options.verbose:
+        tracer.dump(cpu.trace.data())
@@ -24,11 +24,58 @@ import array
 import random
 from memory import Memory
 from video import Video
+from scheduler import Scheduler
+from tracer import Trace
+from idle import IdleSkipper
+from fusion import Fuser
+from dispatch import specialise
+from runner import Runner
+
+# Keyboard key -> CHIP-8 key
+KEY_MAP = {
+    pygame.K_0: 0x0, pygame.K_1: 0x1, pygame.K_2: 0x2, pygame.K_3: 0x3,
+    pygame.K_4: 0x4, pygame.K_5: 0x5, pygame.K_6: 0x6, pygame.K_7: 0x7,
+    pygame.K_8: 0x8, pygame.K_9: 0x9, pygame.K_a: 0xa, pygame.K_b: 0xb,
+    pygame.K_c: 0xc, pygame.K_d: 0xd, pygame.K_e: 0xe, pygame.K_f: 0xf,
+}
+
+def _first_execution(cpu):
+    """Table entry of a word that hasn't run yet: specialise it, store
+    its handler in the table and run it"""
+    mem = cpu.memory._memory
+    PC = cpu._PC[0]
+    word = (mem[PC] << 8) | mem[PC + 1]
+    handler = specialise(word) or Cpu._execute_chain
+    _HANDLERS[word] = handler
+    handler(cpu)
+
+# Instruction word -> handler(cpu) with the word's operands bound, shared
+# by every Cpu. Words are specialised on their first execution, so only
+# the few hundred a ROM uses are ever built.
+_HANDLERS = [_first_execution] * 0x10000
 
 class Cpu:
-    def __init__(self, verbose, scale):
+    def __init__(self, verbose, scale, headless = False, seed = None):
         #
         self._verbose = verbose
+        # Headless: no display, no event polling and no sleeping
+        self._headless = headless
+        # Random numbers for CXKK, seeded per machine so runs can be replayed
+        self._random = random.Random(seed)
+        # InputLog receiving the key mask of every frame, see record()
+        self._log = None
+        # Trace of executed instructions, see enable_trace()
+        self.trace = None
+        self._tracing = False
+        # Fast-forward idle loops in step(), see IdleSkipper
+        self.skip_idle = True
+        self._idle = IdleSkipper(self)
+        # Run frequent instruction sequences in one dispatch in step(),
+        # see Fuser
+        self.fuse = True
+        self._fuser = Fuser(self)
+        # Waiting in FX0A for a key
+        self.halted = False
         # CPU properties
         # 16 general purpose 8-bit registers
         self._reg = array.array('B', [0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0])
@@ -43,21 +90,32 @@ class Cpu:
         # Memory
         self.memory = Memory()
         # Video
-        self.video = Video(verbose, scale)
+        self.video = Video(verbose, scale, headless)
         # Key states
         self._keystate = array.array('B', [0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0])        
+        # Fused sequences are dropped when memory under them is written
+        self._write_memory = self.memory.write
+        self.memory.write = self._write_code
 
         # private properties
-        self.__ips = 60
-        self.clock = pygame.time.Clock()
+        self.__ips = 600
+        if verbose:
+            self.enable_trace()
     
     def execute(self):
+        """Execute the instruction at PC with one lookup in _HANDLERS"""
+        mem = self.memory._memory
+        PC = self._PC[0]
+        _HANDLERS[(mem[PC] << 8) | mem[PC + 1]](self)
+
+    def _execute_chain(self):
+        """Decode and execute the instruction at PC by testing its
+        nibbles in turn. Words without a specialised handler run here"""
         word = (self.memory.read(self._PC[0]) << 8) | (self.memory.read(self._PC[0] + 1))
         n1 = (word >> 12) & 0x0f
         n2 = (word >> 8) & 0x0f
         n3 = (word >> 4) & 0x0f
         n4 = word & 0x0f
-        if self._verbose: print "Opcode: %x" % (word)
         self._PC[0] = self._PC[0] + 2
         
         if n1 == 0x0:
@@ -159,7 +217,7 @@ class Cpu:
         elif n1 == 0xb: # BNNN Jump to NNN + V0
             self._PC[0] = (word & 0x0fff) + self._reg[0]
         elif n1 == 0xc: # CXKK VX = Random number AND KK
-            self._reg[n2] = random.randint(0, word & 0xff)
+            self._reg[n2] = self._random.randint(0, word & 0xff)
         elif n1 == 0xd and n4 == 0: #DXYN Draws a sprite at (VX,VY) starting at M(I). VF = collision. If N=0, draws the 16 x 16 sprite, else an 8 x N sprite.
             print "TODO: not implemented"
             sys.exit(1)
@@ -177,13 +235,16 @@ class Cpu:
         elif n1 == 0xf and n3 == 0x0 and n4 == 0x7: # FX07 VX = Delay timer
             self._reg[n2] = self._timer[0] & 0xff
         elif n1 == 0xf and n3 == 0x0 and n4 == 0xa: # FX0A Waits a keypress and stores it in VX
-            quit = False
-            while not quit:
+            if self.key_mask():
+                self.halted = False
                 for i in range(16):
                     if self._keystate[i] == 1:
                         self._reg[n2] = i
-                        quit = True
-                self.handle_input()
+            else:
+                # Halt on this instruction, step() does nothing until a
+                # key is down and FX0A runs again
+                self.halted = True
+                self._PC[0] = self._PC[0] - 2
         elif n1 == 0xf and n3 == 0x1 and n4 == 0x5: # FX15 Delay timer = VX
             self._timer[0] = self._reg[n2] & 0xff
         elif n1 == 0xf and n3 == 0x1 and n4 == 0x8: # FX18 Sound timer = VX
@@ -212,6 +273,27 @@ class Cpu:
             print "Error %1x%1x%1x%1x" % (n1,n2,n3,n4)
             sys.exit(1)
 
+    def enable_trace(self, size = 4096):
+        """Record the last size instructions in self.trace. execute is
+        swapped for a recording version, so nothing is paid while off"""
+        self.trace = Trace(size)
+        self._tracing = True
+        self.execute = self._execute_traced
+
+    def disable_trace(self):
+        """Stop recording, keeping self.trace"""
+        if self._tracing:
+            self._tracing = False
+            del self.execute
+
+    def _execute_traced(self):
+        PC = self._PC[0]
+        mem = self.memory._memory
+        self.trace.record(PC, (mem[PC] << 8) | mem[PC + 1], self._I[0], self._reg)
+        Cpu.execute(self)
+
+    def tick_timers(self):
+        """Decrement the delay and sound timers, called once per 60 Hz frame"""
         if self._timer[0] > 0:
             self._timer[0] = self._timer[0] - 1
         if self._timer[1] > 0:
@@ -219,85 +301,132 @@ class Cpu:
     
     def read_rom(self, filename):
         self.memory.read_rom(filename)
+        self._fuser.clear()
+
+    def _write_code(self, address, value):
+        self._write_memory(address, value)
+        self._fuser.invalidate(address)
+
+    def key_mask(self):
+        """Return the key states as a 16-bit mask, bit n = key n down"""
+        mask = 0
+        for i in xrange(16):
+            mask |= self._keystate[i] << i
+        return mask
+
+    def set_keys(self, mask):
+        """Set the key states from a 16-bit mask"""
+        for i in xrange(16):
+            self._keystate[i] = (mask >> i) & 1
+
+    def record(self, log):
+        """Record the key mask of every frame run() executes into log"""
+        self._log = log
 
     def handle_input(self):
-        events = pygame.event.get()
-        for event in events: 
-            if self._verbose: print event 
-            if event.type == pygame.QUIT:
-                sys.exit(0)
-            elif event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
-                sys.exit(0)
-            elif event.type == pygame.KEYDOWN and event.key == pygame.K_0:
-                self._keystate[0x0] = 1
-            elif event.type == pygame.KEYDOWN and event.key == pygame.K_1:
-                self._keystate[0x1] = 1
-            elif event.type == pygame.KEYDOWN and event.key == pygame.K_2:
-                self._keystate[0x2] = 1
-            elif event.type == pygame.KEYDOWN and event.key == pygame.K_3:
-                self._keystate[0x3] = 1
-            elif event.type == pygame.KEYDOWN and event.key == pygame.K_4:
-                self._keystate[0x4] = 1
-            elif event.type == pygame.KEYDOWN and event.key == pygame.K_5:
-                self._keystate[0x5] = 1
-            elif event.type == pygame.KEYDOWN and event.key == pygame.K_6:
-                self._keystate[0x6] = 1
-            elif event.type == pygame.KEYDOWN and event.key == pygame.K_7:
-                self._keystate[0x7] = 1
-            elif event.type == pygame.KEYDOWN and event.key == pygame.K_8:
-                self._keystate[0x8] = 1
-            elif event.type == pygame.KEYDOWN and event.key == pygame.K_9:
-                self._keystate[0x9] = 1
-            elif event.type == pygame.KEYDOWN and event.key == pygame.K_a:
-                self._keystate[0xa] = 1
-            elif event.type == pygame.KEYDOWN and event.key == pygame.K_b:
-                self._keystate[0xb] = 1
-            elif event.type == pygame.KEYDOWN and event.key == pygame.K_c:
-                self._keystate[0xc] = 1
-            elif event.type == pygame.KEYDOWN and event.key == pygame.K_d:
-                self._keystate[0xd] = 1
-            elif event.type == pygame.KEYDOWN and event.key == pygame.K_e:
-                self._keystate[0xe] = 1
-            elif event.type == pygame.KEYDOWN and event.key == pygame.K_f:
-                self._keystate[0xf] = 1
-            elif event.type == pygame.KEYDOWN and event.key == pygame.K_0:
-                self._keystate[0x0] = 0
-            elif event.type == pygame.KEYUP and event.key == pygame.K_1:
-                self._keystate[0x1] = 0
-            elif event.type == pygame.KEYUP and event.key == pygame.K_2:
-                self._keystate[0x2] = 0
-            elif event.type == pygame.KEYUP and event.key == pygame.K_3:
-                self._keystate[0x3] = 0
-            elif event.type == pygame.KEYUP and event.key == pygame.K_4:
-                self._keystate[0x4] = 0
-            elif event.type == pygame.KEYUP and event.key == pygame.K_5:
-                self._keystate[0x5] = 0
-            elif event.type == pygame.KEYUP and event.key == pygame.K_6:
-                self._keystate[0x6] = 0
-            elif event.type == pygame.KEYUP and event.key == pygame.K_7:
-                self._keystate[0x7] = 0
-            elif event.type == pygame.KEYUP and event.key == pygame.K_8:
-                self._keystate[0x8] = 0
-            elif event.type == pygame.KEYUP and event.key == pygame.K_9:
-                self._keystate[0x9] = 0
-            elif event.type == pygame.KEYUP and event.key == pygame.K_a:
-                self._keystate[0xa] = 0
-            elif event.type == pygame.KEYUP and event.key == pygame.K_b:
-                self._keystate[0xb] = 0
-            elif event.type == pygame.KEYUP and event.key == pygame.K_c:
-                self._keystate[0xc] = 0
-            elif event.type == pygame.KEYUP and event.key == pygame.K_d:
-                self._keystate[0xd] = 0
-            elif event.type == pygame.KEYUP and event.key == pygame.K_e:
-                self._keystate[0xe] = 0
-            elif event.type == pygame.KEYUP and event.key == pygame.K_f:
-                self._keystate[0xf] = 0
-            if self._verbose: print self._keystate
+        if self._headless:
+            return
+        for event in pygame.event.get():
+            self.handle_event(event)
+
+    def handle_event(self, event):
+        if event.type == pygame.QUIT:
+            sys.exit(0)
+        elif event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
+            sys.exit(0)
+        elif event.type == pygame.KEYDOWN and event.key in KEY_MAP:
+            self._keystate[KEY_MAP[event.key]] = 1
+        elif event.type == pygame.KEYUP and event.key in KEY_MAP:
+            self._keystate[KEY_MAP[event.key]] = 0
+
+    def wait_key(self):
+        """Block until a key is down, sleeping in pygame.event.wait()"""
+        while not self.key_mask():
+            self.handle_event(pygame.event.wait())
+
+    def step(self, n = 1):
+        """Execute up to n instructions as fast as possible and return how
+        many ran. A halted Cpu (FX0A without a key down) runs none. Idle
+        loops are fast-forwarded unless skip_idle is off or tracing, and
+        frequent sequences are fused unless fuse is off or tracing"""
+        if self.halted and not self.key_mask():
+            return 0
+        execute = self.execute
+        PC = self._PC
+        idle = self.skip_idle and not self._tracing and self._idle
+        if self.fuse and not self._tracing:
+            fused = self._fuser.fused
+            fuse = self._fuser.fuse
+        else:
+            fused = None
+        remaining = n
+        while remaining > 0:
+            pc = PC[0]
+            if fused is None:
+                entry = None
+            else:
+                try:
+                    entry = fused[pc]
+                except KeyError:
+                    entry = fuse(pc)
+            if entry is not None and entry[1] <= remaining:
+                executed = entry[0]()
+                remaining = remaining - executed
+                # Address of the last instruction run
+                pc = pc + 2 * (executed - 1)
+            else:
+                execute()
+                remaining = remaining - 1
+            if PC[0] <= pc:
+                if self.halted:
+                    break
+                if idle:
+                    remaining = remaining - idle.run(remaining)
+        return n - remaining
+
+    def run_frames(self, frames, ips = None):
+        """Run frames 60 Hz frames of ips / 60 instructions uncapped and
+        return the instruction count"""
+        if ips is None:
+            ips = self.__ips
+        scheduler = Scheduler(ips, True)
+        executed = 0
+        for frame in xrange(frames):
+            executed += self.step(scheduler.instructions())
+            self.tick_timers()
+        return executed
+
+    def replay(self, log):
+        """Run the session recorded in log uncapped and return the
+        instruction count. The Cpu must be seeded with log.seed."""
+        scheduler = Scheduler(log.ips, True)
+        executed = 0
+        for mask in log.masks():
+            self.set_keys(mask)
+            executed += self.step(scheduler.instructions())
+            self.tick_timers()
+        return executed
+
+    def framebuffer(self):
+        return self.video.framebuffer()
 
-    def run(self, ips = 60):
+    def frames(self, ips = 600):
+        """Generator running one 60 Hz frame per next(): record the keys,
+        execute ips / 60 instructions and tick the timers. Yields the
+        instructions executed. Input, presentation and pacing are left to
+        the caller, see Runner"""
         self.__ips = ips
+        scheduler = Scheduler(ips, True)
+        frame = 0
         while True:
-            self.clock.tick(self.__ips)
-            self.handle_input()
-            self.execute()
+            if self._log is not None:
+                self._log.record(frame, self.key_mask())
+            frame += 1
+            executed = self.step(scheduler.instructions())
+            self.tick_timers()
+            yield executed
 
+    def run(self, ips = 600, turbo = False):
+        runner = Runner(turbo)
+        runner.add(self, ips)
+        runner.run()
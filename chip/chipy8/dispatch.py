@@ -0,0 +1,393 @@
+#!/usr/bin/python
+#* * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * *
+#*   chipy8 - dispatch.py                                                  *
+#*   chipy8 homepage: http://code.google.com/p/chipy8/                     *
+#*   Copyright (C) 2009 olejl77@gmail.com                                  *
+#*                                                                         *
+#*   This program is free software: you can redistribute it and/or modify  *
+#*   it under the terms of the GNU General Public License as published by  *
+#*   the Free Software Foundation, either version 3 of the License, or     *
+#*   (at your option) any later version.                                   *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the          *
+#*   GNU General Public License for more details.                          *
+#*                                                                         *
+#*   You should have received a copy of the GNU General Public License     *
+#*   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+#* * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * */
+
+import array
+
+# One factory per opcode, each returning a handler(cpu) with the operands
+# of one instruction word bound. Every handler does exactly what the
+# matching branch of Cpu._execute_chain does, PC increment included.
+
+def _cls(word):
+    def cls(cpu):
+        cpu._PC[0] = cpu._PC[0] + 2
+        cpu.video.erase()
+    return cls
+
+def _ret(word):
+    def ret(cpu):
+        PC = cpu._PC
+        PC[0] = PC[0] + 2
+        PC[0] = cpu._stack.pop()
+    return ret
+
+def _jump(word):
+    nnn = word & 0x0fff
+    def jump(cpu):
+        cpu._PC[0] = nnn
+    return jump
+
+def _call(word):
+    nnn = word & 0x0fff
+    def call(cpu):
+        PC = cpu._PC
+        cpu._stack.append(PC[0] + 2)
+        PC[0] = nnn
+    return call
+
+def _skip_eq(word):
+    x = (word >> 8) & 0x0f
+    kk = word & 0x00ff
+    def skip_eq(cpu):
+        PC = cpu._PC
+        if cpu._reg[x] == kk:
+            PC[0] = PC[0] + 4
+        else:
+            PC[0] = PC[0] + 2
+    return skip_eq
+
+def _skip_ne(word):
+    x = (word >> 8) & 0x0f
+    kk = word & 0x00ff
+    def skip_ne(cpu):
+        PC = cpu._PC
+        if cpu._reg[x] != kk:
+            PC[0] = PC[0] + 4
+        else:
+            PC[0] = PC[0] + 2
+    return skip_ne
+
+def _skip_eq_reg(word):
+    x = (word >> 8) & 0x0f
+    y = (word >> 4) & 0x0f
+    def skip_eq_reg(cpu):
+        PC = cpu._PC
+        reg = cpu._reg
+        if reg[x] == reg[y]:
+            PC[0] = PC[0] + 4
+        else:
+            PC[0] = PC[0] + 2
+    return skip_eq_reg
+
+def _load(word):
+    x = (word >> 8) & 0x0f
+    kk = word & 0x00ff
+    def load(cpu):
+        cpu._PC[0] = cpu._PC[0] + 2
+        cpu._reg[x] = kk
+    return load
+
+def _add(word):
+    x = (word >> 8) & 0x0f
+    kk = word & 0x00ff
+    def add(cpu):
+        cpu._PC[0] = cpu._PC[0] + 2
+        reg = cpu._reg
+        reg[x] = (reg[x] + kk) & 0xff
+    return add
+
+def _alu(word):
+    """8XYN, the arithmetic and logic group"""
+    x = (word >> 8) & 0x0f
+    y = (word >> 4) & 0x0f
+    n4 = word & 0x0f
+    if n4 == 0x0:
+        def move(cpu):
+            cpu._PC[0] = cpu._PC[0] + 2
+            reg = cpu._reg
+            reg[x] = reg[y]
+        return move
+    if n4 == 0x1:
+        def or_(cpu):
+            cpu._PC[0] = cpu._PC[0] + 2
+            reg = cpu._reg
+            reg[x] = reg[x] | reg[y]
+        return or_
+    if n4 == 0x2:
+        def and_(cpu):
+            cpu._PC[0] = cpu._PC[0] + 2
+            reg = cpu._reg
+            reg[x] = reg[x] & reg[y]
+        return and_
+    if n4 == 0x3:
+        def xor(cpu):
+            cpu._PC[0] = cpu._PC[0] + 2
+            reg = cpu._reg
+            reg[x] = reg[x] ^ reg[y]
+        return xor
+    if n4 == 0x4:
+        def add_carry(cpu):
+            cpu._PC[0] = cpu._PC[0] + 2
+            reg = cpu._reg
+            if (reg[x] + reg[y]) > 0xff:
+                reg[0xf] = 1
+            else:
+                reg[0xf] = 0
+            reg[x] = (reg[x] + reg[y]) & 0xff
+        return add_carry
+    if n4 == 0x5:
+        def sub(cpu):
+            cpu._PC[0] = cpu._PC[0] + 2
+            reg = cpu._reg
+            if reg[x] < reg[y]:
+                reg[0xf] = 0
+                reg[x] = (0x100 - (reg[y] - reg[x])) & 0xff
+            else:
+                reg[0xf] = 1
+                reg[x] = (reg[x] - reg[y]) & 0xff
+        return sub
+    if n4 == 0x6:
+        # Shifts left, as Cpu._execute_chain does
+        def shr(cpu):
+            cpu._PC[0] = cpu._PC[0] + 2
+            reg = cpu._reg
+            if reg[x] > 127:
+                reg[0xf] = 1
+            else:
+                reg[0xf] = 0
+            reg[x] = (reg[x] * 2) & 0xff
+        return shr
+    if n4 == 0x7:
+        def sub_reverse(cpu):
+            cpu._PC[0] = cpu._PC[0] + 2
+            reg = cpu._reg
+            if reg[y] < reg[x]:
+                reg[0xf] = 0
+                reg[x] = (0x100 - (reg[x] - reg[y])) & 0xff
+            else:
+                reg[0xf] = 1
+                reg[x] = (reg[y] - reg[x]) & 0xff
+        return sub_reverse
+    if n4 == 0xe:
+        def shl(cpu):
+            cpu._PC[0] = cpu._PC[0] + 2
+            reg = cpu._reg
+            if (reg[x] * 2) > 0xff:
+                reg[0xf] = 1
+            else:
+                reg[0xf] = 0
+            reg[x] = (reg[x] * 2) & 0xff
+        return shl
+    return None
+
+def _skip_ne_reg(word):
+    x = (word >> 8) & 0x0f
+    y = (word >> 4) & 0x0f
+    def skip_ne_reg(cpu):
+        PC = cpu._PC
+        reg = cpu._reg
+        if reg[x] != reg[y]:
+            PC[0] = PC[0] + 4
+        else:
+            PC[0] = PC[0] + 2
+    return skip_ne_reg
+
+def _load_i(word):
+    nnn = word & 0x0fff
+    def load_i(cpu):
+        cpu._PC[0] = cpu._PC[0] + 2
+        cpu._I[0] = nnn
+    return load_i
+
+def _jump_v0(word):
+    nnn = word & 0x0fff
+    def jump_v0(cpu):
+        cpu._PC[0] = nnn + cpu._reg[0]
+    return jump_v0
+
+def _random(word):
+    x = (word >> 8) & 0x0f
+    kk = word & 0x00ff
+    def random(cpu):
+        cpu._PC[0] = cpu._PC[0] + 2
+        cpu._reg[x] = cpu._random.randint(0, kk)
+    return random
+
+def _draw(word):
+    x = (word >> 8) & 0x0f
+    y = (word >> 4) & 0x0f
+    n = word & 0x0f
+    def draw(cpu):
+        cpu._PC[0] = cpu._PC[0] + 2
+        read = cpu.memory.read
+        I = cpu._I[0]
+        reg = cpu._reg
+        ylines = array.array('B')
+        for i in range(n):
+            ylines.append(read(I + i))
+        reg[0xf] = cpu.video.draw8(ylines, reg[x], reg[y])
+    return draw
+
+def _skip_key(word):
+    x = (word >> 8) & 0x0f
+    def skip_key(cpu):
+        # Key X itself, not VX, as in Cpu._execute_chain
+        PC = cpu._PC
+        if cpu._keystate[x] == 1:
+            PC[0] = PC[0] + 4
+        else:
+            PC[0] = PC[0] + 2
+    return skip_key
+
+def _skip_no_key(word):
+    x = (word >> 8) & 0x0f
+    def skip_no_key(cpu):
+        PC = cpu._PC
+        if cpu._keystate[x] != 1:
+            PC[0] = PC[0] + 4
+        else:
+            PC[0] = PC[0] + 2
+    return skip_no_key
+
+def _get_delay(word):
+    x = (word >> 8) & 0x0f
+    def get_delay(cpu):
+        cpu._PC[0] = cpu._PC[0] + 2
+        cpu._reg[x] = cpu._timer[0] & 0xff
+    return get_delay
+
+def _wait_key(word):
+    x = (word >> 8) & 0x0f
+    def wait_key(cpu):
+        PC = cpu._PC
+        PC[0] = PC[0] + 2
+        if cpu.key_mask():
+            cpu.halted = False
+            keystate = cpu._keystate
+            for i in range(16):
+                if keystate[i] == 1:
+                    cpu._reg[x] = i
+        else:
+            cpu.halted = True
+            PC[0] = PC[0] - 2
+    return wait_key
+
+def _set_delay(word):
+    x = (word >> 8) & 0x0f
+    def set_delay(cpu):
+        cpu._PC[0] = cpu._PC[0] + 2
+        cpu._timer[0] = cpu._reg[x] & 0xff
+    return set_delay
+
+def _set_sound(word):
+    x = (word >> 8) & 0x0f
+    def set_sound(cpu):
+        cpu._PC[0] = cpu._PC[0] + 2
+        cpu._timer[1] = cpu._reg[x]
+    return set_sound
+
+def _add_i(word):
+    x = (word >> 8) & 0x0f
+    def add_i(cpu):
+        cpu._PC[0] = cpu._PC[0] + 2
+        I = cpu._I
+        I[0] = I[0] + cpu._reg[x] & 0xffff
+    return add_i
+
+def _font(word):
+    x = (word >> 8) & 0x0f
+    def font(cpu):
+        cpu._PC[0] = cpu._PC[0] + 2
+        cpu._I[0] = (cpu._reg[x] * 5) & 0xffff
+    return font
+
+def _bcd(word):
+    x = (word >> 8) & 0x0f
+    def bcd(cpu):
+        cpu._PC[0] = cpu._PC[0] + 2
+        write = cpu.memory.write
+        I = cpu._I
+        reg = cpu._reg
+        write(I[0], reg[x] / 100)
+        write(I[0] + 1, (reg[x] % 10) / 10)
+        write(I[0] + 2, reg[x] % 10)
+    return bcd
+
+def _store(word):
+    x = (word >> 8) & 0x0f
+    def store(cpu):
+        cpu._PC[0] = cpu._PC[0] + 2
+        memory = cpu.memory
+        I = cpu._I
+        reg = cpu._reg
+        # Writes to the address read at I + i, as Cpu._execute_chain does
+        for i in range(x + 1):
+            memory.write(memory.read(I[0] + i), reg[i])
+    return store
+
+def _load_regs(word):
+    x = (word >> 8) & 0x0f
+    def load_regs(cpu):
+        cpu._PC[0] = cpu._PC[0] + 2
+        read = cpu.memory.read
+        I = cpu._I
+        reg = cpu._reg
+        for i in range(x + 1):
+            reg[i] = read(I[0] + i) & 0xff
+    return load_regs
+
+# Low byte of EX and FX instructions -> factory
+_KEY_GROUP = {0x9e: _skip_key, 0xa1: _skip_no_key}
+_MISC_GROUP = {
+    0x07: _get_delay, 0x0a: _wait_key, 0x15: _set_delay, 0x18: _set_sound,
+    0x1e: _add_i, 0x29: _font, 0x33: _bcd, 0x55: _store, 0x65: _load_regs,
+}
+
+def specialise(word):
+    """Return a handler(cpu) executing word with its operands bound, or
+    None for words left to Cpu._execute_chain (unsupported instructions,
+    which report themselves and exit)"""
+    n1 = word >> 12
+    n4 = word & 0x0f
+    kk = word & 0x00ff
+    if word == 0x00e0:
+        return _cls(word)
+    if word == 0x00ee:
+        return _ret(word)
+    if n1 == 0x1:
+        return _jump(word)
+    if n1 == 0x2:
+        return _call(word)
+    if n1 == 0x3:
+        return _skip_eq(word)
+    if n1 == 0x4:
+        return _skip_ne(word)
+    if n1 == 0x5 and n4 == 0x0:
+        return _skip_eq_reg(word)
+    if n1 == 0x6:
+        return _load(word)
+    if n1 == 0x7:
+        return _add(word)
+    if n1 == 0x8:
+        return _alu(word)
+    if n1 == 0x9 and n4 == 0x0:
+        return _skip_ne_reg(word)
+    if n1 == 0xa:
+        return _load_i(word)
+    if n1 == 0xb:
+        return _jump_v0(word)
+    if n1 == 0xc:
+        return _random(word)
+    if n1 == 0xd and n4 != 0:
+        return _draw(word)
+    if n1 == 0xe and kk in _KEY_GROUP:
+        return _KEY_GROUP[kk](word)
+    if n1 == 0xf and kk in _MISC_GROUP:
+        return _MISC_GROUP[kk](word)
+    return None
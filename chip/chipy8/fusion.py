@@ -0,0 +1,238 @@
+#!/usr/bin/python
+#* * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * *
+#*   chipy8 - fusion.py                                                    *
+#*   chipy8 homepage: http://code.google.com/p/chipy8/                     *
+#*   Copyright (C) 2009 olejl77@gmail.com                                  *
+#*                                                                         *
+#*   This program is free software: you can redistribute it and/or modify  *
+#*   it under the terms of the GNU General Public License as published by  *
+#*   the Free Software Foundation, either version 3 of the License, or     *
+#*   (at your option) any later version.                                   *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the          *
+#*   GNU General Public License for more details.                          *
+#*                                                                         *
+#*   You should have received a copy of the GNU General Public License     *
+#*   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+#* * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * */
+
+import array
+from optparse import OptionParser
+
+# Longest fused sequence, in instructions
+MAX_LENGTH = 3
+
+# The sequences fused, chosen by their share of the instructions executed
+# running chipy8/games for 600 frames at 600 ips with scripted keys and
+# no idle skipping (see sequences()):
+#   skip (3XKK, 4XKK, EX9E, EXA1) then 1NNN         15.8%
+#   FX07, 6XKK or 7XKK then a skip (then 1NNN)      12.8%
+#   ANNN then FX1E                                   2.2%
+#   ANNN then DXYN                                   1.6%
+# Other pairs, 6XKK then 6XKK among them (0.6%), are too rare to pay for
+# their lookup.
+
+def _skip(cpu, word):
+    """Return (array, index, value, equal) for a skip instruction, which
+    skips when (array[index] == value) == equal, or None for anything
+    else. Like Cpu.execute, EX9E and EXA1 test key X itself"""
+    n1 = word >> 12
+    x = (word >> 8) & 0x0f
+    kk = word & 0x00ff
+    if n1 == 0x3:
+        return cpu._reg, x, kk, True
+    if n1 == 0x4:
+        return cpu._reg, x, kk, False
+    if n1 == 0xe and kk == 0x9e:
+        return cpu._keystate, x, 1, True
+    if n1 == 0xe and kk == 0xa1:
+        return cpu._keystate, x, 1, False
+    return None
+
+def _branch(cpu, pc, skip, target):
+    """A skip at pc over a jump to target: one or two instructions"""
+    array, index, value, equal = skip
+    PC = cpu._PC
+    def branch():
+        if (array[index] == value) == equal:
+            PC[0] = pc + 4
+            return 1
+        PC[0] = target
+        return 2
+    return branch
+
+def _set_and_skip(cpu, pc, word, skip, target):
+    """6XKK, 7XKK or FX07 at pc, a skip and, unless target is None, a jump
+    to target: two or three instructions"""
+    n1 = word >> 12
+    x = (word >> 8) & 0x0f
+    kk = word & 0x00ff
+    reg = cpu._reg
+    timer = cpu._timer
+    array, index, value, equal = skip
+    PC = cpu._PC
+    def set_and_skip():
+        if n1 == 0x6:
+            reg[x] = kk
+        elif n1 == 0x7:
+            reg[x] = (reg[x] + kk) & 0xff
+        else:
+            reg[x] = timer[0] & 0xff
+        if (array[index] == value) == equal:
+            PC[0] = pc + 6
+            return 2
+        if target is None:
+            PC[0] = pc + 4
+            return 2
+        PC[0] = target
+        return 3
+    return set_and_skip
+
+def _set_i_and_add(cpu, pc, nnn, x):
+    """ANNN at pc, then FX1E"""
+    reg = cpu._reg
+    I = cpu._I
+    PC = cpu._PC
+    def set_i_and_add():
+        I[0] = nnn + reg[x] & 0xffff
+        PC[0] = pc + 4
+        return 2
+    return set_i_and_add
+
+def _set_i_and_draw(cpu, pc, nnn, x, y, n):
+    """ANNN at pc, then DXYN with N > 0"""
+    reg = cpu._reg
+    I = cpu._I
+    PC = cpu._PC
+    mem = cpu.memory._memory
+    video = cpu.video
+    def set_i_and_draw():
+        I[0] = nnn
+        PC[0] = pc + 4
+        reg[0xf] = video.draw8(array.array('B', mem[nnn:nnn + n]), reg[x], reg[y])
+        return 2
+    return set_i_and_draw
+
+class Fuser:
+    """Runs frequent instruction sequences of a Cpu in one dispatch.
+
+    A sequence is fused by the address of its first instruction only, so
+    a jump or skip into its middle runs the instructions from there one at
+    a time as before. Skips inside a sequence are followed exactly, which
+    is why a fused function returns the number of instructions it ran. No
+    sequence contains FX0A, so none can halt the Cpu.
+    """
+    def __init__(self, cpu):
+        self._cpu = cpu
+        # entry address -> (function, most instructions it runs) or None
+        self.fused = {}
+
+    def clear(self):
+        self.fused.clear()
+
+    def invalidate(self, address):
+        """Drop the sequences covering address, called on memory writes"""
+        for pc in xrange(address - 2 * MAX_LENGTH + 1, address + 1):
+            self.fused.pop(pc, None)
+
+    def fuse(self, pc):
+        """Return (function, most instructions it runs) for the sequence
+        at pc, or None if there is none, and cache it"""
+        cpu = self._cpu
+        mem = cpu.memory._memory
+        words = [(mem[address] << 8) | mem[address + 1]
+                 for address in xrange(pc, min(pc + 2 * MAX_LENGTH, len(mem) - 1), 2)]
+        words.extend([None] * (MAX_LENGTH - len(words)))
+        first, second, third = words
+        entry = None
+        if first is not None and second is not None:
+            n1 = first >> 12
+            nnn = first & 0x0fff
+            if n1 == 0xa and second & 0xf0ff == 0xf01e:
+                entry = _set_i_and_add(cpu, pc, nnn, (second >> 8) & 0x0f), 2
+            elif n1 == 0xa and second >> 12 == 0xd and second & 0x0f and \
+                 nnn + (second & 0x0f) <= len(mem):
+                entry = _set_i_and_draw(cpu, pc, nnn, (second >> 8) & 0x0f,
+                                        (second >> 4) & 0x0f, second & 0x0f), 2
+            elif n1 in (0x6, 0x7) or first & 0xf0ff == 0xf007:
+                skip = _skip(cpu, second)
+                if skip is not None:
+                    if third is not None and third >> 12 == 0x1:
+                        entry = _set_and_skip(cpu, pc, first, skip, third & 0x0fff), 3
+                    else:
+                        entry = _set_and_skip(cpu, pc, first, skip, None), 2
+            elif second >> 12 == 0x1:
+                skip = _skip(cpu, first)
+                if skip is not None:
+                    entry = _branch(cpu, pc, skip, second & 0x0fff), 2
+        self.fused[pc] = entry
+        return entry
+
+def pattern(word):
+    """Return the instruction class of word, e.g. 3XKK or FX07"""
+    n1 = word >> 12
+    if word in (0x00e0, 0x00ee):
+        return '%04X' % word
+    if n1 == 0x0:
+        return '0NNN'
+    if n1 in (0x1, 0x2, 0xa, 0xb):
+        return '%XNNN' % n1
+    if n1 in (0x5, 0x8, 0x9):
+        return '%XXY%X' % (n1, word & 0x0f)
+    if n1 == 0xd:
+        return 'DXYN'
+    if n1 in (0xe, 0xf):
+        return '%XX%02X' % (n1, word & 0xff)
+    return '%XXKK' % n1
+
+def sequences(filename, frames = 600, ips = 600, length = 2):
+    """Run filename headless without input and return (count, instructions
+    executed) for every sequence of length instruction classes, most
+    frequent first. Idle skipping and fusion are off"""
+    from cpu import Cpu
+    cpu = Cpu(False, 1, True, 0)
+    cpu.skip_idle = False
+    cpu.fuse = False
+    cpu.read_rom(filename)
+    mem = cpu.memory._memory
+    PC = cpu._PC
+    history = []
+    execute = cpu.execute
+    def recording():
+        history.append(pattern((mem[PC[0]] << 8) | mem[PC[0] + 1]))
+        execute()
+    cpu.execute = recording
+    try:
+        cpu.run_frames(frames, ips)
+    except SystemExit:
+        # Unsupported instruction, count what ran up to there
+        pass
+    counts = {}
+    for i in xrange(len(history) - length + 1):
+        key = ' '.join(history[i:i + length])
+        counts[key] = counts.get(key, 0) + 1
+    result = [(count, key) for key, count in counts.items()]
+    result.sort(reverse = True)
+    return result, len(history)
+
+if __name__ == "__main__":
+    parser = OptionParser("usage: %prog [options] ROM...")
+    parser.add_option('-f', '--frames', action='store', dest='frames', type='int', default=600, help='How many frames to run each ROM for')
+    parser.add_option('-i', '--ips', action='store', dest='ips', type='int', default=600, help='How many instructions to execute per second')
+    parser.add_option('-l', '--length', action='store', dest='length', type='int', default=2, help='Length of the counted sequences')
+    parser.add_option('-t', '--top', action='store', dest='top', type='int', default=20, help='How many sequences to print')
+    (options, args) = parser.parse_args()
+    if not args:
+        parser.error("No ROM given")
+    totals = {}
+    executed = 0
+    for filename in args:
+        counts, n = sequences(filename, options.frames, options.ips, options.length)
+        executed += n
+        for count, key in counts:
+            totals[key] = totals.get(key, 0) + count
+    top = sorted(totals.items(), key = lambda item: item[1], reverse = True)
+    for key, count in top[:options.top]:
+        print "%-24s %6.2f%%" % (key, 100.0 * count / max(executed, 1))
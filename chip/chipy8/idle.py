@@ -0,0 +1,98 @@
+#!/usr/bin/python
+#* * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * *
+#*   chipy8 - idle.py                                                      *
+#*   chipy8 homepage: http://code.google.com/p/chipy8/                     *
+#*   Copyright (C) 2009 olejl77@gmail.com                                  *
+#*                                                                         *
+#*   This program is free software: you can redistribute it and/or modify  *
+#*   it under the terms of the GNU General Public License as published by  *
+#*   the Free Software Foundation, either version 3 of the License, or     *
+#*   (at your option) any later version.                                   *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the          *
+#*   GNU General Public License for more details.                          *
+#*                                                                         *
+#*   You should have received a copy of the GNU General Public License     *
+#*   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+#* * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * */
+
+# Fewest instructions left in a step for a loop to be worth checking
+MIN_BUDGET = 32
+# Longest loop iteration (in instructions) that is checked for idling
+MAX_LOOP = 16
+# Most instructions run looking for a repeating loop state
+MAX_SCAN = 256
+
+def is_pure(word):
+    """True if word only reads registers, I, keys, the delay timer or
+    memory and only writes registers, I or PC"""
+    n1 = word >> 12
+    n4 = word & 0x0f
+    kk = word & 0xff
+    if n1 in (0x1, 0x3, 0x4, 0x6, 0x7, 0xa):
+        return True
+    if n1 in (0x5, 0x9):
+        return n4 == 0x0
+    if n1 == 0x8:
+        return n4 in (0x0, 0x1, 0x2, 0x3, 0x4, 0x5, 0x6, 0x7, 0xe)
+    if n1 == 0xe:
+        return kk in (0x9e, 0xa1)
+    if n1 == 0xf:
+        return kk in (0x07, 0x1e, 0x29, 0x65)
+    return False
+
+class IdleSkipper:
+    """Fast-forwards idle loops of a Cpu within one step() call.
+
+    Games wait for the delay timer or a key in tight loops. After a jump
+    back the loop at the new PC is run on, one iteration at a time, as
+    long as it only executes pure instructions (see is_pure). Once the
+    registers and I are back to what they were at the start of an earlier
+    iteration, the loop repeats itself exactly until the timers tick or the
+    keys change, which only happens between step() calls, so whole periods
+    are skipped up to the step budget.
+    """
+    def __init__(self, cpu):
+        self._cpu = cpu
+        # Instructions skipped so far
+        self.skipped = 0
+
+    def run(self, budget):
+        """Called after a jump back with budget instructions left in the
+        step. Returns how many of them were executed or skipped"""
+        if budget < MIN_BUDGET:
+            return 0
+        cpu = self._cpu
+        PC = cpu._PC
+        head = PC[0]
+        mem = cpu.memory._memory
+        reg = cpu._reg
+        I = cpu._I
+        execute = cpu.execute
+        # loop state -> instructions executed when it was seen
+        seen = {}
+        count = 0
+        while count < budget and count < MAX_SCAN:
+            state = reg.tostring(), I[0]
+            if state in seen:
+                period = count - seen[state]
+                skip = (budget - count) // period * period
+                self.skipped = self.skipped + skip
+                return count + skip
+            seen[state] = count
+            # Run one iteration, back to head
+            length = 0
+            while True:
+                pc = PC[0]
+                if count == budget or length == MAX_LOOP or \
+                   not is_pure((mem[pc] << 8) | mem[pc + 1]):
+                    # Out of budget, not idle, or leaving the loop
+                    return count
+                execute()
+                count = count + 1
+                length = length + 1
+                if PC[0] == head:
+                    break
+        return count
@@ -0,0 +1,81 @@
+#!/usr/bin/python
+#* * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * *
+#*   chipy8 - inputlog.py                                                  *
+#*   chipy8 homepage: http://code.google.com/p/chipy8/                     *
+#*   Copyright (C) 2009 olejl77@gmail.com                                  *
+#*                                                                         *
+#*   This program is free software: you can redistribute it and/or modify  *
+#*   it under the terms of the GNU General Public License as published by  *
+#*   the Free Software Foundation, either version 3 of the License, or     *
+#*   (at your option) any later version.                                   *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the          *
+#*   GNU General Public License for more details.                          *
+#*                                                                         *
+#*   You should have received a copy of the GNU General Public License     *
+#*   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+#* * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * */
+import struct
+
+LOG_MAGIC = 'C8IN'
+LOG_VERSION = 1
+# magic, version, RNG seed, instructions per second, frame count
+_header = struct.Struct('<4sBIdI')
+# frame number, 16-bit key mask (bit n = key n down)
+_event = struct.Struct('<IH')
+
+class InputLog:
+    """Key masks by 60 Hz frame number for recording and replaying a session.
+
+    Only frames where the mask changes are stored. Together with the RNG
+    seed and the instruction rate in the header that is enough to replay
+    the session with identical results.
+    """
+    def __init__(self, seed = 0, ips = 600):
+        self.seed = seed
+        self.ips = ips
+        self.frames = 0
+        # (frame, mask) for every change of mask, keys start released
+        self.events = []
+        self._mask = 0
+
+    def record(self, frame, mask):
+        """Record the key mask held during frame"""
+        if mask != self._mask:
+            self.events.append((frame, mask))
+            self._mask = mask
+        self.frames = frame + 1
+
+    def masks(self):
+        """Yield the key mask of every recorded frame in order"""
+        mask = 0
+        events = iter(self.events)
+        change = next(events, None)
+        for frame in xrange(self.frames):
+            while change is not None and change[0] <= frame:
+                mask = change[1]
+                change = next(events, None)
+            yield mask
+
+    def save(self, filename):
+        with open(filename, "wb") as f:
+            f.write(_header.pack(LOG_MAGIC, LOG_VERSION, self.seed, self.ips, self.frames))
+            for frame, mask in self.events:
+                f.write(_event.pack(frame, mask))
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, "rb") as f:
+            data = f.read()
+        magic, version, seed, ips, frames = _header.unpack_from(data, 0)
+        if magic != LOG_MAGIC or version != LOG_VERSION:
+            raise ValueError("%s is not a version %d input log" % (filename, LOG_VERSION))
+        log = cls(seed, ips)
+        log.frames = frames
+        for offset in xrange(_header.size, len(data) - _event.size + 1, _event.size):
+            log.events.append(_event.unpack_from(data, offset))
+        if log.events:
+            log._mask = log.events[-1][1]
+        return log
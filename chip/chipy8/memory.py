@@ -18,116 +18,44 @@
 #*   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
 #* * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * */
 import pygame
-import array
-import struct
+import os
+
+MEMORY_SIZE = 0x1000
+# The ROM is loaded at 0x200, the interpreter area below holds the font
+ROM_START = 0x200
+MAX_ROM_SIZE = MEMORY_SIZE - ROM_START
+
+# 4x5 font sprites for the hex digits 0-F
+FONT = bytearray([
+    0xf0, 0x90, 0x90, 0x90, 0xf0, # 0
+    0x20, 0x60, 0x20, 0x20, 0x70, # 1
+    0xf0, 0x10, 0xf0, 0x80, 0xf0, # 2
+    0xf0, 0x10, 0xf0, 0x10, 0xf0, # 3
+    0x90, 0x90, 0xf0, 0x10, 0x10, # 4
+    0xf0, 0x80, 0xf0, 0x10, 0xf0, # 5
+    0xf0, 0x80, 0xf0, 0x90, 0xf0, # 6
+    0xf0, 0x10, 0x20, 0x40, 0x40, # 7
+    0xf0, 0x90, 0xf0, 0x90, 0xf0, # 8
+    0xf0, 0x90, 0xf0, 0x10, 0xf0, # 9
+    0xf0, 0x90, 0xf0, 0x90, 0x90, # A
+    0xe0, 0x90, 0xe0, 0x90, 0xe0, # B
+    0xf0, 0x80, 0x80, 0x80, 0xf0, # C
+    0xe0, 0x90, 0x90, 0x90, 0xe0, # D
+    0xf0, 0x80, 0xf0, 0x80, 0xf0, # E
+    0xf0, 0x80, 0xf0, 0x80, 0x80, # F
+])
+
+# Power-on memory image: the font at 0 and zeros everywhere else.
+# Every Memory starts as a single copy of it.
+_template = bytearray(MEMORY_SIZE)
+_template[0:len(FONT)] = FONT
+_blank = bytearray(MAX_ROM_SIZE)
 
 class Memory:
     def __init__(self):
-        # Memory
-        self._memory = array.array('B') # creating an array of unsigned chars
-
-        # Inserting the font data. Starting in memory position 0
-        # 0
-        self._memory.append(0b11110000)
-        self._memory.append(0b10010000)
-        self._memory.append(0b10010000)
-        self._memory.append(0b10010000)
-        self._memory.append(0b11110000)
-        # 1
-        self._memory.append(0x20) #0010 0000
-        self._memory.append(0x60) #0110 0000
-        self._memory.append(0x20) #0010 0000
-        self._memory.append(0x20) #0010 0000
-        self._memory.append(0x70) #0111 0000
-        # 2
-        self._memory.append(0xf0) #1111 0000
-        self._memory.append(0x10) #0001 0000
-        self._memory.append(0xf0) #1111 0000
-        self._memory.append(0x80) #1000 0000
-        self._memory.append(0xf0) #1111 0000
-        # 3
-        self._memory.append(0xf0) #1111 0000
-        self._memory.append(0x10) #0001 0000
-        self._memory.append(0xf0) #1111 0000
-        self._memory.append(0x10) #0001 0000
-        self._memory.append(0xf0) #1111 0000
-        # 4
-        self._memory.append(0x90) #1001 0000
-        self._memory.append(0x90) #1001 0000
-        self._memory.append(0xf0) #1111 0000
-        self._memory.append(0x10) #0001 0000
-        self._memory.append(0x10) #0001 0000
-        # 5
-        self._memory.append(0xf0) #1111 0000
-        self._memory.append(0x80) #1000 0000
-        self._memory.append(0xf0) #1111 0000
-        self._memory.append(0x10) #0001 0000
-        self._memory.append(0xf0) #1111 0000
-        # 6
-        self._memory.append(0xf0) #1111 0000
-        self._memory.append(0x80) #1000 0000
-        self._memory.append(0xf0) #1111 0000
-        self._memory.append(0x90) #1001 0000
-        self._memory.append(0xf0) #1111 0000
-        # 7
-        self._memory.append(0xf0) #1111 0000
-        self._memory.append(0x10) #0001 0000
-        self._memory.append(0x20) #0010 0000
-        self._memory.append(0x40) #0100 0000
-        self._memory.append(0x40) #0100 0000
-        # 8
-        self._memory.append(0xf0) #1111 0000
-        self._memory.append(0x90) #1001 0000
-        self._memory.append(0xf0) #1111 0000
-        self._memory.append(0x90) #1001 0000
-        self._memory.append(0xf0) #1111 0000
-        # 9
-        self._memory.append(0xf0) #1111 0000
-        self._memory.append(0x90) #1001 0000
-        self._memory.append(0xf0) #1111 0000
-        self._memory.append(0x10) #0001 0000
-        self._memory.append(0xf0) #1111 0000
-        # A
-        self._memory.append(0xf0) #1111 0000
-        self._memory.append(0x90) #1001 0000
-        self._memory.append(0xf0) #1111 0000
-        self._memory.append(0x90) #1001 0000
-        self._memory.append(0x90) #1001 0000
-        # B
-        self._memory.append(0xe0) #1110 0000
-        self._memory.append(0x90) #1001 0000
-        self._memory.append(0xe0) #1110 0000
-        self._memory.append(0x90) #1001 0000
-        self._memory.append(0xe0) #1110 0000
-        # C
-        self._memory.append(0xf0) #1111 0000
-        self._memory.append(0x80) #1000 0000
-        self._memory.append(0x80) #1000 0000
-        self._memory.append(0x80) #1000 0000
-        self._memory.append(0xf0) #1111 0000
-        # D
-        self._memory.append(0xe0) #1110 0000
-        self._memory.append(0x90) #1001 0000
-        self._memory.append(0x90) #1001 0000
-        self._memory.append(0x90) #1001 0000
-        self._memory.append(0xe0) #1110 0000
-        # E
-        self._memory.append(0xf0) #1111 0000
-        self._memory.append(0x80) #1000 0000
-        self._memory.append(0xf0) #1111 0000
-        self._memory.append(0x80) #1000 0000
-        self._memory.append(0xf0) #1111 0000
-        # F
-        self._memory.append(0xf0) #1111 0000
-        self._memory.append(0x80) #1000 0000
-        self._memory.append(0xf0) #1111 0000
-        self._memory.append(0x80) #1000 0000
-        self._memory.append(0x80) #1000 0000
+        # 4 KiB of unsigned bytes
+        self._memory = bytearray(_template)
 
-        # pad the memory up to 0x200 where the ROM will start
-        for i in range(0x200 - len(self._memory)):
-            self._memory.append(0)    # with 0.
-            
     def read(self, address):
         return self._memory[address]
     
@@ -135,12 +63,17 @@ class Memory:
         self._memory[address] = value
         
     def read_rom(self, filename):
+        """Read a ROM file straight into memory at ROM_START"""
         with open(filename, "rb") as f:
-            byte = f.read(1)
-            while byte:
-                self._memory.append(struct.unpack('B', byte)[0])
-                byte = f.read(1)
-        # After the ROM is loaded, make sure that the complete memory is initialized
-        while (len(self._memory) < 0x1000):
-            self._memory.append(0)
+            size = os.fstat(f.fileno()).st_size
+            if size > MAX_ROM_SIZE:
+                raise ValueError("ROM is %d bytes, at most %d fit in memory" % (size, MAX_ROM_SIZE))
+            self._memory[ROM_START:] = _blank
+            f.readinto(memoryview(self._memory)[ROM_START:ROM_START + size])
 
+    def load(self, data):
+        """Load a ROM from any buffer (string, bytearray, mmap) at ROM_START"""
+        if len(data) > MAX_ROM_SIZE:
+            raise ValueError("ROM is %d bytes, at most %d fit in memory" % (len(data), MAX_ROM_SIZE))
+        self._memory[ROM_START:] = _blank
+        self._memory[ROM_START:ROM_START + len(data)] = data
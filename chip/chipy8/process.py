@@ -0,0 +1,139 @@
+#!/usr/bin/python
+#* * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * *
+#*   chipy8 - process.py                                                   *
+#*   chipy8 homepage: http://code.google.com/p/chipy8/                     *
+#*   Copyright (C) 2009 olejl77@gmail.com                                  *
+#*                                                                         *
+#*   This program is free software: you can redistribute it and/or modify  *
+#*   it under the terms of the GNU General Public License as published by  *
+#*   the Free Software Foundation, either version 3 of the License, or     *
+#*   (at your option) any later version.                                   *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the          *
+#*   GNU General Public License for more details.                          *
+#*                                                                         *
+#*   You should have received a copy of the GNU General Public License     *
+#*   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+#* * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * */
+import sys
+import struct
+import time
+import pygame
+from multiprocessing import Process
+from multiprocessing.sharedctypes import RawArray, RawValue
+from cpu import Cpu, KEY_MAP
+from translator import BlockCpu
+from video import Video
+from scheduler import Scheduler
+from sound import Beeper
+
+# One framebuffer: 32 rows of 64 pixels, a big endian 64-bit int per row
+_rows = struct.Struct('>32Q')
+FRAME_SIZE = _rows.size
+
+class _Shared:
+    """State shared by the front-end and the worker process.
+
+    The worker writes each frame into the back buffer of frames and then
+    makes it the front one. A buffer's sequence number is odd while it is
+    being written, so the front-end can tell when it read a torn frame and
+    keep the previous one instead.
+    """
+    def __init__(self):
+        self.frames = RawArray('B', 2 * FRAME_SIZE)
+        self.sequence = RawArray('L', 2)
+        self.front = RawValue('b', 0)
+        # Key states, as Cpu._keystate
+        self.keys = RawArray('B', 16)
+        self.sound = RawValue('B', 0)
+        self.running = RawValue('b', 1)
+
+def _work(shared, rom, ips, turbo, seed, jit, exact):
+    """Worker process: run a headless Cpu at ips, publishing every frame"""
+    if jit:
+        cpu = BlockCpu(False, 1, True, seed)
+    else:
+        cpu = Cpu(False, 1, True, seed)
+    cpu.skip_idle = not exact
+    cpu.read_rom(rom)
+    rows = cpu.video.rows
+    keystate = cpu._keystate
+    keys = shared.keys
+    clock = Scheduler(60, turbo)
+    back = 1
+    for executed in cpu.frames(ips):
+        if not shared.running.value:
+            break
+        for i in xrange(16):
+            keystate[i] = keys[i]
+        shared.sequence[back] += 1
+        _rows.pack_into(shared.frames, back * FRAME_SIZE, *rows)
+        shared.sequence[back] += 1
+        shared.front.value = back
+        back = 1 - back
+        shared.sound.value = cpu._timer[1]
+        if turbo and cpu.halted:
+            # Waiting on FX0A for a key only the front-end can deliver, so
+            # sleep a frame instead of spinning through empty ones
+            time.sleep(1.0 / clock.fps)
+        clock.wait()
+
+class ProcessMachine:
+    """Front-end for a Cpu running in a worker process.
+
+    The main process only handles input, rendering and sound, so scaling
+    and display updates no longer compete with the interpreter for the
+    GIL. The worker keeps its own 60 Hz pacing; the front-end presents
+    the newest complete frame once per display frame.
+    """
+    def __init__(self, rom, ips = 600, scale = 1, turbo = False, seed = None,
+                 jit = False, exact = False):
+        self.video = Video(False, scale)
+        self._shared = _Shared()
+        self._process = Process(target = _work,
+                                args = (self._shared, rom, ips, turbo, seed,
+                                        jit, exact))
+        self._process.daemon = True
+
+    def handle_event(self, event):
+        if event.type == pygame.QUIT:
+            sys.exit(0)
+        elif event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
+            sys.exit(0)
+        elif event.type == pygame.KEYDOWN and event.key in KEY_MAP:
+            self._shared.keys[KEY_MAP[event.key]] = 1
+        elif event.type == pygame.KEYUP and event.key in KEY_MAP:
+            self._shared.keys[KEY_MAP[event.key]] = 0
+
+    def present(self):
+        """Show the newest complete frame published by the worker"""
+        shared = self._shared
+        front = shared.front.value
+        sequence = shared.sequence[front]
+        if sequence & 1:
+            return
+        rows = _rows.unpack_from(shared.frames, front * FRAME_SIZE)
+        if shared.sequence[front] != sequence:
+            # Overwritten while reading, try again next frame
+            return
+        self.video.set_rows(rows)
+        self.video.present()
+
+    def run(self):
+        """Start the worker and serve it until it stops or the window is
+        closed"""
+        self._process.start()
+        clock = Scheduler(60)
+        beeper = Beeper()
+        try:
+            while self._process.is_alive():
+                for event in pygame.event.get():
+                    self.handle_event(event)
+                self.present()
+                beeper.update(self._shared.sound.value)
+                clock.wait()
+        finally:
+            self._shared.running.value = 0
+            self._process.join(1)
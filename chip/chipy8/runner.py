@@ -0,0 +1,81 @@
+#!/usr/bin/python
+#* * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * *
+#*   chipy8 - runner.py                                                    *
+#*   chipy8 homepage: http://code.google.com/p/chipy8/                     *
+#*   Copyright (C) 2009 olejl77@gmail.com                                  *
+#*                                                                         *
+#*   This program is free software: you can redistribute it and/or modify  *
+#*   it under the terms of the GNU General Public License as published by  *
+#*   the Free Software Foundation, either version 3 of the License, or     *
+#*   (at your option) any later version.                                   *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the          *
+#*   GNU General Public License for more details.                          *
+#*                                                                         *
+#*   You should have received a copy of the GNU General Public License     *
+#*   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+#* * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * */
+from scheduler import Scheduler
+from sound import Beeper
+
+class Runner:
+    """Runs any number of machines cooperatively in one process.
+
+    Every machine is a generator (see Cpu.frames) that runs one 60 Hz
+    frame slice per next(), so each frame every machine gets exactly its
+    slice, in turn. Input is taken from the pygame event queue once per
+    frame and goes to the focused machine, the one with a display, which
+    is also presented and heard. The loop sleeps to the next frame
+    boundary, and when every machine is halted on FX0A with its timers
+    stopped it blocks in the event queue until a key is pressed.
+    """
+    def __init__(self, turbo = False, fps = 60):
+        self._clock = Scheduler(fps, turbo, fps)
+        # (cpu, frame generator) in scheduling order
+        self.machines = []
+        self.focus = None
+        self._beeper = None
+
+    def add(self, cpu, ips = 600):
+        """Start running cpu at ips instructions per second"""
+        self.machines.append((cpu, cpu.frames(ips)))
+        if self.focus is None and not cpu._headless:
+            self.focus = cpu
+            self._beeper = Beeper()
+
+    def remove(self, cpu):
+        self.machines = [(c, f) for c, f in self.machines if c is not cpu]
+        if self.focus is cpu:
+            self.focus = None
+            self._beeper.update(0)
+            self._beeper = None
+
+    def idle(self):
+        """True if no machine can do anything until a key is pressed"""
+        for cpu, frames in self.machines:
+            if not cpu.halted or cpu._timer[0] or cpu._timer[1]:
+                return False
+        return True
+
+    def run(self, frames = None):
+        """Run every machine for frames frames, or forever"""
+        frame = 0
+        while self.machines and (frames is None or frame < frames):
+            focus = self.focus
+            if focus is not None:
+                if self.idle():
+                    # Nothing changes until a key goes down, sleep until
+                    # then instead of running empty frames. Skipped frames
+                    # aren't recorded, replaying them would do nothing
+                    # either.
+                    focus.wait_key()
+                focus.handle_input()
+            for cpu, slices in self.machines:
+                slices.next()
+            if focus is not None:
+                focus.video.present()
+                self._beeper.update(focus._timer[1])
+            frame += 1
+            self._clock.wait()
@@ -0,0 +1,57 @@
+#!/usr/bin/python
+#* * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * *
+#*   chipy8 - scheduler.py                                                 *
+#*   chipy8 homepage: http://code.google.com/p/chipy8/                     *
+#*   Copyright (C) 2009 olejl77@gmail.com                                  *
+#*                                                                         *
+#*   This program is free software: you can redistribute it and/or modify  *
+#*   it under the terms of the GNU General Public License as published by  *
+#*   the Free Software Foundation, either version 3 of the License, or     *
+#*   (at your option) any later version.                                   *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the          *
+#*   GNU General Public License for more details.                          *
+#*                                                                         *
+#*   You should have received a copy of the GNU General Public License     *
+#*   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+#* * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * */
+import time
+
+class Scheduler:
+    """Splits emulation into 60 Hz frames.
+
+    Each frame gets ips / fps instructions (the fractional part carries
+    over to the next frame) and the caller sleeps once per frame. In turbo
+    mode frames are never delayed.
+    """
+    def __init__(self, ips = 600, turbo = False, fps = 60):
+        self.ips = ips
+        self.turbo = turbo
+        self.fps = fps
+        self._per_frame = float(ips) / fps
+        self._budget = 0.0
+        self._next = None
+
+    def instructions(self):
+        """Return how many instructions to execute in the next frame"""
+        self._budget += self._per_frame
+        count = int(self._budget)
+        self._budget -= count
+        return count
+
+    def wait(self):
+        """Sleep until the next frame boundary"""
+        if self.turbo:
+            return
+        now = time.time()
+        if self._next is None:
+            self._next = now
+        self._next += 1.0 / self.fps
+        delay = self._next - now
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            # Running behind, don't try to catch up
+            self._next = now
@@ -0,0 +1,55 @@
+#!/usr/bin/python
+#* * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * *
+#*   chipy8 - sound.py                                                     *
+#*   chipy8 homepage: http://code.google.com/p/chipy8/                     *
+#*   Copyright (C) 2009 olejl77@gmail.com                                  *
+#*                                                                         *
+#*   This program is free software: you can redistribute it and/or modify  *
+#*   it under the terms of the GNU General Public License as published by  *
+#*   the Free Software Foundation, either version 3 of the License, or     *
+#*   (at your option) any later version.                                   *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the          *
+#*   GNU General Public License for more details.                          *
+#*                                                                         *
+#*   You should have received a copy of the GNU General Public License     *
+#*   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+#* * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * */
+import pygame
+import numpy
+from pygame import sndarray
+
+class Beeper:
+    """Square wave tone played while the sound timer is running.
+
+    update() is called once per frame with the sound timer. Without a
+    usable mixer (no audio device, headless) the Beeper stays silent.
+    """
+    def __init__(self, frequency = 440, volume = 0.25):
+        self._sound = None
+        self._playing = False
+        try:
+            if not pygame.mixer.get_init():
+                pygame.mixer.init()
+            rate, size, channels = pygame.mixer.get_init()
+        except (pygame.error, TypeError):
+            return
+        period = max(rate // frequency, 2)
+        level = int(volume * 0x7fff)
+        wave = numpy.where(numpy.arange(period) < period // 2, level, -level)
+        wave = wave.astype(numpy.int16)
+        if channels > 1:
+            wave = numpy.repeat(wave[:, None], channels, axis = 1)
+        self._sound = sndarray.make_sound(wave)
+
+    def update(self, timer):
+        if self._sound is None:
+            return
+        if timer and not self._playing:
+            self._sound.play(-1)
+            self._playing = True
+        elif not timer and self._playing:
+            self._sound.stop()
+            self._playing = False
@@ -0,0 +1,139 @@
+#!/usr/bin/python
+#* * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * *
+#*   chipy8 - tracer.py                                                    *
+#*   chipy8 homepage: http://code.google.com/p/chipy8/                     *
+#*   Copyright (C) 2009 olejl77@gmail.com                                  *
+#*                                                                         *
+#*   This program is free software: you can redistribute it and/or modify  *
+#*   it under the terms of the GNU General Public License as published by  *
+#*   the Free Software Foundation, either version 3 of the License, or     *
+#*   (at your option) any later version.                                   *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the          *
+#*   GNU General Public License for more details.                          *
+#*                                                                         *
+#*   You should have received a copy of the GNU General Public License     *
+#*   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+#* * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * */
+import sys
+import struct
+
+# PC, opcode, I, V0-VF as they were before the instruction executed
+RECORD = struct.Struct('<HHH16B')
+_head = struct.Struct('<HHH')
+
+class Trace:
+    """Ring buffer of the last size executed instructions.
+
+    Records are fixed-size binary (see RECORD) in one preallocated
+    bytearray, so recording costs a pack and a slice copy and nothing is
+    formatted until the trace is decoded.
+    """
+    def __init__(self, size = 4096):
+        self.size = size
+        self._buffer = bytearray(size * RECORD.size)
+        self._offset = 0
+        self._count = 0
+
+    def __len__(self):
+        return min(self._count, self.size)
+
+    def record(self, pc, word, i, reg):
+        buffer = self._buffer
+        offset = self._offset
+        _head.pack_into(buffer, offset, pc, word, i)
+        buffer[offset + _head.size:offset + RECORD.size] = reg.tostring()
+        offset = offset + RECORD.size
+        if offset == len(buffer):
+            offset = 0
+        self._offset = offset
+        self._count = self._count + 1
+
+    def data(self):
+        """Return the records oldest first as one string"""
+        split = self._offset
+        if self._count < self.size:
+            return str(self._buffer[:split])
+        return str(self._buffer[split:] + self._buffer[:split])
+
+    def save(self, filename):
+        with open(filename, "wb") as f:
+            f.write(self.data())
+
+def records(data):
+    """Yield (pc, word, i, registers) for every record in data"""
+    for offset in xrange(0, len(data) - RECORD.size + 1, RECORD.size):
+        fields = RECORD.unpack_from(data, offset)
+        yield fields[0], fields[1], fields[2], fields[3:]
+
+def disassemble(word):
+    """Return the mnemonic of a CHIP-8 instruction"""
+    n1 = (word >> 12) & 0x0f
+    x = (word >> 8) & 0x0f
+    y = (word >> 4) & 0x0f
+    n = word & 0x0f
+    kk = word & 0x00ff
+    nnn = word & 0x0fff
+    if word == 0x00e0:
+        return "CLS"
+    if word == 0x00ee:
+        return "RET"
+    if n1 == 0x0:
+        return "SYS  %03X" % nnn
+    if n1 == 0x1:
+        return "JP   %03X" % nnn
+    if n1 == 0x2:
+        return "CALL %03X" % nnn
+    if n1 == 0x3:
+        return "SE   V%X, %02X" % (x, kk)
+    if n1 == 0x4:
+        return "SNE  V%X, %02X" % (x, kk)
+    if n1 == 0x5 and n == 0x0:
+        return "SE   V%X, V%X" % (x, y)
+    if n1 == 0x6:
+        return "LD   V%X, %02X" % (x, kk)
+    if n1 == 0x7:
+        return "ADD  V%X, %02X" % (x, kk)
+    if n1 == 0x8 and n in _ALU:
+        return "%-4s V%X, V%X" % (_ALU[n], x, y)
+    if n1 == 0x9 and n == 0x0:
+        return "SNE  V%X, V%X" % (x, y)
+    if n1 == 0xa:
+        return "LD   I, %03X" % nnn
+    if n1 == 0xb:
+        return "JP   V0, %03X" % nnn
+    if n1 == 0xc:
+        return "RND  V%X, %02X" % (x, kk)
+    if n1 == 0xd:
+        return "DRW  V%X, V%X, %X" % (x, y, n)
+    if n1 == 0xe and kk == 0x9e:
+        return "SKP  V%X" % x
+    if n1 == 0xe and kk == 0xa1:
+        return "SKNP V%X" % x
+    if n1 == 0xf and kk in _MISC:
+        return _MISC[kk] % x
+    return "DW   %04X" % word
+
+_ALU = {0x0: "LD", 0x1: "OR", 0x2: "AND", 0x3: "XOR", 0x4: "ADD",
+        0x5: "SUB", 0x6: "SHR", 0x7: "SUBN", 0xe: "SHL"}
+_MISC = {0x07: "LD   V%X, DT", 0x0a: "LD   V%X, K", 0x15: "LD   DT, V%X",
+         0x18: "LD   ST, V%X", 0x1e: "ADD  I, V%X", 0x29: "LD   F, V%X",
+         0x33: "LD   B, V%X", 0x55: "LD   [I], V%X", 0x65: "LD   V%X, [I]"}
+
+def format_record(pc, word, i, reg):
+    return "%03X  %04X  %-16s I=%03X  %s" % (pc, word, disassemble(word), i,
+                                             " ".join(["%02X" % r for r in reg]))
+
+def dump(data, out = sys.stdout):
+    """Pretty-print the records in data"""
+    for record in records(data):
+        out.write(format_record(*record) + "\n")
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print "usage: %s TRACE" % sys.argv[0]
+        sys.exit(1)
+    with open(sys.argv[1], "rb") as f:
+        dump(f.read())
@@ -0,0 +1,304 @@
+#!/usr/bin/python
+#* * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * *
+#*   chipy8 - translator.py                                                *
+#*   chipy8 homepage: http://code.google.com/p/chipy8/                     *
+#*   Copyright (C) 2009 olejl77@gmail.com                                  *
+#*                                                                         *
+#*   This program is free software: you can redistribute it and/or modify  *
+#*   it under the terms of the GNU General Public License as published by  *
+#*   the Free Software Foundation, either version 3 of the License, or     *
+#*   (at your option) any later version.                                   *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the          *
+#*   GNU General Public License for more details.                          *
+#*                                                                         *
+#*   You should have received a copy of the GNU General Public License     *
+#*   along with this program.  If not, see <http://www.gnu.org/licenses/>. *
+#* * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * */
+from cpu import Cpu
+
+# Longest straight-line run translated into a single block
+MAX_BLOCK = 64
+
+class BlockCpu(Cpu):
+    """Cpu that translates basic blocks into Python functions.
+
+    Starting at the current PC, instructions are translated up to and
+    including the next jump, skip, call, return or memory write. The
+    generated function keeps registers and I in locals and is cached per
+    entry address until memory under it is written. Anything that can't
+    be translated is left to Cpu.execute.
+    """
+    def __init__(self, verbose, scale, headless = False, seed = None):
+        Cpu.__init__(self, verbose, scale, headless, seed)
+        # entry address -> (function, instruction count) or None
+        self._blocks = {}
+        # memory address -> entry addresses of blocks covering it
+        self._owners = {}
+        # Route every memory write (interpreted or translated) through
+        # the invalidation check
+        self._memory_write = self.memory.write
+        self.memory.write = self._write
+
+    def read_rom(self, filename):
+        Cpu.read_rom(self, filename)
+        self._blocks.clear()
+        self._owners.clear()
+
+    def step(self, n = 1):
+        if self._tracing:
+            return Cpu.step(self, n)
+        if self.halted and not self.key_mask():
+            return 0
+        blocks = self._blocks
+        PC = self._PC
+        execute = self.execute
+        idle = self.skip_idle and self._idle
+        remaining = n
+        while remaining > 0:
+            pc = PC[0]
+            try:
+                block = blocks[pc]
+            except KeyError:
+                block = self._translate(pc)
+            if block is None or block[1] > remaining:
+                execute()
+                remaining -= 1
+            else:
+                block[0]()
+                remaining -= block[1]
+            if PC[0] <= pc:
+                if self.halted:
+                    break
+                if idle:
+                    remaining -= idle.run(remaining)
+        return n - remaining
+
+    def _write(self, address, value):
+        self._memory_write(address, value)
+        for entry in self._owners.pop(address, ()):
+            self._blocks.pop(entry, None)
+
+    def _translate(self, address):
+        """Translate the block starting at address and cache it"""
+        mem = self.memory._memory
+        gen = _Generator()
+        pc = address
+        while gen.count < MAX_BLOCK and pc + 1 < len(mem):
+            word = (mem[pc] << 8) | mem[pc + 1]
+            if not gen.translate(word, pc):
+                break
+            pc = pc + 2
+            if gen.terminated:
+                break
+
+        block = None
+        if gen.count:
+            source = gen.source(pc)
+            namespace = {
+                'reg': self._reg,
+                'I': self._I,
+                'timer': self._timer,
+                'stack': self._stack,
+                'PC': self._PC,
+                'mem': mem,
+                'write': self.memory.write,
+                'draw8': self.video.draw8,
+                'erase': self.video.erase,
+                'randint': self._random.randint,
+                'keystate': self._keystate,
+            }
+            exec compile(source, '<block %03x>' % address, 'exec') in namespace
+            block = (namespace['block'], gen.count)
+        self._blocks[address] = block
+        # Cover at least the first instruction so untranslatable entries
+        # are retried when they are rewritten.
+        for i in xrange(address, max(pc, address + 2)):
+            self._owners.setdefault(i, []).append(address)
+        return block
+
+class _Generator:
+    """Generates the source of one block, mirroring Cpu.execute"""
+    def __init__(self):
+        self.count = 0
+        self.terminated = False
+        self.lines = []
+        self.used = set()
+        self.dirty = set()
+        self.uses_I = False
+        self.dirty_I = False
+
+    def emit(self, line):
+        self.lines.append(line)
+
+    def v(self, n, write = False):
+        self.used.add(n)
+        if write:
+            self.dirty.add(n)
+        return 'v%x' % n
+
+    def i(self, write = False):
+        self.uses_I = True
+        if write:
+            self.dirty_I = True
+        return 'ir'
+
+    def translate(self, word, pc):
+        """Emit code for word at pc. Returns False if it must be interpreted"""
+        n1 = (word >> 12) & 0x0f
+        n2 = (word >> 8) & 0x0f
+        n3 = (word >> 4) & 0x0f
+        n4 = word & 0x0f
+        kk = word & 0x00ff
+        nnn = word & 0x0fff
+        nxt = pc + 2
+        emit = self.emit
+        v = self.v
+
+        if n1 == 0x0:
+            if word == 0x00e0:
+                emit('erase()')
+            elif word == 0x00ee:
+                emit('pc = stack.pop()')
+                self.terminated = True
+            else:
+                return False
+        elif n1 == 0x1:
+            emit('pc = 0x%03x' % nnn)
+            self.terminated = True
+        elif n1 == 0x2:
+            emit('stack.append(0x%03x)' % nxt)
+            emit('pc = 0x%03x' % nnn)
+            self.terminated = True
+        elif n1 == 0x3:
+            emit('pc = 0x%03x if %s == 0x%02x else 0x%03x' % (nxt + 2, v(n2), kk, nxt))
+            self.terminated = True
+        elif n1 == 0x4:
+            emit('pc = 0x%03x if %s != 0x%02x else 0x%03x' % (nxt + 2, v(n2), kk, nxt))
+            self.terminated = True
+        elif n1 == 0x5 and n4 == 0x0:
+            emit('pc = 0x%03x if %s == %s else 0x%03x' % (nxt + 2, v(n2), v(n3), nxt))
+            self.terminated = True
+        elif n1 == 0x6:
+            emit('%s = 0x%02x' % (v(n2, True), kk))
+        elif n1 == 0x7:
+            emit('%s = (%s + 0x%02x) & 0xff' % (v(n2, True), v(n2), kk))
+        elif n1 == 0x8:
+            x = v(n2, True)
+            y = v(n3)
+            if n4 == 0x0:
+                emit('%s = %s' % (x, y))
+            elif n4 == 0x1:
+                emit('%s = %s | %s' % (x, x, y))
+            elif n4 == 0x2:
+                emit('%s = %s & %s' % (x, x, y))
+            elif n4 == 0x3:
+                emit('%s = %s ^ %s' % (x, x, y))
+            elif n4 == 0x4:
+                vf = v(0xf, True)
+                emit('if (%s + %s) > 0xff: %s = 1' % (x, y, vf))
+                emit('else: %s = 0' % vf)
+                emit('%s = (%s + %s) & 0xff' % (x, x, y))
+            elif n4 == 0x5:
+                vf = v(0xf, True)
+                emit('if %s < %s:' % (x, y))
+                emit('    %s = 0' % vf)
+                emit('    %s = (0x100 - (%s - %s)) & 0xff' % (x, y, x))
+                emit('else:')
+                emit('    %s = 1' % vf)
+                emit('    %s = (%s - %s) & 0xff' % (x, x, y))
+            elif n4 == 0x6:
+                vf = v(0xf, True)
+                emit('if %s > 127: %s = 1' % (x, vf))
+                emit('else: %s = 0' % vf)
+                emit('%s = (%s * 2) & 0xff' % (x, x))
+            elif n4 == 0x7:
+                vf = v(0xf, True)
+                emit('if %s < %s:' % (y, x))
+                emit('    %s = 0' % vf)
+                emit('    %s = (0x100 - (%s - %s)) & 0xff' % (x, x, y))
+                emit('else:')
+                emit('    %s = 1' % vf)
+                emit('    %s = (%s - %s) & 0xff' % (x, y, x))
+            elif n4 == 0xe:
+                vf = v(0xf, True)
+                emit('if (%s * 2) > 0xff: %s = 1' % (x, vf))
+                emit('else: %s = 0' % vf)
+                emit('%s = (%s * 2) & 0xff' % (x, x))
+            else:
+                return False
+        elif n1 == 0x9 and n4 == 0x0:
+            emit('pc = 0x%03x if %s != %s else 0x%03x' % (nxt + 2, v(n2), v(n3), nxt))
+            self.terminated = True
+        elif n1 == 0xa:
+            emit('%s = 0x%03x' % (self.i(True), nnn))
+        elif n1 == 0xb:
+            emit('pc = 0x%03x + %s' % (nnn, v(0)))
+            self.terminated = True
+        elif n1 == 0xc:
+            emit('%s = randint(0, 0x%02x)' % (v(n2, True), kk))
+        elif n1 == 0xd and n4 != 0:
+            i = self.i()
+            emit('%s = draw8(mem[%s:%s + %d], %s, %s)' % (v(0xf, True), i, i, n4, v(n2), v(n3)))
+        elif n1 == 0xe and n3 == 0x9 and n4 == 0xe:
+            emit('pc = 0x%03x if keystate[%d] == 1 else 0x%03x' % (nxt + 2, n2, nxt))
+            self.terminated = True
+        elif n1 == 0xe and n3 == 0xa and n4 == 0x1:
+            emit('pc = 0x%03x if keystate[%d] != 1 else 0x%03x' % (nxt + 2, n2, nxt))
+            self.terminated = True
+        elif n1 == 0xf and kk == 0x07:
+            emit('%s = timer[0] & 0xff' % v(n2, True))
+        elif n1 == 0xf and kk == 0x15:
+            emit('timer[0] = %s & 0xff' % v(n2))
+        elif n1 == 0xf and kk == 0x18:
+            emit('timer[1] = %s' % v(n2))
+        elif n1 == 0xf and kk == 0x1e:
+            emit('%s = %s + %s & 0xffff' % (self.i(True), self.i(), v(n2)))
+        elif n1 == 0xf and kk == 0x29:
+            emit('%s = (%s * 5) & 0xffff' % (self.i(True), v(n2)))
+        elif n1 == 0xf and kk == 0x33:
+            i = self.i()
+            x = v(n2)
+            emit('write(%s, %s / 100)' % (i, x))
+            emit('write(%s + 1, (%s %% 10) / 10)' % (i, x))
+            emit('write(%s + 2, %s %% 10)' % (i, x))
+            emit('pc = 0x%03x' % nxt)
+            self.terminated = True
+        elif n1 == 0xf and kk == 0x55:
+            i = self.i()
+            for r in xrange(n2 + 1):
+                emit('write(mem[%s + %d], %s)' % (i, r, v(r)))
+            emit('pc = 0x%03x' % nxt)
+            self.terminated = True
+        elif n1 == 0xf and kk == 0x65:
+            i = self.i()
+            for r in xrange(n2 + 1):
+                emit('%s = mem[%s + %d] & 0xff' % (v(r, True), i, r))
+        else:
+            return False
+
+        self.count += 1
+        return True
+
+    def source(self, end):
+        """Return the module source defining block(), falling through to end"""
+        if not self.terminated:
+            self.emit('pc = 0x%03x' % end)
+
+        args = ['reg=reg', 'I=I', 'timer=timer', 'stack=stack', 'PC=PC',
+                'mem=mem', 'write=write', 'draw8=draw8', 'erase=erase',
+                'randint=randint', 'keystate=keystate']
+        body = []
+        for n in sorted(self.used):
+            body.append('v%x = reg[%d]' % (n, n))
+        if self.uses_I:
+            body.append('ir = I[0]')
+        body.extend(self.lines)
+        for n in sorted(self.dirty):
+            body.append('reg[%d] = v%x' % (n, n))
+        if self.dirty_I:
+            body.append('I[0] = ir')
+        body.append('PC[0] = pc')
+        return 'def block(%s):\n    %s\n' % (', '.join(args), '\n    '.join(body))
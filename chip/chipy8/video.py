@@ -20,21 +20,50 @@
 import pygame
 import os
 import sys
+import binascii
 #import Numeric
 import numpy
 # for optimizing drawing:
 from pygame import surfarray
 
+# Sprite rows pre-shifted for every x position, keyed by display width.
+# _shift_tables[width][x][byte] is byte placed at column x (wrapping
+# around the right edge) in a row where column 0 is the highest bit.
+_shift_tables = {}
+
+def shift_table(width):
+    table = _shift_tables.get(width)
+    if table is None:
+        mask = (1 << width) - 1
+        table = []
+        for x in range(width):
+            row = []
+            for byte in range(256):
+                sprite = byte << (width - 8)
+                row.append(((sprite >> x) | (sprite << (width - x))) & mask)
+            table.append(row)
+        _shift_tables[width] = table
+    return table
+
 class Video:
-    def __init__(self, verbose = False, scale = 1):
+    def __init__(self, verbose = False, scale = 1, headless = False, size = (64, 32)):
         self.verbose = verbose
         self.scale = scale
-        self.arraysize = (64,32)
+        self.headless = headless
+        self.arraysize = size
+        self.width, self.height = size
         self.winsize = (self.arraysize[0] * self.scale, self.arraysize[1] * self.scale)
         self.__color_on = (0, 0, 0) # Black
         self.__color_off = (255, 240, 220) # White
-        self.pixel_data = numpy.zeros( (64,32), 'i' )
-        
+        # One integer per display row, column 0 is the most significant bit
+        self.rows = [0] * self.height
+        self._shift = shift_table(self.width)
+        # Rows changed since the last present()
+        self._dirty = set()
+        if self.headless:
+            # No display: only the framebuffer is maintained
+            return
+
         # Setup the pygame environment
         pygame.init()
         os.environ['SDL_VIDEO_CENTERED'] = '1'
@@ -49,27 +78,61 @@ class Video:
 
     def draw8(self, ylines, regX, regY):
         collision = 0
-        yline = 0
+        sprites = self._shift[regX % self.width]
+        rows = self.rows
+        height = self.height
+        y = regY
         for byte in ylines:
-            byte = ylines[yline]
-            for xline in range(8):
-                if (byte & (0x80>>xline)) != 0:
-                    x = (regX + xline) % 64
-                    y = (regY + yline) % 32
-                    if self.pixel_data[x][y] == 1:
-                        self.pixel_data[x][y] = 0
-                        collision = 1
-                    else:
-                        self.pixel_data[x][y] = 1
-            yline = yline + 1
-
-        surfarray.blit_array( self.scale_screen, self.pixel_data )
-        temp = pygame.transform.scale(self.scale_screen, self.screen.get_size())
-        self.screen.blit(temp, (0,0))
-        pygame.display.update()
+            y = y % height
+            sprite = sprites[byte]
+            row = rows[y]
+            if row & sprite:
+                collision = 1
+            rows[y] = row ^ sprite
+            self._dirty.add(y)
+            y = y + 1
         return collision
 
+    def present(self):
+        """Scale and update the rows drawn since the last call, once per frame"""
+        if self.headless or not self._dirty:
+            return
+        surfarray.blit_array( self.scale_screen, self.framebuffer().T )
+        rects = []
+        for top, bottom in self._dirty_bands():
+            source = self.scale_screen.subsurface((0, top, self.width, bottom - top))
+            rect = pygame.Rect(0, top * self.scale, self.winsize[0], (bottom - top) * self.scale)
+            pygame.transform.scale(source, rect.size, self.screen.subsurface(rect))
+            rects.append(rect)
+        self._dirty.clear()
+        pygame.display.update(rects)
+
+    def _dirty_bands(self):
+        """Yield (top, bottom) for each run of consecutive dirty rows"""
+        top = None
+        for y in range(self.height + 1):
+            if y in self._dirty:
+                if top is None:
+                    top = y
+            elif top is not None:
+                yield top, y
+                top = None
+
+    def set_rows(self, rows):
+        """Replace the display with rows (as in self.rows), marking the
+        rows that changed for the next present()"""
+        for y in range(self.height):
+            if self.rows[y] != rows[y]:
+                self.rows[y] = rows[y]
+                self._dirty.add(y)
+
     def erase(self):
-        self.screen.fill(self.__color_off)
-        pygame.display.flip()
+        self.rows[:] = [0] * self.height
+        self._dirty.update(range(self.height))
 
+    def framebuffer(self):
+        """Return a copy of the display as a (height, width) array of 0/1, indexed [y][x]"""
+        digits = self.width // 4
+        packed = ''.join([binascii.unhexlify('%0*x' % (digits, row)) for row in self.rows])
+        bits = numpy.unpackbits(numpy.frombuffer(packed, numpy.uint8))
+        return bits.reshape(self.height, self.width)
@@ -1,5 +1,160 @@
 import os,sys,pygame
+import numpy
+
+from chipy8.scheduler import Scheduler
+
 class CPU:
-	def __init__(self):
-		print ("Initializing CPU...\n")
-		
+	""" Common interface of the interpreter cores a Machine can drive
+
+	Every backend wraps one core behind the same methods. Keys are a 16-bit
+	mask (bit n = key n down), framebuffer() is a (height, width) array of
+	0/1 and snapshot() is the whole machine state as a byte string in the
+	core's own layout (only comparable between runs of the same backend).
+	step() and the cores themselves may raise SystemExit or any error on an
+	instruction they don't support.
+	"""
+	Name = None
+
+	def __init__(self, seed = None):
+		self.Seed = seed
+
+	def load(self, filename):
+		raise NotImplementedError
+
+	def step(self, count):
+		""" Execute up to count instructions and return how many ran """
+		raise NotImplementedError
+
+	def tick_timers(self):
+		""" Decrement the delay and sound timers, once per 60 Hz frame """
+		raise NotImplementedError
+
+	def set_keys(self, mask):
+		raise NotImplementedError
+
+	def framebuffer(self):
+		raise NotImplementedError
+
+	def snapshot(self):
+		raise NotImplementedError
+
+	def run_frames(self, frames, ips = 600):
+		""" Run frames 60 Hz frames uncapped and return the instruction count """
+		scheduler = Scheduler(ips, True)
+		executed = 0
+		for frame in xrange(frames):
+			executed += self.step(scheduler.instructions())
+			self.tick_timers()
+		return executed
+
+class ReferenceCPU(CPU):
+	""" chipy8's interpreter, every instruction decoded and run in turn """
+	Name = 'reference'
+
+	def load(self, filename):
+		from chipy8.cpu import Cpu
+		self.Core = self._create(Cpu)
+		self.Core.read_rom(filename)
+
+	def _create(self, cls):
+		core = cls(False, 1, True, self.Seed)
+		core.skip_idle = False
+		core.fuse = False
+		return core
+
+	def step(self, count):
+		return self.Core.step(count)
+
+	def tick_timers(self):
+		self.Core.tick_timers()
+
+	def set_keys(self, mask):
+		self.Core.set_keys(mask)
+
+	def framebuffer(self):
+		return self.Core.framebuffer()
+
+	def snapshot(self):
+		core = self.Core
+		return core._reg.tostring() + core._I.tostring() + \
+			core._PC.tostring() + core._stack.tostring() + \
+			core._timer.tostring() + str(core.memory._memory) + \
+			core.framebuffer().tostring()
+
+class BlockCPU(ReferenceCPU):
+	""" chipy8's block translator with idle loop skipping """
+	Name = 'block'
+
+	def load(self, filename):
+		from chipy8.translator import BlockCpu
+		self.Core = self._create(BlockCpu)
+		self.Core.skip_idle = True
+		self.Core.read_rom(filename)
+
+class CachedCPU(CPU):
+	""" xchipulator's Chip8CPU, decoded instructions cached per address """
+	Name = 'cached'
+
+	def load(self, filename):
+		from xchipulator_cpu import Chip8CPU
+		import headless
+		self.Gamepad = headless.Gamepad()
+		self.Core = Chip8CPU(self.Gamepad, headless.Canvas(), filename, self.Seed)
+
+	def step(self, count):
+		return self.Core.runCycles(count)
+
+	def tick_timers(self):
+		if(self.Core.getDelayTimer() > 0):
+			self.Core.decrementDelayTimer()
+		if(self.Core.getSoundTimer() > 0):
+			self.Core.decrementSoundTimer()
+
+	def set_keys(self, mask):
+		self.Gamepad.setMask(mask)
+
+	def framebuffer(self):
+		return numpy.asarray(self.Core.getVRAM(), numpy.uint8)
+
+	def snapshot(self):
+		return bytes(self.Core.coreDump())
+
+class AOTCPU(CachedCPU):
+	""" aot_cpu's AOTChip8CPU, the ROM compiled ahead of time into Python
+	functions with Chip8CPU interpreting the rest """
+	Name = 'aot'
+
+	def load(self, filename):
+		from aot_cpu import AOTChip8CPU
+		import headless
+		self.Gamepad = headless.Gamepad()
+		self.Core = AOTChip8CPU(self.Gamepad, headless.Canvas(), filename, self.Seed)
+
+class VectorCPU(CPU):
+	""" vector_cpu's VectorChip8CPU running a batch of one machine """
+	Name = 'vector'
+
+	def load(self, filename):
+		from vector_cpu import VectorChip8CPU
+		self.Core = VectorChip8CPU(1, filename, self.Seed)
+
+	def step(self, count):
+		self.Core.run(count)
+		if(self.Core.faulted[0]):
+			raise RuntimeError("Unsupported instruction at %03X" % self.Core.PC[0])
+		return count
+
+	def tick_timers(self):
+		self.Core.decrementTimers()
+
+	def set_keys(self, mask):
+		self.Core.setKeys([mask])
+
+	def framebuffer(self):
+		return self.Core.getVRAM()[0]
+
+	def snapshot(self):
+		core = self.Core
+		return ''.join([array[0].tostring() for array in
+			(core.V, core.I, core.PC, core.SP, core.stack, core.delayTimer,
+			 core.soundTimer, core.halted, core.memory, core.VRAM)])
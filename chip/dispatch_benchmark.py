@@ -0,0 +1,122 @@
+"""Compare chipy8's opcode table with the nibble-testing chain it replaced.
+
+For one instruction of every opcode class the cost of a dispatch is
+measured through Cpu.execute (one lookup in the 64K handler table) and
+through Cpu._execute_chain (four nibbles decoded, then tested in turn),
+with the cost of the timing loop itself taken off. Through the table
+only the work of the instruction differs between opcodes, through the
+chain the decoding grows with the position of the opcode in it. The game
+corpus is then run with each, with idle loop skipping and fusion off, for
+the overall instructions per second.
+
+usage: python dispatch_benchmark.py [options]
+
+"""
+import time
+import timeit
+from optparse import OptionParser
+
+from benchmark import keys, games
+from chipy8.scheduler import Scheduler
+
+# Opcode class -> an instance of it that can run over and over from 0x200
+# with every register 0 and I at 0x300
+WORDS = [
+    ('1NNN', 0x1200), ('3XKK', 0x3012), ('4XKK', 0x4012), ('5XY0', 0x5010),
+    ('6XKK', 0x6012), ('7XKK', 0x7012), ('8XY0', 0x8010), ('8XY1', 0x8011),
+    ('8XY2', 0x8012), ('8XY3', 0x8013), ('8XY4', 0x8014), ('8XY5', 0x8015),
+    ('8XY6', 0x8016), ('8XY7', 0x8017), ('8XYE', 0x801e), ('9XY0', 0x9010),
+    ('ANNN', 0xa300), ('BNNN', 0xb200), ('CXKK', 0xc0ff), ('DXYN', 0xd015),
+    ('EX9E', 0xe09e), ('EXA1', 0xe0a1), ('FX07', 0xf007), ('FX15', 0xf015),
+    ('FX18', 0xf018), ('FX1E', 0xf01e), ('FX29', 0xf029), ('FX33', 0xf033),
+    ('FX55', 0xf055), ('FX65', 0xf065),
+]
+START = 0x200
+
+def _newCpu():
+    from chipy8.cpu import Cpu
+    cpu = Cpu(False, 1, True, 0)
+    cpu.skip_idle = False
+    cpu.fuse = False
+    return cpu
+
+def timeWord(word, chain, count):
+    """Return the seconds one execution of word takes on average."""
+    cpu = _newCpu()
+    cpu.memory._memory[START] = word >> 8
+    cpu.memory._memory[START + 1] = word & 0xFF
+    cpu._I[0] = 0x300
+    if(chain):
+        execute = cpu._execute_chain
+    else:
+        execute = cpu.execute
+    # Once outside the timing so the table entry is built
+    cpu._PC[0] = START
+    execute()
+    PC = cpu._PC
+    clock = timeit.default_timer
+    start = clock()
+    for i in xrange(count):
+        PC[0] = START
+        execute()
+    elapsed = clock() - start
+    # The same loop around a call that does nothing
+    nothing = lambda: None
+    start = clock()
+    for i in xrange(count):
+        PC[0] = START
+        nothing()
+    overhead = clock() - start
+    return max(elapsed - overhead, 0.0) / count
+
+def runCorpus(roms, frames, ips, chain):
+    """Run every ROM and return the instructions executed and seconds."""
+    executed = 0
+    seconds = 0.0
+    for rom in roms:
+        cpu = _newCpu()
+        if(chain):
+            cpu.execute = cpu._execute_chain
+        cpu.read_rom(rom)
+        scheduler = Scheduler(ips, True)
+        start = time.time()
+        try:
+            for frame in xrange(frames):
+                cpu.set_keys(keys(frame))
+                executed += cpu.step(scheduler.instructions())
+                cpu.tick_timers()
+        except SystemExit:
+            # chipy8 exits on opcodes it doesn't implement
+            pass
+        seconds += time.time() - start
+    return executed, seconds
+
+def main():
+    parser = OptionParser("usage: %prog [options] [ROM...]")
+    parser.add_option('-n', '--count', action='store', dest='count', type='int', default=100000, help='How many times to execute each opcode')
+    parser.add_option('-f', '--frames', action='store', dest='frames', type='int', default=600, help='How many frames to run each game for')
+    parser.add_option('-i', '--ips', action='store', dest='ips', type='float', default=600, help='How many instructions to execute per emulated second')
+    (options, args) = parser.parse_args()
+    roms = args or games()
+
+    print "%-6s %10s %10s %8s" % ('opcode', 'chain ns', 'table ns', 'speedup')
+    costs = {False: [], True: []}
+    for name, word in WORDS:
+        chain = timeWord(word, True, options.count)
+        table = timeWord(word, False, options.count)
+        costs[True].append(chain)
+        costs[False].append(table)
+        print "%-6s %10.0f %10.0f %7.2fx" % \
+            (name, chain * 1e9, table * 1e9, chain / max(table, 1e-12))
+    print "%-6s %10.0f %10.0f %7.2fx" % \
+        ('mean', sum(costs[True]) / len(WORDS) * 1e9,
+         sum(costs[False]) / len(WORDS) * 1e9,
+         sum(costs[True]) / max(sum(costs[False]), 1e-12))
+
+    for chain, label in ((True, 'chain'), (False, 'table')):
+        executed, seconds = runCorpus(roms, options.frames, options.ips, chain)
+        print "%s: %d instructions in %.2f s, %.0f ips" % \
+            (label, executed, seconds, executed / max(seconds, 1e-9))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+class Gamepad:
+    """Stand-in gamepad for running a Chip8CPU without a front-end. Keys are
+    set from a 16-bit mask where bit n means key n is down.
+
+    """
+    def __init__(self):
+        self._keys = [0] * 16
+        self._mask = 0
+        self._lastKey = 0
+
+    def setMask(self, mask):
+        """Set the state of all 16 keys from a bit mask."""
+        pressed = mask & ~self._mask
+        for key in xrange(16):
+            self._keys[key] = (mask >> key) & 1
+            if((pressed >> key) & 1):
+                self._lastKey = key
+        self._mask = mask
+
+    def getMask(self):
+        """Return the state of all 16 keys as a bit mask."""
+        return self._mask
+
+    def keyIsDown(self, key):
+        return self._keys[key & 0xF]
+
+    def keyCount(self):
+        return sum(self._keys)
+
+    def lastKey(self):
+        return self._lastKey
+
+    def getKeyTable(self):
+        return list(self._keys)
+
+    def setKeyTable(self, keyTable):
+        mask = 0
+        for key in xrange(16):
+            if(keyTable[key]):
+                mask |= 1 << key
+        self.setMask(mask)
+
+class Canvas:
+    """Stand-in canvas that only records the display size."""
+    def __init__(self):
+        self.width = 64
+        self.height = 32
+
+    def setDisplayProperties(self, width, height):
+        self.width = width
+        self.height = height
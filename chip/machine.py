@@ -1,11 +1,117 @@
-import os,sys,pygame
+import os,sys,pygame,time
 import cpu
 
+# Backend name -> CPU subclass, see register()
+BACKENDS = {}
+# The backend the others are checked against
+REFERENCE = 'reference'
+# Backend names in the order select() tries them, fastest first as
+# benchmark.py measures them on the game corpus. The probes are too short to
+# time reliably, so timing them would pick differently from run to run
+PREFERENCE = ['cached', 'aot', 'block', REFERENCE, 'vector']
+# Length of the conformance check run by select()
+PROBE_FRAMES = 300
+PROBE_IPS = 6000
+
+def register(backend):
+	""" Make a CPU subclass available to Machine under its Name """
+	BACKENDS[backend.Name] = backend
+	if(backend.Name not in PREFERENCE):
+		PREFERENCE.append(backend.Name)
+	return backend
+
+for backend in (cpu.ReferenceCPU, cpu.CachedCPU, cpu.BlockCPU, cpu.AOTCPU,
+		cpu.VectorCPU):
+	register(backend)
+
+def probeKeys(frame):
+	""" Scripted input: every second, hold the next key for a third of it """
+	if(frame % 60 < 20):
+		return 1 << ((frame // 60) % 16)
+	return 0
+
+def probe(name, filename, frames = PROBE_FRAMES, ips = PROBE_IPS, seed = 0):
+	""" Run filename on a backend with scripted keys. Returns the framebuffer
+	of every frame, whether the backend stopped on an error and the seconds
+	taken by the second half of the frames, once caches and translations
+	have warmed up """
+	core = BACKENDS[name](seed)
+	screens = []
+	failed = False
+	start = None
+	try:
+		core.load(filename)
+		for frame in xrange(frames):
+			if(frame == frames // 2):
+				start = time.time()
+			core.set_keys(probeKeys(frame))
+			core.run_frames(1, ips)
+			screens.append(core.framebuffer().tostring())
+	except (Exception, SystemExit):
+		failed = True
+	if(start is None):
+		return screens, failed, float('inf')
+	return screens, failed, time.time() - start
+
+def select(filename, names = None, frames = PROBE_FRAMES, ips = PROBE_IPS):
+	""" Return the first backend in PREFERENCE that conforms to the
+	reference backend on filename: every frame drawn the same and no error.
+	Where the reference itself fails, a backend only has to match it up to
+	there and carry on without an error, and the reference is only picked
+	when nothing else runs the ROM. """
+	expected, referenceFailed, seconds = probe(REFERENCE, filename, frames, ips)
+	for name in PREFERENCE:
+		if(names and name not in names):
+			continue
+		if(name == REFERENCE):
+			if(not referenceFailed):
+				return name
+			continue
+		screens, failed, seconds = probe(name, filename, frames, ips)
+		if(not failed and screens[:len(expected)] == expected):
+			return name
+	return REFERENCE
+
 class Machine:
-	""" Main class for the Emulation Engine / Machine """
-	def __init__(self):
+	""" Main class for the Emulation Engine / Machine
+
+	Runs a ROM on one of the registered backends (see BACKENDS), chosen by
+	name or, with 'auto', by select() when the ROM is loaded. All of them are
+	driven through the same CPU interface. """
+	def __init__(self, backend = 'auto', seed = None):
 		self.Name = "Chip-8 Emulator"
 		self.Version = 0.1
 		print ("Initializing " + self.Name + " ", self.Version )
-		self.CPU = cpu.CPU()
-		
+		if(backend != 'auto' and backend not in BACKENDS):
+			raise ValueError("Unknown backend %r, choose from %s" %
+				(backend, ', '.join(sorted(BACKENDS))))
+		self.Backend = backend
+		self.Seed = seed
+		self.CPU = None
+
+	def load(self, filename):
+		""" Load a ROM, picking the backend first if it is 'auto' """
+		name = self.Backend
+		if(name == 'auto'):
+			name = select(filename)
+		self.CPU = BACKENDS[name](self.Seed)
+		self.CPU.load(filename)
+		return name
+
+	def step(self, count):
+		return self.CPU.step(count)
+
+	def tick_timers(self):
+		self.CPU.tick_timers()
+
+	def run_frames(self, frames, ips = 600):
+		return self.CPU.run_frames(frames, ips)
+
+	def set_keys(self, mask):
+		self.CPU.set_keys(mask)
+
+	def framebuffer(self):
+		return self.CPU.framebuffer()
+
+	def snapshot(self):
+		return self.CPU.snapshot()
@@ -0,0 +1,41 @@
+"""Profile which Chip8CPU opcode handlers dominate a ROM.
+
+usage: python profile_opcodes.py [-f FRAMES] [-c CSV] ROM
+
+"""
+import sys
+from optparse import OptionParser
+
+from xchipulator_cpu import Chip8CPU
+from benchmark import keys
+import headless
+
+def main():
+    parser = OptionParser("usage: %prog [options] ROM")
+    parser.add_option('-f', '--frames', action='store', dest='frames', type='int', default=600, help='How many frames to run')
+    parser.add_option('-n', '--cycles', action='store', dest='cycles', type='int', default=10, help='How many instructions to run per frame')
+    parser.add_option('-c', '--csv', action='store', dest='csv', default=None, help='Write the profile as CSV to this file')
+    (options, args) = parser.parse_args()
+    if len(args) != 1:
+        parser.error("Wrong number of arguments specified")
+
+    gamepad = headless.Gamepad()
+    cpu = Chip8CPU(gamepad, headless.Canvas(), args[0], 0)
+    cpu.enableProfiling()
+    for frame in xrange(options.frames):
+        gamepad.setMask(keys(frame))
+        for i in xrange(options.cycles):
+            cpu.nextCycle()
+        if cpu.getDelayTimer() > 0:
+            cpu.decrementDelayTimer()
+        if cpu.getSoundTimer() > 0:
+            cpu.decrementSoundTimer()
+    cpu.disableProfiling()
+
+    print cpu.profileTable()
+    if options.csv:
+        with open(options.csv, 'wb') as f:
+            cpu.writeProfileCSV(f)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+import numpy
+
+from xchipulator_cpu import STATE_SIZE, STATE_VRAM_OFFSET, STATE_MEMORY_OFFSET
+
+# A save state is compared with its keyframe in chunks: the header, each
+# 64 pixel VRAM row and each memory page.
+VRAM_ROW_SIZE = 64 // 8
+PAGE_SIZE = 0x100
+
+_CHUNK_STARTS = [0] + \
+    range(STATE_VRAM_OFFSET, STATE_MEMORY_OFFSET, VRAM_ROW_SIZE) + \
+    range(STATE_MEMORY_OFFSET, STATE_SIZE, PAGE_SIZE)
+_CHUNK_ENDS = _CHUNK_STARTS[1 : ] + [STATE_SIZE]
+_CHUNK_INDICES = numpy.array(_CHUNK_STARTS)
+
+class Rewind:
+    """Bounded history of Chip8CPU save states for rewinding.
+
+    record() is called once per frame. Every keyframeInterval frames a full
+    save state is kept as a keyframe; the frames in between only keep the
+    chunks (header, VRAM rows, memory pages) that differ from their
+    keyframe. Restoring any frame therefore costs one copy of the keyframe
+    plus one patch, however long the history is, and the oldest frames are
+    overwritten once the history is full.
+
+    """
+    def __init__(self, cpu, seconds=60, fps=60, keyframeInterval=60):
+        self._cpu = cpu
+        self._capacity = seconds * fps
+        self._keyframeInterval = keyframeInterval
+        # Ring of (keyframe, changed chunk indices, changed chunk data)
+        self._entries = [None] * self._capacity
+        self._next = 0
+        self._count = 0
+        self._keyframe = None
+        self._keyframeArray = None
+        self._sinceKeyframe = 0
+
+    def __len__(self):
+        return self._count
+
+    def record(self):
+        """Append the current CPU state to the history."""
+        state = self._cpu.coreDump()
+        if(self._keyframe is None or
+           self._sinceKeyframe >= self._keyframeInterval):
+            self._keyframe = bytes(state)
+            self._keyframeArray = numpy.frombuffer(self._keyframe, numpy.uint8)
+            self._sinceKeyframe = 0
+            entry = (self._keyframe, '', '')
+        else:
+            current = numpy.frombuffer(state, numpy.uint8)
+            changed = numpy.logical_or.reduceat(current != self._keyframeArray,
+                                                _CHUNK_INDICES)
+            chunks = numpy.flatnonzero(changed)
+            data = ''.join([bytes(state[_CHUNK_STARTS[i] : _CHUNK_ENDS[i]])
+                            for i in chunks])
+            entry = (self._keyframe, chunks.astype(numpy.uint8).tostring(), data)
+        self._sinceKeyframe += 1
+
+        self._entries[self._next] = entry
+        self._next = (self._next + 1) % self._capacity
+        self._count = min(self._count + 1, self._capacity)
+
+    def stateAt(self, age):
+        """Return the save state recorded age frames before the latest one."""
+        if(age < 0 or age >= self._count):
+            raise IndexError("Only %d frames of history" % self._count)
+        keyframe, chunks, data = \
+            self._entries[(self._next - 1 - age) % self._capacity]
+        state = bytearray(keyframe)
+        offset = 0
+        for i in bytearray(chunks):
+            start = _CHUNK_STARTS[i]
+            end = _CHUNK_ENDS[i]
+            state[start : end] = data[offset : offset + end - start]
+            offset += end - start
+        return state
+
+    def rewind(self, frames=1):
+        """Load the state recorded frames - 1 frames before the latest one
+        into the CPU and drop it and everything newer from the history.
+
+        """
+        state = self.stateAt(frames - 1)
+        for i in xrange(frames):
+            self._next = (self._next - 1) % self._capacity
+            self._entries[self._next] = None
+        self._count -= frames
+        # Later frames are recorded against a fresh keyframe
+        self._keyframe = None
+        self._cpu.unCoreDump(state)
@@ -9,8 +9,13 @@ import random
 import sys
 import time
 
+from array import array
 from pyglet.sprite import Sprite
 
+# The trace records and their disassembly are chipy8's, two levels up
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from chipy8 import tracer
+
 KEY_MAP = {pyglet.window.key._1: 0x1,
            pyglet.window.key._2: 0x2,
            pyglet.window.key._3: 0x3,
@@ -30,6 +35,20 @@ KEY_MAP = {pyglet.window.key._1: 0x1,
           }
           
 LOGGING = False
+
+# With LOGGING on, the last TRACE_SIZE instructions are kept in a
+# chipy8 tracer.Trace and printed on exit instead of logging every
+# instruction as it runs.
+TRACE_SIZE = 4096
+
+# Instructions executed per second, in batches of IPS / 60 per frame.
+# TURBO runs frames back to back without sleeping.
+IPS = 600
+TURBO = False
+
+# Seed for the emulator's own random number generator, None seeds it from
+# the system
+SEED = None
           
 def log(msg):
   if LOGGING:
@@ -85,44 +104,44 @@ class cpu (pyglet.window.Window):
       print "Unknown instruction: %X" % self.opcode
     
   def _0ZZ0(self):
-    log("Clears the screen")
+    # Clears the screen
     self.display_buffer = [0]*64*32 # 64*32
     self.should_draw = True
     
   def _0ZZE(self):
-    log("Returns from subroutine")
+    # Returns from subroutine
     self.pc = self.stack.pop()
       
   def _1ZZZ(self):
-    log("Jumps to address NNN.")
+    # Jumps to address NNN.
     self.pc = self.opcode & 0x0fff
     
   def _2ZZZ(self):
-    log("Calls subroutine at NNN.")
+    # Calls subroutine at NNN.
     self.stack.append(self.pc)
     self.pc = self.opcode & 0x0fff
       
   def _3ZZZ(self):
-    log("Skips the next instruction if VX equals NN.")
+    # Skips the next instruction if VX equals NN.
     if self.gpio[self.vx] == (self.opcode & 0x00ff):
       self.pc += 2
       
   def _4ZZZ(self):
-    log("Skips the next instruction if VX doesn't equal NN.")
+    # Skips the next instruction if VX doesn't equal NN.
     if self.gpio[self.vx] != (self.opcode & 0x00ff):
       self.pc += 2
       
   def _5ZZZ(self):
-    log("Skips the next instruction if VX equals VY.")
+    # Skips the next instruction if VX equals VY.
     if self.gpio[self.vx] == self.gpio[self.vy]:
       self.pc += 2
       
   def _6ZZZ(self):
-    log("Sets VX to NN.")
+    # Sets VX to NN.
     self.gpio[self.vx] = self.opcode & 0x00ff
     
   def _7ZZZ(self):
-    log("Adds NN to VX.")
+    # Adds NN to VX.
     self.gpio[self.vx] += (self.opcode & 0xff)
     
   def _8ZZZ(self):
@@ -134,27 +153,27 @@ class cpu (pyglet.window.Window):
       print "Unknown instruction: %X" % self.opcode
     
   def _8ZZ0(self):
-    log("Sets VX to the value of VY.")
+    # Sets VX to the value of VY.
     self.gpio[self.vx] = self.gpio[self.vy]
     self.gpio[self.vx] &= 0xff
   
   def _8ZZ1(self):  
-    log("Sets VX to VX or VY.")
+    # Sets VX to VX or VY.
     self.gpio[self.vx] |= self.gpio[self.vy]
     self.gpio[self.vx] &= 0xff
     
   def _8ZZ2(self):
-    log("Sets VX to VX and VY.")
+    # Sets VX to VX and VY.
     self.gpio[self.vx] &= self.gpio[self.vy]
     self.gpio[self.vx] &= 0xff
     
   def _8ZZ3(self):
-    log("Sets VX to VX xor VY.")
+    # Sets VX to VX xor VY.
     self.gpio[self.vx] ^= self.gpio[self.vy]
     self.gpio[self.vx] &= 0xff
     
   def _8ZZ4(self):
-    log("Adds VY to VX. VF is set to 1 when there's a carry, and to 0 when there isn't.")
+    # Adds VY to VX. VF is set to 1 when there's a carry, and to 0 when there isn't.
     if self.gpio[self.vx] + self.gpio[self.vy] > 0xff:
       self.gpio[0xf] = 1
     else:
@@ -163,7 +182,7 @@ class cpu (pyglet.window.Window):
     self.gpio[self.vx] &= 0xff
     
   def _8ZZ5(self):
-    log("VY is subtracted from VX. VF is set to 0 when there's a borrow, and 1 when there isn't")
+    # VY is subtracted from VX. VF is set to 0 when there's a borrow, and 1 when there isn't
     if self.gpio[self.vy] > self.gpio[self.vx]:
       self.gpio[0xf] = 0
     else:
@@ -172,12 +191,12 @@ class cpu (pyglet.window.Window):
     self.gpio[self.vx] &= 0xff
     
   def _8ZZ6(self):
-    log("Shifts VX right by one. VF is set to the value of the least significant bit of VX before the shift.")
+    # Shifts VX right by one. VF is set to the value of the least significant bit of VX before the shift.
     self.gpio[0xf] = self.gpio[self.vx] & 0x0001
     self.gpio[self.vx] = self.gpio[self.vx] >> 1
     
   def _8ZZ7(self):
-    log("Sets VX to VY minus VX. VF is set to 0 when there's a borrow, and 1 when there isn't.")
+    # Sets VX to VY minus VX. VF is set to 0 when there's a borrow, and 1 when there isn't.
     if self.gpio[self.vx] > self.gpio[self.vy]:
       self.gpio[0xf] = 0
     else:
@@ -186,32 +205,32 @@ class cpu (pyglet.window.Window):
     self.gpio[self.vx] &= 0xff
     
   def _8ZZE(self):
-    log("Shifts VX left by one. VF is set to the value of the most significant bit of VX before the shift.")
+    # Shifts VX left by one. VF is set to the value of the most significant bit of VX before the shift.
     self.gpio[0xf] = (self.gpio[self.vx] & 0x00f0) >> 7
     self.gpio[self.vx] = self.gpio[self.vx] << 1
     self.gpio[self.vx] &= 0xff
       
   def _9ZZZ(self):
-    log("Skips the next instruction if VX doesn't equal VY.")
+    # Skips the next instruction if VX doesn't equal VY.
     if self.gpio[self.vx] != self.gpio[self.vy]:
       self.pc += 2
       
   def _AZZZ(self):
-    log("Sets I to the address NNN.")
+    # Sets I to the address NNN.
     self.index = self.opcode & 0x0fff
     
   def _BZZZ(self):
-    log("Jumps to the address NNN plus V0.")
+    # Jumps to the address NNN plus V0.
     self.pc = (self.opcode & 0x0fff) + self.gpio[0]
     
   def _CZZZ(self):
-    log("Sets VX to a random number and NN.")
-    r = int(random.random() * 0xff)
+    # Sets VX to a random number and NN.
+    r = int(self.random.random() * 0xff)
     self.gpio[self.vx] = r & (self.opcode & 0x00ff)
     self.gpio[self.vx] &= 0xff
     
   def _DZZZ(self):
-    log("Draw a sprite")
+    # Draw a sprite
     # Draws a sprite at coordinate (VX, VY) that has a width of 8 pixels
     # and a height of N pixels. Each row of 8 pixels is read as bit-coded
     # (with the most significant bit of each byte displayed on the left)
@@ -251,13 +270,13 @@ class cpu (pyglet.window.Window):
       print "Unknown instruction: %X" % self.opcode
     
   def _EZZE(self):
-    log("Skips the next instruction if the key stored in VX is pressed.")
+    # Skips the next instruction if the key stored in VX is pressed.
     key = self.gpio[self.vx] & 0xf
     if self.key_inputs[key] == 1:
       self.pc += 2
       
   def _EZZ1(self):
-    log("Skips the next instruction if the key stored in VX isn't pressed.")
+    # Skips the next instruction if the key stored in VX isn't pressed.
     key = self.gpio[self.vx] & 0xf
     if self.key_inputs[key] == 0:
       self.pc += 2
@@ -270,27 +289,30 @@ class cpu (pyglet.window.Window):
       print "Unknown instruction: %X" % self.opcode
     
   def _FZ07(self):
-    log("Sets VX to the value of the delay timer.")
+    # Sets VX to the value of the delay timer.
     self.gpio[self.vx] = self.delay_timer
     
   def _FZ0A(self):
-    log("A key press is awaited, and then stored in VX.")
+    # A key press is awaited, and then stored in VX.
     ret = self.get_key()
     if ret >= 0:
       self.gpio[self.vx] = ret
+      self.key_wait = False
     else:
+      # halt here, main() runs no cycles until on_key_press wakes us
+      self.key_wait = True
       self.pc -= 2
       
   def _FZ15(self):
-    log("Sets the delay timer to VX.")
+    # Sets the delay timer to VX.
     self.delay_timer = self.gpio[self.vx]
     
   def _FZ18(self):
-    log("Sets the sound timer to VX.")
+    # Sets the sound timer to VX.
     self.sound_timer = self.gpio[self.vx]
     
   def _FZ1E(self):
-    log("Adds VX to I. if overflow, vf = 1")
+    # Adds VX to I. if overflow, vf = 1
     self.index += self.gpio[self.vx]
     if self.index > 0xfff:
       self.gpio[0xf] = 1
@@ -299,13 +321,13 @@ class cpu (pyglet.window.Window):
       self.gpio[0xf] = 0
       
   def _FZ29(self):
-    log("Set index to point to a character")
+    # Set index to point to a character
     # Sets I to the location of the sprite for the character in VX.
     # Characters 0-F (in hexadecimal) are represented by a 4x5 font.
     self.index = (5*(self.gpio[self.vx])) & 0xfff
     
   def _FZ33(self):
-    log("Store a number as BCD")
+    # Store a number as BCD
     # Stores the Binary-coded decimal representation of VX, with the
     # most significant of three digits at the address in I, the middle
     # digit at I plus 1, and the least significant digit at I plus 2.
@@ -314,7 +336,7 @@ class cpu (pyglet.window.Window):
     self.memory[self.index+2] = self.gpio[self.vx] % 10
     
   def _FZ55(self):
-    log("Stores V0 to VX in memory starting at address I.")
+    # Stores V0 to VX in memory starting at address I.
     i = 0
     while i <= self.vx:
       self.memory[self.index + i] = self.gpio[i]
@@ -322,7 +344,7 @@ class cpu (pyglet.window.Window):
     self.index += (self.vx) + 1
     
   def _FZ65(self):
-    log("Fills V0 to VX with values from memory starting at address I.")
+    # Fills V0 to VX with values from memory starting at address I.
     i = 0
     while i <= self.vx:
       self.gpio[i] = self.memory[self.index + i]
@@ -331,7 +353,12 @@ class cpu (pyglet.window.Window):
   # end instructions
   
   def __init__(self, *args, **kwargs):
-    super(cpu, self).__init__(*args, **kwargs)
+    # headless=True skips the window so the interpreter can be driven
+    # directly with cycle() and tick_timers(), e.g. by a benchmark
+    self.headless = kwargs.pop('headless', False)
+    if not self.headless:
+      super(cpu, self).__init__(*args, **kwargs)
+    self.random = random.Random(SEED)
     self.funcmap = {0x0000: self._0ZZZ,
                     0x00e0: self._0ZZ0,
                     0x00ee: self._0ZZE,
@@ -373,7 +400,8 @@ class cpu (pyglet.window.Window):
                     }
   
   def load_rom(self, rom_path):
-    log("Loading %s..." % rom_path)
+    if LOGGING:
+      log("Loading %s..." % rom_path)
     binary = open(rom_path, "rb").read()
     i = 0
     while i < len(binary):
@@ -381,7 +409,8 @@ class cpu (pyglet.window.Window):
       i += 1
   
   def initialize(self):
-    self.clear()
+    if not self.headless:
+      self.clear()
     self.memory = [0]*4096 # max 4096
     self.gpio = [0]*16 # max 16
     self.display_buffer = [0]*64*32 # 64*32
@@ -405,7 +434,6 @@ class cpu (pyglet.window.Window):
   def cycle(self):
     # 1. get op (op code plus operand)
     self.opcode = (self.memory[self.pc] << 8) | self.memory[self.pc + 1]
-    log("Current opcode: %X" % self.opcode)
     self.pc += 2
     self.vx = (self.opcode & 0x0f00) >> 8
     self.vy = (self.opcode & 0x00f0) >> 4
@@ -417,26 +445,43 @@ class cpu (pyglet.window.Window):
     except:
       print "Unknown instruction: %X" % self.opcode
     
+  def enable_trace(self):
+    # cycle is swapped for the recording version, so it costs nothing
+    # while tracing is off
+    self.trace = tracer.Trace(TRACE_SIZE)
+    self.cycle = self.traced_cycle
+
+  def traced_cycle(self):
+    pc = self.pc
+    self.trace.record(pc, (self.memory[pc] << 8) | self.memory[pc + 1],
+                      self.index & 0xffff,
+                      array('B', [v & 0xff for v in self.gpio]))
+    cpu.cycle(self)
+
+  def dump_trace(self):
+    # oldest record first, disassembled
+    tracer.dump(self.trace.data())
+    
+  def tick_timers(self):
+    # called once per 60 Hz frame
     if self.delay_timer > 0:
       self.delay_timer -= 1
     if self.sound_timer > 0:
       self.sound_timer -= 1
-      if self.sound_timer == 0:
+      if self.sound_timer == 0 and not self.headless:
         self.buzz.play()
 
-  def draw(self):
-    if self.should_draw:
-      # draw
-      self.clear()
-      line_counter = 0
-      i = 0
-      while i < 2048:
-        if self.display_buffer[i] == 1:
-          # draw a square pixel
-          self.pixel.blit((i%64)*10, 310 - ((i/64)*10))
-        i += 1
-      self.flip()
-      self.should_draw = False
+  def on_draw(self):
+    # pyglet.app calls this and flips the window after every frame(), so
+    # the whole display is drawn every time
+    self.clear()
+    i = 0
+    while i < 2048:
+      if self.display_buffer[i] == 1:
+        # draw a square pixel
+        self.pixel.blit((i%64)*10, 310 - ((i/64)*10))
+      i += 1
+    self.should_draw = False
 
   def get_key(self):
     i = 0
@@ -447,7 +492,8 @@ class cpu (pyglet.window.Window):
     return -1
     
   def on_key_press(self, symbol, modifiers):
-    log("Key pressed: %r" % symbol)
+    if LOGGING:
+      log("Key pressed: %r" % symbol)
     if symbol in KEY_MAP.keys():
       self.key_inputs[KEY_MAP[symbol]] = 1
       if self.key_wait:
@@ -456,30 +502,53 @@ class cpu (pyglet.window.Window):
       super(cpu, self).on_key_press(symbol, modifiers)
 
   def on_key_release(self, symbol, modifiers):
-    log("Key released: %r" % symbol)
+    if LOGGING:
+      log("Key released: %r" % symbol)
     if symbol in KEY_MAP.keys():
       self.key_inputs[KEY_MAP[symbol]] = 0
       
+  def frame(self, dt):
+    # one 60 Hz frame of IPS / 60 cycles, scheduled by main()
+    self.budget += IPS / 60.0
+    while self.budget >= 1 and not self.key_wait:
+      self.cycle()
+      self.budget -= 1
+    if self.key_wait:
+      # halted on FX0A, don't save up cycles for when a key comes
+      self.budget = 0.0
+    self.tick_timers()
+
   def main(self):
     if len(sys.argv) <= 1:
       print "Usage: python chip8.py <path to chip8 rom> <log>"
       print "where: <path to chip8 rom> - path to Chip8 rom"
-      print "     : <log> - if present, prints log messages to console"
+      print "     : <log> - if present, prints log messages and the last"
+      print "               instructions executed to console"
       return
     self.initialize()
     self.load_rom(sys.argv[1])
-    while not self.has_exit:
-      self.dispatch_events()    
-      self.cycle()
-      self.draw()
+    if LOGGING:
+      self.enable_trace()
+    # pyglet.app sleeps until the next scheduled frame and dispatches
+    # input and drawing in between, so nothing here busy-waits
+    self.budget = 0.0
+    if TURBO:
+      pyglet.clock.schedule(self.frame)
+    else:
+      pyglet.clock.schedule_interval(self.frame, 1.0 / 60)
+    pyglet.app.run()
+    if LOGGING:
+      self.dump_trace()
 
 
 # begin emulating!
-if len(sys.argv) == 3:
-  if sys.argv[2] == "log":
-    LOGGING = True
-      
-chip8emu = cpu(640, 320)
-chip8emu.main()
-log("... done.")
+if __name__ == '__main__':
+  if len(sys.argv) == 3:
+    if sys.argv[2] == "log":
+      LOGGING = True
+        
+  chip8emu = cpu(640, 320)
+  chip8emu.main()
+  if LOGGING:
+    log("... done.")
 
@@ -0,0 +1,519 @@
+import random
+
+import numpy
+
+from xchipulator_cpu import FONT, SPRITE_BITS
+
+class VectorChip8CPU:
+    """Runs many chip8 machines in lockstep with all state in NumPy arrays.
+
+    Each step fetches one instruction per machine, groups the machines by
+    opcode and executes every opcode class as one vectorized operation
+    over the machines sitting on it. Opcode semantics follow Chip8CPU in
+    standard (64x32) display mode, including a return on an empty stack,
+    which wraps round to its last entry. A machine that executes
+    something Chip8CPU would fail on (an unknown opcode, more than 16
+    nested calls, more than 16 returns past an empty stack) or that
+    enables extended display mode is marked faulted and stops stepping.
+
+    """
+    def __init__(self, count, filename, seed=None):
+        """Create count machines running the ROM in filename. Every
+        machine draws from a random number generator of its own, machine i
+        seeded with seed + i, so machine 0 draws what a Chip8CPU seeded
+        with seed would. Without a seed the base is unpredictable.
+
+        """
+        self.count = count
+        self._machines = numpy.arange(count)
+        if(seed is None):
+            # One unpredictable base, seeding from the OS per machine is slow
+            seed = random.getrandbits(64)
+        self._randoms = [random.Random(seed + i) for i in xrange(count)]
+        self._draws = [generator.random for generator in self._randoms]
+
+        fh = open(filename, 'rb')
+        self._ROM = numpy.frombuffer(fh.read(), numpy.uint8)
+        fh.close()
+
+        self.memory = numpy.zeros((count, 0x1000), numpy.uint8)
+        self.V = numpy.zeros((count, 16), numpy.uint8)
+        self.I = numpy.zeros(count, numpy.int64)
+        self.PC = numpy.zeros(count, numpy.int64)
+        self.SP = numpy.zeros(count, numpy.int64)
+        self.stack = numpy.zeros((count, 16), numpy.int64)
+        self.hp48Flags = numpy.zeros((count, 8), numpy.uint8)
+        self.delayTimer = numpy.zeros(count, numpy.int64)
+        self.soundTimer = numpy.zeros(count, numpy.int64)
+        self.halted = numpy.zeros(count, numpy.uint8)
+        self.faulted = numpy.zeros(count, numpy.bool_)
+        self.keys = numpy.zeros((count, 16), numpy.bool_)
+        self.lastKey = numpy.zeros(count, numpy.int64)
+        self.VRAM = numpy.zeros((count, 32, 64), numpy.uint8)
+        self.reset()
+
+        # Handlers per opcode class, nested classes are keyed by the
+        # low nibble (0x8, 0xE) or low byte (0xF)
+        self._optable_main = {
+            0x0: self._op_0_nest,
+            0x1: self._op_jmp,
+            0x2: self._op_jsr,
+            0x3: self._op_skeq,
+            0x4: self._op_skne,
+            0x5: self._op_sker,
+            0x6: self._op_mov,
+            0x7: self._op_add,
+            0x8: self._op_8_nest,
+            0x9: self._op_skner,
+            0xA: self._op_mvi,
+            0xB: self._op_jmi,
+            0xC: self._op_rand,
+            0xD: self._op_sprite,
+            0xE: self._op_E_nest,
+            0xF: self._op_F_nest
+        }
+
+        self._optable_8 = {
+            0x0: self._op_movr,
+            0x1: self._op_or,
+            0x2: self._op_and,
+            0x3: self._op_xor,
+            0x4: self._op_addr,
+            0x5: self._op_sub,
+            0x6: self._op_shr,
+            0x7: self._op_rsb,
+            0xE: self._op_shl
+        }
+
+        self._optable_F = {
+            0x07: self._op_gdelay,
+            0x0A: self._op_key,
+            0x15: self._op_sdelay,
+            0x18: self._op_ssound,
+            0x1E: self._op_adi,
+            0x29: self._op_nfnt,
+            0x30: self._op_efnt,
+            0x33: self._op_bcd,
+            0x55: self._op_str,
+            0x65: self._op_ldr,
+            0x75: self._op_shpf,
+            0x85: self._op_lhpf,
+        }
+
+    def reset(self):
+        """Reset every machine to power-on state with the ROM loaded."""
+        self.memory.fill(0)
+        self.memory[:, : len(FONT)] = FONT
+        self.memory[:, 0x200 : 0x200 + len(self._ROM)] = self._ROM
+        self.V.fill(0)
+        self.I.fill(0)
+        self.PC.fill(0x200)
+        self.SP.fill(0)
+        self.stack.fill(0)
+        self.hp48Flags.fill(0)
+        self.delayTimer.fill(0)
+        self.soundTimer.fill(0)
+        self.halted.fill(0)
+        self.faulted.fill(False)
+        self.VRAM.fill(0)
+
+    def setSeeds(self, seeds):
+        """Reseed the random number generator of every machine, one seed
+        per machine.
+
+        """
+        for generator, seed in zip(self._randoms, seeds):
+            generator.seed(seed)
+
+    def setKeys(self, masks):
+        """Set the keypad of every machine from 16-bit key masks."""
+        masks = numpy.asarray(masks, numpy.int64)
+        bits = (masks[:, numpy.newaxis] >> numpy.arange(16)) & 1
+        pressed = bits.astype(numpy.bool_) & ~self.keys
+        # The highest newly pressed key becomes the last key
+        hit = pressed.any(axis=1)
+        self.lastKey[hit] = 15 - numpy.argmax(pressed[hit, ::-1], axis=1)
+        self.keys[:] = bits
+
+    def decrementTimers(self):
+        """Decrement the delay and sound timers, once per 60 Hz frame."""
+        self.delayTimer -= self.delayTimer > 0
+        self.soundTimer -= self.soundTimer > 0
+
+    def getVRAM(self):
+        """Return the VRAM of all machines, shaped (count, 32, 64)."""
+        return self.VRAM
+
+    def step(self):
+        """Execute one instruction on every machine that hasn't faulted."""
+        if(self.faulted.any()):
+            m = numpy.flatnonzero(~self.faulted)
+        else:
+            m = self._machines
+        pc = self.PC[m]
+        op = (self.memory[m, pc & 0xFFF].astype(numpy.int64) << 8) | \
+            self.memory[m, (pc + 1) & 0xFFF]
+        self._dispatch(self._optable_main, op >> 12, m, op)
+
+    def run(self, cycles):
+        """Execute cycles instructions on every machine."""
+        for i in xrange(cycles):
+            self.step()
+
+    def runFrames(self, frames, cyclesPerFrame):
+        """Run frames frames of cyclesPerFrame instructions each."""
+        for frame in xrange(frames):
+            for i in xrange(cyclesPerFrame):
+                self.step()
+            self.decrementTimers()
+
+    def _dispatch(self, table, keys, m, op):
+        """Call table[key] once for each distinct key with the machines
+        (and their opcodes) that have that key. Unknown keys fault.
+
+        """
+        if(len(m) == 0):
+            return
+        first = keys[0]
+        if((keys == first).all()):
+            # Common case: everyone on the same opcode class
+            groups = [(first, m, op)]
+        else:
+            order = numpy.argsort(keys, kind='mergesort')
+            keys = keys[order]
+            m = m[order]
+            op = op[order]
+            bounds = numpy.flatnonzero(keys[1 : ] != keys[ : -1]) + 1
+            starts = numpy.concatenate(([0], bounds))
+            ends = numpy.concatenate((bounds, [len(keys)]))
+            groups = [(keys[s], m[s : e], op[s : e]) for s, e in zip(starts, ends)]
+        for key, gm, gop in groups:
+            handler = table.get(int(key))
+            if(handler is None):
+                self.faulted[gm] = True
+            else:
+                handler(gm, gop)
+
+    def _op_0_nest(self, m, op):
+        """Nested opcodes in the 0x0 range"""
+        Y = (op >> 4) & 0xF
+        NN = op & 0xFF
+        scd = Y == 0xC
+        if(scd.any()):
+            self._op_scd(m[scd], op[scd])
+        for code, handler in ((0xE0, self._op_cls), (0xEE, self._op_rts),
+                              (0xFB, self._op_scr), (0xFC, self._op_scl),
+                              (0xFD, self._op_end), (0xFE, self._op_dex)):
+            sel = NN == code
+            if(sel.any()):
+                handler(m[sel])
+        # Anything else in 0xE? / 0xF? is unknown to Chip8CPU, 00FF needs
+        # extended mode. Other 0x0 opcodes do nothing (and don't advance).
+        unknown = ((Y == 0xE) & (NN != 0xE0) & (NN != 0xEE)) | \
+            ((Y == 0xF) & (NN < 0xFB))
+        self.faulted[m[unknown | (NN == 0xFF)]] = True
+
+    def _op_8_nest(self, m, op):
+        self._dispatch(self._optable_8, op & 0xF, m, op)
+
+    def _op_E_nest(self, m, op):
+        N = op & 0xF
+        key = self.keys[m, self.V[m, (op >> 8) & 0xF] & 0xF]
+        down = N == 0xE
+        up = N == 0x1
+        self.PC[m[down]] += numpy.where(key[down], 4, 2)
+        self.PC[m[up]] += numpy.where(key[up], 2, 4)
+        self.faulted[m[~(down | up)]] = True
+
+    def _op_F_nest(self, m, op):
+        self._dispatch(self._optable_F, op & 0xFF, m, op)
+
+    def _op_scd(self, m, op):
+        """SCHIP scd (0x00CN): Scroll down N lines"""
+        N = op & 0xF
+        for lines in numpy.unique(N):
+            sel = m[N == lines]
+            if(lines):
+                self.VRAM[sel, lines : ] = self.VRAM[sel, : -lines]
+                self.VRAM[sel, : lines] = 0
+        self.PC[m] += 2
+
+    def _op_scr(self, m):
+        """SCHIP scr (0x00FB): Scroll right 2 pixels"""
+        self.VRAM[m, :, 2 : ] = self.VRAM[m, :, : -2]
+        self.VRAM[m, :, : 2] = 0
+        self.PC[m] += 2
+
+    def _op_scl(self, m):
+        """SCHIP scl (0x00FC): Scroll left 2 pixels"""
+        self.VRAM[m, :, : -2] = self.VRAM[m, :, 2 : ]
+        self.VRAM[m, :, -2 : ] = 0
+        self.PC[m] += 2
+
+    def _op_end(self, m):
+        """SCHIP end (0x00FD): Halt"""
+        self.halted[m] = 1
+
+    def _op_dex(self, m):
+        """SCHIP dex (0x00FE): Standard display mode, clears the VRAM"""
+        self.VRAM[m] = 0
+        self.PC[m] += 2
+
+    def _op_cls(self, m):
+        """cls (0x00E0)"""
+        self.VRAM[m] = 0
+        self.PC[m] += 2
+
+    def _op_rts(self, m):
+        """rts (0x00EE). Like Chip8CPU's list, an empty stack wraps round
+        to its last entry and only 16 returns too many fault
+
+        """
+        self.SP[m] -= 1
+        self.PC[m] = self.stack[m, self.SP[m] % 16] + 2
+        self.faulted[m[self.SP[m] < -16]] = True
+
+    def _op_jmp(self, m, op):
+        """jmp (0x1NNN), jumping to itself halts"""
+        NNN = op & 0xFFF
+        self.halted[m[NNN == self.PC[m]]] = 1
+        self.PC[m] = NNN
+
+    def _op_jsr(self, m, op):
+        """jsr (0x2NNN)"""
+        SP = self.SP[m]
+        overflow = SP >= 16
+        self.faulted[m[overflow]] = True
+        m = m[~overflow]
+        self.stack[m, SP[~overflow]] = self.PC[m]
+        self.SP[m] += 1
+        self.PC[m] = op[~overflow] & 0xFFF
+
+    def _op_skeq(self, m, op):
+        """skeq (0x3XNN)"""
+        equal = self.V[m, (op >> 8) & 0xF] == (op & 0xFF)
+        self.PC[m] += numpy.where(equal, 4, 2)
+
+    def _op_skne(self, m, op):
+        """skne (0x4XNN)"""
+        equal = self.V[m, (op >> 8) & 0xF] == (op & 0xFF)
+        self.PC[m] += numpy.where(equal, 2, 4)
+
+    def _op_sker(self, m, op):
+        """sker (0x5XY0)"""
+        equal = self.V[m, (op >> 8) & 0xF] == self.V[m, (op >> 4) & 0xF]
+        self.PC[m] += numpy.where(equal, 4, 2)
+
+    def _op_mov(self, m, op):
+        """mov (0x6XNN)"""
+        self.V[m, (op >> 8) & 0xF] = op & 0xFF
+        self.PC[m] += 2
+
+    def _op_add(self, m, op):
+        """add (0x7XNN)"""
+        X = (op >> 8) & 0xF
+        self.V[m, X] = (self.V[m, X] + (op & 0xFF)) & 0xFF
+        self.PC[m] += 2
+
+    def _op_movr(self, m, op):
+        """movr (0x8XY0)"""
+        self.V[m, (op >> 8) & 0xF] = self.V[m, (op >> 4) & 0xF]
+        self.PC[m] += 2
+
+    def _op_or(self, m, op):
+        """or (0x8XY1)"""
+        X = (op >> 8) & 0xF
+        self.V[m, X] |= self.V[m, (op >> 4) & 0xF]
+        self.PC[m] += 2
+
+    def _op_and(self, m, op):
+        """and (0x8XY2)"""
+        X = (op >> 8) & 0xF
+        self.V[m, X] &= self.V[m, (op >> 4) & 0xF]
+        self.PC[m] += 2
+
+    def _op_xor(self, m, op):
+        """xor (0x8XY3)"""
+        X = (op >> 8) & 0xF
+        self.V[m, X] ^= self.V[m, (op >> 4) & 0xF]
+        self.PC[m] += 2
+
+    def _op_addr(self, m, op):
+        """addr (0x8XY4): register[F] = carry, written after register[X]"""
+        X = (op >> 8) & 0xF
+        total = self.V[m, X].astype(numpy.int64) + self.V[m, (op >> 4) & 0xF]
+        self.V[m, X] = total & 0xFF
+        self.V[m, 0xF] = total > 0xFF
+        self.PC[m] += 2
+
+    def _op_sub(self, m, op):
+        """sub (0x8XY5): register[F] = not borrow, written after register[X]"""
+        X = (op >> 8) & 0xF
+        diff = self.V[m, X].astype(numpy.int64) - self.V[m, (op >> 4) & 0xF]
+        self.V[m, X] = diff & 0xFF
+        self.V[m, 0xF] = diff >= 0
+        self.PC[m] += 2
+
+    def _op_shr(self, m, op):
+        """shr (0x8X06): register[F] = bit 0, written before the shift"""
+        X = (op >> 8) & 0xF
+        self.V[m, 0xF] = self.V[m, X] & 0x1
+        self.V[m, X] = self.V[m, X] >> 1
+        self.PC[m] += 2
+
+    def _op_rsb(self, m, op):
+        """rsb (0x8XY7): register[F] = not borrow, written after register[X]"""
+        X = (op >> 8) & 0xF
+        diff = self.V[m, (op >> 4) & 0xF].astype(numpy.int64) - self.V[m, X]
+        self.V[m, X] = diff & 0xFF
+        self.V[m, 0xF] = diff >= 0
+        self.PC[m] += 2
+
+    def _op_shl(self, m, op):
+        """shl (0x8X0E): register[F] = bit 7 (as 0x80), written before the
+        shift
+
+        """
+        X = (op >> 8) & 0xF
+        self.V[m, 0xF] = self.V[m, X] & 0x80
+        self.V[m, X] = (self.V[m, X].astype(numpy.int64) << 1) & 0xFF
+        self.PC[m] += 2
+
+    def _op_skner(self, m, op):
+        """skner (0x9XY0)"""
+        equal = self.V[m, (op >> 8) & 0xF] == self.V[m, (op >> 4) & 0xF]
+        self.PC[m] += numpy.where(equal, 2, 4)
+
+    def _op_mvi(self, m, op):
+        """mvi (0xANNN)"""
+        self.I[m] = op & 0xFFF
+        self.PC[m] += 2
+
+    def _op_jmi(self, m, op):
+        """jmi (0xBNNN)"""
+        self.PC[m] = (op & 0xFFF) + self.V[m, 0]
+
+    def _op_rand(self, m, op):
+        """rand (0xCXNN), drawn per machine as Chip8CPU draws"""
+        # int(random() * 256) is what randint(0x0, 0xFF) returns, without
+        # its argument checks
+        draws = self._draws
+        drawn = numpy.array([int(draws[i]() * 256) for i in m], numpy.int64)
+        self.V[m, (op >> 8) & 0xF] = drawn & (op & 0xFF)
+        self.PC[m] += 2
+
+    def _op_sprite(self, m, op):
+        """sprite (0xDXYN): 8xN sprite (8x16 for N = 0), clipped at the
+        screen edges, register[F] = collision
+
+        """
+        X = (op >> 8) & 0xF
+        x = self.V[m, X].astype(numpy.int64)
+        y = self.V[m, (op >> 4) & 0xF].astype(numpy.int64)
+        rows = op & 0xF
+        rows[rows == 0] = 16
+
+        # Rows past the end of memory are dropped, like a short slice
+        offsets = numpy.arange(16)
+        address = self.I[m][:, numpy.newaxis] + offsets
+        bits = SPRITE_BITS[self.memory[m[:, numpy.newaxis],
+                                       numpy.minimum(address, 0xFFF)]]
+        visible = (offsets < rows[:, numpy.newaxis]) & (address <= 0xFFF) & \
+            (y[:, numpy.newaxis] + offsets < 32)
+        visible = visible[:, :, numpy.newaxis] & \
+            (x[:, numpy.newaxis, numpy.newaxis] + numpy.arange(8) < 64) & \
+            (bits != 0)
+
+        k, row, column = numpy.nonzero(visible)
+        machines = m[k]
+        py = y[k] + row
+        px = x[k] + column
+        old = self.VRAM[machines, py, px]
+        self.VRAM[machines, py, px] = old ^ 1
+        collision = numpy.bincount(k, weights=old, minlength=len(m)) > 0
+        self.V[m, 0xF] = collision
+        self.PC[m] += 2
+
+    def _op_gdelay(self, m, op):
+        """gdelay (0xFX07)"""
+        self.V[m, (op >> 8) & 0xF] = self.delayTimer[m]
+        self.PC[m] += 2
+
+    def _op_key(self, m, op):
+        """key (0xFX0A): halt until a key is down, then store the last key"""
+        down = self.keys[m].any(axis=1)
+        self.halted[m[~down]] = 1
+        m = m[down]
+        self.V[m, (op[down] >> 8) & 0xF] = self.lastKey[m]
+        self.halted[m] = 0
+        self.PC[m] += 2
+
+    def _op_sdelay(self, m, op):
+        """sdelay (0xFX15)"""
+        self.delayTimer[m] = self.V[m, (op >> 8) & 0xF]
+        self.PC[m] += 2
+
+    def _op_ssound(self, m, op):
+        """ssound (0xFX18)"""
+        self.soundTimer[m] = self.V[m, (op >> 8) & 0xF]
+        self.PC[m] += 2
+
+    def _op_adi(self, m, op):
+        """adi (0xFX1E)"""
+        self.I[m] += self.V[m, (op >> 8) & 0xF]
+        self.PC[m] += 2
+
+    def _op_nfnt(self, m, op):
+        """nfnt (0xFX29)"""
+        self.I[m] = self.V[m, (op >> 8) & 0xF].astype(numpy.int64) * 5
+        self.PC[m] += 2
+
+    def _op_efnt(self, m, op):
+        """SCHIP efnt (0xFX30)"""
+        self.I[m] = 0x50 + self.V[m, (op >> 8) & 0xF].astype(numpy.int64) * 10
+        self.PC[m] += 2
+
+    def _op_bcd(self, m, op):
+        """bcd (0xFX33)"""
+        number = self.V[m, (op >> 8) & 0xF]
+        address = self.I[m]
+        self.memory[m, address & 0xFFF] = number // 100
+        self.memory[m, (address + 1) & 0xFFF] = (number % 100) // 10
+        self.memory[m, (address + 2) & 0xFFF] = number % 10
+        self.PC[m] += 2
+
+    def _op_str(self, m, op):
+        """str (0xFX55)"""
+        X = (op >> 8) & 0xF
+        for i in xrange(X.max() + 1):
+            sel = m[X >= i]
+            self.memory[sel, (self.I[sel] + i) & 0xFFF] = self.V[sel, i]
+        self.PC[m] += 2
+
+    def _op_ldr(self, m, op):
+        """ldr (0xFX65)"""
+        X = (op >> 8) & 0xF
+        for i in xrange(X.max() + 1):
+            sel = m[X >= i]
+            self.V[sel, i] = self.memory[sel, (self.I[sel] + i) & 0xFFF]
+        self.PC[m] += 2
+
+    def _op_shpf(self, m, op):
+        """SCHIP shpf (0xFX75)"""
+        X = (op >> 8) & 0xF
+        overflow = X >= 8
+        self.faulted[m[overflow]] = True
+        for i in xrange(8):
+            sel = m[(X >= i) & ~overflow]
+            self.hp48Flags[sel, i] = self.V[sel, i]
+        self.PC[m[~overflow]] += 2
+
+    def _op_lhpf(self, m, op):
+        """SCHIP lhpf (0xFX85)"""
+        X = (op >> 8) & 0xF
+        overflow = X >= 8
+        self.faulted[m[overflow]] = True
+        for i in xrange(8):
+            sel = m[(X >= i) & ~overflow]
+            self.V[sel, i] = self.hp48Flags[sel, i]
+        self.PC[m[~overflow]] += 2
@@ -1,13 +1,94 @@
-from random import randint
+import csv
+import random
+import struct
+import timeit
+
+import numpy
+
+# Font data, loaded at memory[0x00 : 0xF0]
+FONT = [
+    # 8x5 font data
+    0xF0, 0x90, 0x90, 0x90, 0xF0, # 0
+    0x60, 0x20, 0x20, 0x20, 0xF0,
+    0xF0, 0x10, 0xF0, 0x80, 0xF0,
+    0xF0, 0x10, 0xF0, 0x10, 0xF0,
+    0x90, 0x90, 0xF0, 0x10, 0x10,
+    0xF0, 0x80, 0xF0, 0x10, 0xF0,
+    0xF0, 0x80, 0xF0, 0x90, 0xF0,
+    0xF0, 0x10, 0x10, 0x10, 0x10,
+    0xF0, 0x90, 0xF0, 0x90, 0xF0,
+    0xF0, 0x90, 0xF0, 0x10, 0x10,
+    0xF0, 0x90, 0xF0, 0x90, 0x90, # A
+    0xC0, 0xA0, 0xC0, 0xA0, 0xC0,
+    0xF0, 0x80, 0x80, 0x80, 0xF0,
+    0xC0, 0xA0, 0xA0, 0xA0, 0xC0,
+    0xF0, 0x80, 0xF0, 0x80, 0xF0,
+    0xF0, 0x80, 0xC0, 0x80, 0x80,
+    
+    # 16x10 font data (taken from David Winter's documentation)
+    0xF0, 0xF0, 0x90, 0x90, 0x90, 0x90, 0x90, 0x90, 0xF0, 0xF0, # 0
+    0x20, 0x20, 0x60, 0x60, 0x20, 0x20, 0x20, 0x20, 0x70, 0x70,
+    0xF0, 0xF0, 0x10, 0x10, 0xF0, 0xF0, 0x80, 0x80, 0xF0, 0xF0,
+    0xF0, 0xF0, 0x10, 0x10, 0xF0, 0xF0, 0x10, 0x10, 0xF0, 0xF0,
+    0x90, 0x90, 0x90, 0x90, 0xF0, 0xF0, 0x10, 0x10, 0x10, 0x10,
+    0xF0, 0xF0, 0x80, 0x80, 0xF0, 0xF0, 0x10, 0x10, 0xF0, 0xF0,
+    0xF0, 0xF0, 0x80, 0x80, 0xF0, 0xF0, 0x90, 0x90, 0xF0, 0xF0,
+    0xF0, 0xF0, 0x10, 0x10, 0x20, 0x20, 0x40, 0x40, 0x40, 0x40,
+    0xF0, 0xF0, 0x90, 0x90, 0xF0, 0xF0, 0x90, 0x90, 0xF0, 0xF0,
+    0xF0, 0xF0, 0x90, 0x90, 0xF0, 0xF0, 0x10, 0x10, 0xF0, 0xF0,
+    0xF0, 0xF0, 0x90, 0x90, 0xF0, 0xF0, 0x90, 0x90, 0x90, 0x90, # A
+    0xE0, 0xE0, 0x90, 0x90, 0xE0, 0xE0, 0x90, 0x90, 0xE0, 0xE0,
+    0xF0, 0xF0, 0x80, 0x80, 0x80, 0x80, 0x80, 0x80, 0xF0, 0xF0,
+    0xE0, 0xE0, 0x90, 0x90, 0x90, 0x90, 0x90, 0x90, 0xE0, 0xE0,
+    0xF0, 0xF0, 0x80, 0x80, 0xF0, 0xF0, 0x80, 0x80, 0xF0, 0xF0,
+    0xF0, 0xF0, 0x80, 0x80, 0xF0, 0xF0, 0x80, 0x80, 0x80, 0x80,
+]
+
+# Row of 8 pixels for every sprite byte, most significant bit first
+SPRITE_BITS = numpy.unpackbits(
+    numpy.arange(256, dtype=numpy.uint8)[:, numpy.newaxis], axis=1)
+
+# Save state layout, version 2 (little endian): a fixed header followed by
+# the VRAM packed 8 pixels per byte (room for 128x64) and the memory.
+# Header: magic, version, display mode, halt status, PC, address register,
+# stack pointer, delay timer, sound timer, keypad bit mask, 16 registers,
+# 16 stack entries, 8 HP48 flags. The stack pointer is signed, a return on
+# an empty stack leaves it negative.
+STATE_MAGIC = 'C8ST'
+STATE_VERSION = 2
+_STATE_HEADER = struct.Struct('<4sBBBHHbhhH16B16H8B')
+STATE_VRAM_OFFSET = _STATE_HEADER.size
+STATE_VRAM_SIZE = 128 * 64 // 8
+STATE_MEMORY_OFFSET = STATE_VRAM_OFFSET + STATE_VRAM_SIZE
+STATE_MEMORY_SIZE = 0x1000
+STATE_SIZE = STATE_MEMORY_OFFSET + STATE_MEMORY_SIZE
+
+# Idle loop detection (see runCycles): fewest instructions left for a
+# loop to be worth checking, longest loop iteration and most instructions
+# run looking for a repeating loop state
+IDLE_MIN_BUDGET = 32
+IDLE_MAX_LOOP = 16
+IDLE_MAX_SCAN = 256
+
+# Longest instruction sequence runCycles runs in one dispatch (see _fuse).
+# The fused sequences are the most frequent ones over chipy8/games, as
+# counted by chipy8/fusion.py: a skip then a jump, FX07, 6XNN or 7XNN then
+# a skip (then a jump), ANNN then FX1E and ANNN then DXYN.
+FUSE_MAX_LENGTH = 3
+
+# Dispatch tables swapped for instrumented copies while profiling
+_OPTABLES = ('_optable_main', '_optable_0_E', '_optable_0_F', '_optable_8',
+             '_optable_E', '_optable_F')
 
 class Chip8CPU:
-    def __init__(self, gamepad, canvas, filename):
+    def __init__(self, gamepad, canvas, filename, seed=None):
         """Initialize a chip8 CPU by passing in its gamepad, canvas and a ROM
-        filename.
+        filename. seed seeds the CPU's own random number generator.
         
         """
         self._gamepad = gamepad
         self._canvas = canvas
+        self._random = random.Random(seed)
         
         # Initialize memory with font data and pad to ROM accessible area.
         self._initMemory()
@@ -16,6 +97,14 @@ class Chip8CPU:
         # Pad to the end of memory
         self._padMemory(0xFFF)
         
+        # VRAM arrays keyed by (width, height), allocated once per mode
+        self._VRAMBuffers = {}
+        
+        # Handler name -> [executions, seconds], and the plain dispatch
+        # tables while profiling is on
+        self._profile = {}
+        self._plainOptables = None
+        
         # Initialize registers, stack pointer etc
         self._resetSystem()
         
@@ -84,10 +173,93 @@ class Chip8CPU:
             0x85: self._op_lhpf,
         }
         
+        # Handlers that only read registers, keys, the delay timer or
+        # memory and only write registers, the address register or PC.
+        # Loops made of them can be fast-forwarded.
+        self._pureHandlers = set([
+            self._op_jmp, self._op_skeq, self._op_skne, self._op_sker,
+            self._op_mov, self._op_add, self._op_movr, self._op_or,
+            self._op_and, self._op_xor, self._op_addr, self._op_sub,
+            self._op_shr, self._op_rsb, self._op_shl, self._op_skner,
+            self._op_mvi, self._op_skpr, self._op_skup, self._op_gdelay,
+            self._op_adi, self._op_nfnt, self._op_efnt,
+            self._op_ldr
+        ])
+        
+        # Skip handler -> (whether it tests a key, whether it skips when the
+        # test is true), for the fused sequences
+        self._skipTests = {
+            self._op_skeq: (False, True),
+            self._op_skne: (False, False),
+            self._op_skpr: (True, True),
+            self._op_skup: (True, False),
+        }
+        
+        # Instructions skipped by runCycles so far
+        self.idleSkipped = 0
+        
+        # Run frequent instruction sequences in one dispatch in runCycles
+        self.fuse = True
+        # Fast-forward idle loops in runCycles
+        self.skipIdle = True
+        
     def nextCycle(self):
         """Reads and executes the next instruction."""
-        instruction = (self._memory[self._PC] << 8) + self._memory[self._PC + 1]
-        self._executeInstruction(instruction)
+        try:
+            handler, self._X, self._Y, self._N, self._NN, self._NNN = \
+                self._decodeCache[self._PC]
+        except KeyError:
+            handler, self._X, self._Y, self._N, self._NN, self._NNN = \
+                self._decode(self._PC)
+        handler()
+    
+    def runCycles(self, count):
+        """Execute up to count instructions and return how many ran. A CPU
+        halted on a key wait (FX0A) stops there and runs nothing until a
+        key is down. Unless skipIdle is off, idle loops, which would repeat
+        exactly until the timers or keys change, are fast-forwarded; the
+        state afterwards is the same as after the same number of
+        nextCycle() calls.
+        
+        """
+        if(self._halted and self._gamepad.keyCount() == 0):
+            return 0
+        nextCycle = self.nextCycle
+        skipIdle = self.skipIdle
+        # The profiler counts handlers, so nothing is fused while it's on
+        if(self.fuse and self._plainOptables is None):
+            fused = self._fusedCache
+        else:
+            fused = None
+        remaining = count
+        while(remaining > 0):
+            PC = self._PC
+            if(fused is None):
+                entry = None
+            else:
+                try:
+                    entry = fused[PC]
+                except KeyError:
+                    entry = self._fuse(PC)
+            if(entry is not None and entry[1] <= remaining):
+                executed = entry[0]()
+                remaining -= executed
+                # Address of the last instruction run
+                PC += 2 * (executed - 1)
+            else:
+                nextCycle()
+                remaining -= 1
+            # Loops close with a jump back (1NNN) or an instruction that
+            # stays put (FX0A, 00FD)
+            if(self._PC <= PC):
+                if(self._halted):
+                    break
+                if(skipIdle and remaining >= IDLE_MIN_BUDGET and
+                   (self._PC == PC or self._memory[PC] >> 4 == 0x1)):
+                    remaining -= self._skipIdle(remaining)
+                    if(self._halted):
+                        break
+        return count - remaining
     
     def getSoundTimer(self):
         """Returns the Chip-8 sound timer."""
@@ -117,78 +289,126 @@ class Chip8CPU:
         self._delayTimer -= 1
     
     def coreDump(self):
-        """Return the CPU program counter, stack, stack pointer, registers,
-        address register, delay timer, sound timer, halt status, keypad status,
-        video mode, video memory, lower bound of any modified memory
-        and the modified memory itself.
+        """Return a snapshot of the CPU as a bytearray in the fixed save state
+        layout: registers, stack, timers, address register, PC, halt status,
+        keypad status, display mode, packed VRAM and memory. The snapshot
+        shares nothing with the CPU.
         
         """
-        tempDump = []
-        
-        # Append simple data
-        tempDump.append(self._PC)
-        tempDump.append(self._stack)
-        tempDump.append(self._stackPointer)
-        tempDump.append(self._register)
-        tempDump.append(self._addressRegister)
-        
-        tempDump.append(self._delayTimer)
-        tempDump.append(self._soundTimer)
-        tempDump.append(self._halted)
-        tempDump.append(self._gamepad.getKeyTable())
-        tempDump.append(self._displayMode)
-        
-        tempDump.append(self._VRAM)
-        
-        # Calculate the lower and upper bounds for modified program memory
-        # (if any)
-        memUpperBound = 0x200
-        memLowerBound = 0x200
-        
-        for i in xrange(0xFFF, 0x200, -1):
-            if(self._memory[i - 1] != 0x00):
-                memUpperBound = i
-                break
-        
-        for i in xrange(0x200, min(memUpperBound, len(self._ROM) + 0x200)):
-            if(self._memory[i] != self._ROM[i - 0x200]):
-                memLowerBound = i
-                break
+        keyTable = self._gamepad.getKeyTable()
+        keyMask = 0
+        for i in xrange(16):
+            if(keyTable[i]):
+                keyMask |= 1 << i
         
-        modifiedProgramMemory = self._memory[memLowerBound : memUpperBound]
-        
-        tempDump.append(memLowerBound)
-        tempDump.append(modifiedProgramMemory)
-        
-        return tempDump
-    
-    def unCoreDump(self, memoryDump):
-        """Accepts a memory dump list and loads it into the CPU."""
+        state = bytearray(STATE_SIZE)
+        _STATE_HEADER.pack_into(state, 0, STATE_MAGIC, STATE_VERSION,
+                                self._displayMode, self._halted, self._PC,
+                                self._addressRegister, self._stackPointer,
+                                self._delayTimer, self._soundTimer, keyMask,
+                                *(self._register + self._stack +
+                                  self._hp48Flags))
+        vram = numpy.packbits(self._VRAM)
+        numpy.frombuffer(state, numpy.uint8, len(vram),
+                         STATE_VRAM_OFFSET)[:] = vram
+        state[STATE_MEMORY_OFFSET : STATE_MEMORY_OFFSET + len(self._memory)] = \
+            self._memory
+        return state
+    
+    def unCoreDump(self, state):
+        """Load a snapshot returned by coreDump into the CPU."""
+        header = _STATE_HEADER.unpack_from(state, 0)
+        if(header[0] != STATE_MAGIC or header[1] != STATE_VERSION):
+            raise ValueError("Not a version %d save state" % STATE_VERSION)
         
+        displayMode, \
+        self._halted, \
         self._PC, \
-        self._stack, \
-        self._stackPointer, \
-        self._register, \
         self._addressRegister, \
+        self._stackPointer, \
         self._delayTimer, \
         self._soundTimer, \
-        self._halted, \
-        keyTable, \
-        displayMode, \
-        VRAM, \
-        memLowerBound, \
-        modifiedProgramMemory = memoryDump
+        keyMask = header[2 : 10]
+        self._register = list(header[10 : 26])
+        self._stack = list(header[26 : 42])
+        self._hp48Flags = list(header[42 : 50])
         
         # Load in the keyTable
-        self._gamepad.setKeyTable(keyTable)
+        self._gamepad.setKeyTable([(keyMask >> i) & 1 for i in xrange(16)])
         # Load in the VRAM after initializing display
         self._setDisplayMode(displayMode)
-        self._VRAM = VRAM
-        # Initialize and load in the program memory
-        self._initMemory()
-        self._loadROM(limit=(memLowerBound - 0x200))
-        self._memory.extend(modifiedProgramMemory)
-        self._padMemory(0xFFF)
+        vram = numpy.frombuffer(state, numpy.uint8, self._VRAM.size // 8,
+                                STATE_VRAM_OFFSET)
+        self._VRAM[:] = numpy.unpackbits(vram).reshape(self._VRAM.shape)
+        # Load in the memory, any decoded instructions are stale
+        view = memoryview(state)
+        self._memory[:] = \
+            view[STATE_MEMORY_OFFSET : STATE_MEMORY_OFFSET + len(self._memory)]
+        self._decodeCache = {}
+        self._fusedCache = {}
+    
+    def enableProfiling(self):
+        """Start (or resume) counting executions and time per opcode
+        handler. The dispatch tables are swapped for instrumented copies, so
+        nothing is paid while profiling is off. Nested table handlers
+        (_op_8_nest, ...) are counted too and their time includes the leaf
+        handler.
+        
+        """
+        if(self._plainOptables is not None):
+            return
+        self._plainOptables = {}
+        for name in _OPTABLES:
+            table = getattr(self, name)
+            self._plainOptables[name] = table
+            setattr(self, name, dict([(key, self._profiled(handler))
+                                      for key, handler in table.items()]))
+        # Cached decodes point at the plain handlers
+        self._decodeCache = {}
+        self._fusedCache = {}
+    
+    def disableProfiling(self):
+        """Restore the plain dispatch tables, keeping the counts."""
+        if(self._plainOptables is None):
+            return
+        for name in _OPTABLES:
+            setattr(self, name, self._plainOptables[name])
+        self._plainOptables = None
+        self._decodeCache = {}
+        self._fusedCache = {}
+    
+    def getProfile(self):
+        """Return (handler name, executions, seconds) per opcode handler,
+        most time first.
+        
+        """
+        rows = [(name, count, seconds)
+                for name, (count, seconds) in self._profile.items() if count]
+        rows.sort(key=lambda row: row[2], reverse=True)
+        return rows
+    
+    def profileTable(self):
+        """Return the profile as a text table."""
+        rows = self.getProfile()
+        total = sum([row[2] for row in rows if not row[0].endswith('_nest')])
+        lines = ["%-16s %10s %10s %9s %6s" %
+                 ('handler', 'count', 'total ms', 'us/call', '%')]
+        for name, count, seconds in rows:
+            lines.append("%-16s %10d %10.2f %9.3f %6.1f" %
+                         (name, count, seconds * 1e3, seconds / count * 1e6,
+                          seconds / max(total, 1e-12) * 100))
+        return '\n'.join(lines)
+    
+    def writeProfileCSV(self, fileObject):
+        """Write the profile as CSV to fileObject."""
+        writer = csv.writer(fileObject)
+        writer.writerow(['handler', 'count', 'seconds'])
+        for row in self.getProfile():
+            writer.writerow(row)
+    
+    def setSeed(self, seed):
+        """Reseed the CPU's random number generator."""
+        self._random.seed(seed)
     
     def reset(self):
         """Reset the CPU"""
@@ -214,6 +434,221 @@ class Chip8CPU:
             self._canvas.setDisplayProperties(64, 32)
             self._displayMode = 0
     
+    def _decode(self, address):
+        """Decode the instruction at address into its leaf handler and
+        operands and store the result in the decode cache.
+        
+        """
+        instruction = (self._memory[address] << 8) + self._memory[address + 1]
+        X = (instruction & 0x0F00) >> 8
+        Y = (instruction & 0x00F0) >> 4
+        N = instruction & 0x000F
+        NN = instruction & 0x00FF
+        NNN = instruction & 0x0FFF
+        
+        # Resolve the nested opcode maps now rather than on every execution.
+        # Anything that can't be resolved keeps its nest handler so that it
+        # behaves exactly as before when executed.
+        handler = self._optable_main[instruction >> 12]
+        try:
+            if(handler == self._op_0_nest):
+                if(Y == 0xC):
+                    handler = self._op_scd
+                elif(Y == 0xE):
+                    handler = self._optable_0_E[NN]
+                elif(Y == 0xF):
+                    handler = self._optable_0_F[NN]
+            elif(handler == self._op_8_nest):
+                handler = self._optable_8[N]
+            elif(handler == self._op_E_nest):
+                handler = self._optable_E[N]
+            elif(handler == self._op_F_nest):
+                handler = self._optable_F[NN]
+        except KeyError:
+            pass
+        
+        entry = (handler, X, Y, N, NN, NNN)
+        self._decodeCache[address] = entry
+        return entry
+    
+    def _profiled(self, handler):
+        """Wrap handler to count its executions and time."""
+        stats = self._profile.setdefault(handler.__name__, [0, 0.0])
+        clock = timeit.default_timer
+        def profiled():
+            start = clock()
+            handler()
+            stats[1] += clock() - start
+            stats[0] += 1
+        return profiled
+    
+    def _skipIdle(self, budget):
+        """Called after a jump back with budget instructions left. Runs the
+        loop at PC one iteration at a time while it only executes pure
+        handlers. Once the registers and address register repeat those at
+        the start of an earlier iteration, whole periods are skipped.
+        Returns the instructions executed or skipped.
+        
+        """
+        head = self._PC
+        pure = self._pureHandlers
+        decodeCache = self._decodeCache
+        # loop state -> instructions executed when it was seen
+        seen = {}
+        count = 0
+        while(count < budget and count < IDLE_MAX_SCAN):
+            state = (tuple(self._register), self._addressRegister)
+            if(state in seen):
+                period = count - seen[state]
+                skip = (budget - count) // period * period
+                self.idleSkipped += skip
+                return count + skip
+            seen[state] = count
+            # Run one iteration, back to head
+            length = 0
+            while(True):
+                entry = decodeCache.get(self._PC)
+                if(entry is None):
+                    entry = self._decode(self._PC)
+                if(count == budget or length == IDLE_MAX_LOOP or
+                   entry[0] not in pure):
+                    # Out of budget, not idle, or leaving the loop
+                    return count
+                handler, self._X, self._Y, self._N, self._NN, self._NNN = entry
+                handler()
+                count += 1
+                length += 1
+                if(self._halted):
+                    # A jump to itself halted the CPU, nothing more runs
+                    return count
+                if(self._PC == head):
+                    break
+        return count
+    
+    def _invalidateDecodeCache(self, address, length):
+        """Drop cached decodes and fused sequences overlapping
+        memory[address : address + length]
+        
+        """
+        for i in xrange(address - 1, address + length):
+            self._decodeCache.pop(i, None)
+        for i in xrange(address - 2 * FUSE_MAX_LENGTH + 1, address + length):
+            self._fusedCache.pop(i, None)
+    
+    def _fuse(self, address):
+        """Return (function, most instructions it runs) for the instruction
+        sequence starting at address, or None if it isn't one that is
+        fused, and cache it. The function runs the sequence exactly as
+        nextCycle() would, following any skip inside it, and returns how
+        many instructions ran. Sequences are only fused by their first
+        address, a jump or skip into the middle of one runs from there one
+        instruction at a time.
+        
+        """
+        entries = []
+        for i in xrange(address, min(address + 2 * FUSE_MAX_LENGTH,
+                                     len(self._memory) - 1), 2):
+            entry = self._decodeCache.get(i)
+            if(entry is None):
+                entry = self._decode(i)
+            entries.append(entry)
+        entries.extend([(None, 0, 0, 0, 0, 0)] *
+                       (FUSE_MAX_LENGTH - len(entries)))
+        first, second, third = entries
+        skips = self._skipTests
+        # A jump to itself ends emulation, which is left to _op_jmp
+        jump = third[0] == self._op_jmp and third[5] != address + 4
+        fused = None
+        if(first[0] == self._op_mvi and second[0] == self._op_adi):
+            fused = self._fusedIndex(address, first[5], second[1]), 2
+        elif(first[0] == self._op_mvi and second[0] == self._op_sprite):
+            fused = self._fusedSprite(address, first[5], second[1 : ]), 2
+        elif(first[0] in (self._op_mov, self._op_add, self._op_gdelay) and
+             second[0] in skips):
+            if(jump):
+                fused = self._fusedSetAndSkip(address, first, second,
+                                              skips[second[0]], third[5]), 3
+            else:
+                fused = self._fusedSetAndSkip(address, first, second,
+                                              skips[second[0]], None), 2
+        elif(first[0] in skips and second[0] == self._op_jmp and
+             second[5] != address + 2):
+            fused = self._fusedBranch(address, first, skips[first[0]],
+                                      second[5]), 2
+        self._fusedCache[address] = fused
+        return fused
+    
+    def _fusedBranch(self, address, skip, test, target):
+        """Fuse a skip at address over a jump to target: one or two
+        instructions. test is (key test, skip when the test is true).
+        
+        """
+        X, NN = skip[1], skip[4]
+        key, equal = test
+        gamepad = self._gamepad
+        def branch():
+            if(key):
+                taken = bool(gamepad.keyIsDown(self._register[X])) == equal
+            else:
+                taken = (self._register[X] == NN) == equal
+            if(taken):
+                self._PC = address + 4
+                return 1
+            self._PC = target
+            return 2
+        return branch
+    
+    def _fusedSetAndSkip(self, address, load, skip, test, target):
+        """Fuse 6XNN, 7XNN or FX07 at address, a skip and, unless target is
+        None, a jump to target: two or three instructions.
+        
+        """
+        handler, X, NN = load[0], load[1], load[4]
+        mode = (self._op_mov, self._op_add, self._op_gdelay).index(handler)
+        skipX, skipNN = skip[1], skip[4]
+        key, equal = test
+        gamepad = self._gamepad
+        def setAndSkip():
+            register = self._register
+            if(mode == 0):
+                register[X] = NN
+            elif(mode == 1):
+                register[X] = (register[X] + NN) & 0xFF
+            else:
+                register[X] = self._delayTimer
+            if(key):
+                taken = bool(gamepad.keyIsDown(register[skipX])) == equal
+            else:
+                taken = (register[skipX] == skipNN) == equal
+            if(taken):
+                self._PC = address + 6
+                return 2
+            if(target is None):
+                self._PC = address + 4
+                return 2
+            self._PC = target
+            return 3
+        return setAndSkip
+    
+    def _fusedIndex(self, address, NNN, X):
+        """Fuse ANNN at address and FX1E"""
+        def index():
+            self._addressRegister = NNN + self._register[X]
+            self._PC = address + 4
+            return 2
+        return index
+    
+    def _fusedSprite(self, address, NNN, operands):
+        """Fuse ANNN at address and DXYN, drawn by _op_sprite"""
+        X, Y, N, NN, sNNN = operands
+        def sprite():
+            self._addressRegister = NNN
+            self._PC = address + 2
+            self._X, self._Y, self._N, self._NN, self._NNN = X, Y, N, NN, sNNN
+            self._op_sprite()
+            return 2
+        return sprite
+    
     def _executeInstruction(self, instruction):
         """Execute an instruction."""
         # Store some common bit masks
@@ -228,50 +663,19 @@ class Chip8CPU:
     def _initMemory(self):
         """Initialize the system memory with font data and pad to 0x200."""
         # Load the font data into memory[0x00 : 0xF0]
-        self._memory = [
-            # 8x5 font data
-            0xF0, 0x90, 0x90, 0x90, 0xF0, # 0
-            0x60, 0x20, 0x20, 0x20, 0xF0,
-            0xF0, 0x10, 0xF0, 0x80, 0xF0,
-            0xF0, 0x10, 0xF0, 0x10, 0xF0,
-            0x90, 0x90, 0xF0, 0x10, 0x10,
-            0xF0, 0x80, 0xF0, 0x10, 0xF0,
-            0xF0, 0x80, 0xF0, 0x90, 0xF0,
-            0xF0, 0x10, 0x10, 0x10, 0x10,
-            0xF0, 0x90, 0xF0, 0x90, 0xF0,
-            0xF0, 0x90, 0xF0, 0x10, 0x10,
-            0xF0, 0x90, 0xF0, 0x90, 0x90, # A
-            0xC0, 0xA0, 0xC0, 0xA0, 0xC0,
-            0xF0, 0x80, 0x80, 0x80, 0xF0,
-            0xC0, 0xA0, 0xA0, 0xA0, 0xC0,
-            0xF0, 0x80, 0xF0, 0x80, 0xF0,
-            0xF0, 0x80, 0xC0, 0x80, 0x80,
-            
-            # 16x10 font data (taken from David Winter's documentation)
-            0xF0, 0xF0, 0x90, 0x90, 0x90, 0x90, 0x90, 0x90, 0xF0, 0xF0, # 0
-            0x20, 0x20, 0x60, 0x60, 0x20, 0x20, 0x20, 0x20, 0x70, 0x70,
-            0xF0, 0xF0, 0x10, 0x10, 0xF0, 0xF0, 0x80, 0x80, 0xF0, 0xF0,
-            0xF0, 0xF0, 0x10, 0x10, 0xF0, 0xF0, 0x10, 0x10, 0xF0, 0xF0,
-            0x90, 0x90, 0x90, 0x90, 0xF0, 0xF0, 0x10, 0x10, 0x10, 0x10,
-            0xF0, 0xF0, 0x80, 0x80, 0xF0, 0xF0, 0x10, 0x10, 0xF0, 0xF0,
-            0xF0, 0xF0, 0x80, 0x80, 0xF0, 0xF0, 0x90, 0x90, 0xF0, 0xF0,
-            0xF0, 0xF0, 0x10, 0x10, 0x20, 0x20, 0x40, 0x40, 0x40, 0x40,
-            0xF0, 0xF0, 0x90, 0x90, 0xF0, 0xF0, 0x90, 0x90, 0xF0, 0xF0,
-            0xF0, 0xF0, 0x90, 0x90, 0xF0, 0xF0, 0x10, 0x10, 0xF0, 0xF0,
-            0xF0, 0xF0, 0x90, 0x90, 0xF0, 0xF0, 0x90, 0x90, 0x90, 0x90, # A
-            0xE0, 0xE0, 0x90, 0x90, 0xE0, 0xE0, 0x90, 0x90, 0xE0, 0xE0,
-            0xF0, 0xF0, 0x80, 0x80, 0x80, 0x80, 0x80, 0x80, 0xF0, 0xF0,
-            0xE0, 0xE0, 0x90, 0x90, 0x90, 0x90, 0x90, 0x90, 0xE0, 0xE0,
-            0xF0, 0xF0, 0x80, 0x80, 0xF0, 0xF0, 0x80, 0x80, 0xF0, 0xF0,
-            0xF0, 0xF0, 0x80, 0x80, 0xF0, 0xF0, 0x80, 0x80, 0x80, 0x80,
-        ]
+        self._memory = bytearray(FONT)
         
         # Pad up to program memory
         self._padMemory(0x200)
+        
+        # Decoded instructions keyed by address
+        self._decodeCache = {}
+        # Fused sequences keyed by address of their first instruction
+        self._fusedCache = {}
     
     def _padMemory(self, endOffset):
         """Pad the program memory with zeros to the specified offset."""
-        self._memory.extend([0x0] * (endOffset - len(self._memory)))
+        self._memory.extend(bytearray(endOffset - len(self._memory)))
     
     def _resetSystem(self):
         """Reset timers, registers and bit masks"""
@@ -296,21 +700,14 @@ class Chip8CPU:
         self._NN = 0x00
         self._NNN = 0x000
     
-    def _loadROM(self, fileName=None, limit=None):
+    def _loadROM(self, fileName=None):
         """Load a ROM file into program memory."""
         if(fileName is not None):
             fh = open(fileName, 'rb')
-            romString = fh.read()
+            self._ROM = bytearray(fh.read())
             fh.close()
-            # Explode the string, then convert each element to a hex value
-            self._ROM = map(ord, list(romString))
         
-        # Only a portion of the ROM may need to be loaded if a core dump file
-        # being loaded into the CPU.
-        if(limit is not None):
-            self._memory.extend(self._ROM[ : limit])
-        else:
-            self._memory.extend(self._ROM)
+        self._memory.extend(self._ROM)
     
     def _stackPop(self):
         """Pop the stack."""
@@ -325,12 +722,16 @@ class Chip8CPU:
     def _initVRAM(self, dimensions):
         """Store the VRAM dimensions and clear the VRAM."""
         self._VRAMX, self._VRAMY = dimensions
+        key = (self._VRAMX, self._VRAMY)
+        if(key not in self._VRAMBuffers):
+            self._VRAMBuffers[key] = numpy.zeros((self._VRAMY, self._VRAMX),
+                                                 numpy.uint8)
+        self._VRAM = self._VRAMBuffers[key]
         self._clearVRAM()
     
     def _clearVRAM(self):
         """Fill the VRAM with zeros."""
-        self._VRAM = []
-        self._VRAM = [[0x0] * self._VRAMX for i in xrange(self._VRAMY)]
+        self._VRAM.fill(0)
     
     def _op_0_nest(self):
         """Nested opcode map for opcodes in the 0x0 range"""
@@ -356,9 +757,9 @@ class Chip8CPU:
     
     def _op_scd(self):
         """OPCODE SCHIP scd (0x00CN): Scroll the screen down N lines"""
-        oldVRAM = self._VRAM
-        self._clearVRAM()   
-        self._VRAM[self._N : ] = oldVRAM[ : -self._N]
+        if(self._N != 0):
+            self._VRAM[self._N : ] = self._VRAM[ : -self._N]
+            self._VRAM[ : self._N] = 0
         self._PC += 2
     
     def _op_scr(self):
@@ -367,11 +768,9 @@ class Chip8CPU:
             pixelCount = 4
         else:
             pixelCount = 2
-            
-        for y in xrange(self._VRAMY):
-            newVRAM = [0x0] * pixelCount
-            newVRAM.extend(self._VRAM[y][ : -pixelCount])
-            self._VRAM[y] = newVRAM
+        
+        self._VRAM[:, pixelCount : ] = self._VRAM[:, : -pixelCount]
+        self._VRAM[:, : pixelCount] = 0
         self._PC += 2
     
     def _op_scl(self):
@@ -380,11 +779,9 @@ class Chip8CPU:
             pixelCount = 4
         else:
             pixelCount = 2
-            
-        for y in xrange(self._VRAMY):
-            newVRAM = self._VRAM[y][pixelCount : self._VRAMX]
-            newVRAM.extend([0x0] * pixelCount)
-            self._VRAM[y] = newVRAM
+        
+        self._VRAM[:, : -pixelCount] = self._VRAM[:, pixelCount : ]
+        self._VRAM[:, -pixelCount : ] = 0
         self._PC += 2
     
     def _op_end(self):
@@ -561,7 +958,7 @@ class Chip8CPU:
         
         """
         self._register[0xF] = self._register[self._X] & 0x80
-        self._register[self._X] = self._register[self._X] << 1
+        self._register[self._X] = (self._register[self._X] << 1) & 0xFF
         self._PC += 2
     
     def _op_skner(self):
@@ -581,14 +978,14 @@ class Chip8CPU:
     
     def _op_jmi(self):
         """OPCODE jmi(0xBNNN): Jump to NNN + register[0]"""
-        self._PC = _NNN + self._register[0x0]
+        self._PC = self._NNN + self._register[0x0]
     
     def _op_rand(self):
         """OPCODE rand (0xCXNN): Generate a random number anded with NN
         and store it in register[X]
         
         """
-        self._register[self._X] = randint(0x0, 0xFF) & self._NN
+        self._register[self._X] = self._random.randint(0x0, 0xFF) & self._NN
         self._PC += 2
     
     def _op_sprite(self):
@@ -598,7 +995,7 @@ class Chip8CPU:
         
         """
         x = self._register[self._X]
-        y = self._register[self._Y]        
+        y = self._register[self._Y]
         address = self._addressRegister
         self._register[0xF] = 0
         
@@ -606,66 +1003,23 @@ class Chip8CPU:
             self._N = 16
         
         if(self._N != 0):
-            # Normal-sized sprite
-            for i in xrange(self._N):
-                spriteRow = self._memory[address]
-                currY = (y + i)
-                
-                # currY %= self._VRAMY
-                # Ignore if not within screen Y range
-                if(currY < 0 or currY >= self._VRAMY):
-                    continue
-                
-                for j in xrange(8):               
-                    currBit = (spriteRow >> (7 - j)) & 0x01
-                    currX = (x + j)
-                    # currX %= self._VRAMX
-                    # Ignore if not within screen X range
-                    if(currX < 0 or currX >= self._VRAMX):
-                        continue
-                    
-                    #Ignore if bit is not set
-                    if(currBit == 0):
-                        continue
-                    
-                    if(self._VRAM[currY][currX]):
-                        self._register[0xF] = 1
-                        self._VRAM[currY][currX] = 0
-                    else:
-                        self._VRAM[currY][currX] = 1
-                # Go to the next byte
-                address += 1 
+            # Normal-sized sprite, one byte per row
+            data = self._memory[address : address + self._N]
+            bits = SPRITE_BITS[numpy.array(data, numpy.uint8)]
         else:
-            # 16x16 sprite
-            for i in xrange(16):
-                spriteRow = (self._memory[address] << 8) + \
-                                self._memory[address + 1]
-                currY = (y + i)
-                
-                # Ignore if not within screen Y range
-                if(currY < 0 or currY >= self._VRAMY):
-                    continue
-                
-                for j in xrange(16):
-                    currBit = (spriteRow >> (15 - j)) & 0x01
-                    currX = (x + j)
-                    
-                    # Ignore if not within screen X range
-                    if(currX < 0 or currX >= self._VRAMX):
-                        continue
-                    
-                     #Ignore if bit is not set
-                    if(currBit == 0):
-                        continue
-                    
-                    if(self._VRAM[currY][currX]):
-                        self._register[0xF] = 1
-                        self._VRAM[currY][currX] = 0
-                    else:
-                        self._VRAM[currY][currX] = 1
-                    
-                # Go to the next byte
-                address += 2 
+            # 16x16 sprite, two bytes per row
+            data = self._memory[address : address + 32]
+            bits = SPRITE_BITS[numpy.array(data, numpy.uint8)].reshape(-1, 16)
+        
+        # Pixels outside the screen are clipped
+        height = min(bits.shape[0], self._VRAMY - y)
+        width = min(bits.shape[1], self._VRAMX - x)
+        if(height > 0 and width > 0):
+            bits = bits[ : height, : width]
+            region = self._VRAM[y : y + height, x : x + width]
+            if(numpy.any(region & bits)):
+                self._register[0xF] = 1
+            region ^= bits
         self._PC += 2
     
     def _op_skpr(self):
@@ -741,6 +1095,7 @@ class Chip8CPU:
         self._memory[address] =  number // 100
         self._memory[address + 1] = (number % 100) // 10
         self._memory[address + 2] = number % 10
+        self._invalidateDecodeCache(address, 3)
         self._PC += 2
     
     def _op_str(self):
@@ -749,6 +1104,7 @@ class Chip8CPU:
         for i in xrange(self._X + 1):
             self._memory[address] = self._register[i]
             address += 1
+        self._invalidateDecodeCache(self._addressRegister, self._X + 1)
         self._PC += 2
     
     def _op_ldr(self):